@@ -0,0 +1,52 @@
+# Created by Homme Zwaagstra
+# 
+# Copyright (c) 2010 GeoData Institute
+# http://www.geodata.soton.ac.uk
+# geodata@soton.ac.uk
+# 
+# Unless explicitly acquired and licensed from Licensor under another
+# license, the contents of this file are subject to the Reciprocal
+# Public License ("RPL") Version 1.5, or subsequent versions as
+# allowed by the RPL, and You may not copy or use this file in either
+# source code or executable form, except in compliance with the terms
+# and conditions of the RPL.
+# 
+# All software distributed under the RPL is provided strictly on an
+# "AS IS" basis, WITHOUT WARRANTY OF ANY KIND, EITHER EXPRESS OR
+# IMPLIED, AND LICENSOR HEREBY DISCLAIMS ALL SUCH WARRANTIES,
+# INCLUDING WITHOUT LIMITATION, ANY WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE, QUIET ENJOYMENT, OR
+# NON-INFRINGEMENT. See the RPL for specific language governing rights
+# and limitations under the RPL.
+# 
+# You can obtain a full copy of the RPL from
+# http://opensource.org/licenses/rpl1.5.txt or geodata@soton.ac.uk
+__version__ = 0.1
+
+import argparse
+import logging
+import sqlite3
+from os.path import abspath
+from medin.spatial import index_areas
+
+def main():
+    """
+    Index the areas in the portal database
+    """
+
+    parser = argparse.ArgumentParser(description='Create the spatial and name indexes for the areas in the portal SQLite database.')
+    parser.add_argument('file', metavar='FILE', nargs=1,
+                        help='The portal SQLite database file to update')
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+    filename = abspath(args.file[0])
+
+    db = sqlite3.connect(filename)
+    try:
+        index_areas(db)
+        logging.info('indexed the areas in %s', filename)
+    finally:
+        db.close()
+
+if __name__ == '__main__':
+    main()
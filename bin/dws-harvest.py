@@ -0,0 +1,58 @@
+# Created by Homme Zwaagstra
+# 
+# Copyright (c) 2010 GeoData Institute
+# http://www.geodata.soton.ac.uk
+# geodata@soton.ac.uk
+# 
+# Unless explicitly acquired and licensed from Licensor under another
+# license, the contents of this file are subject to the Reciprocal
+# Public License ("RPL") Version 1.5, or subsequent versions as
+# allowed by the RPL, and You may not copy or use this file in either
+# source code or executable form, except in compliance with the terms
+# and conditions of the RPL.
+# 
+# All software distributed under the RPL is provided strictly on an
+# "AS IS" basis, WITHOUT WARRANTY OF ANY KIND, EITHER EXPRESS OR
+# IMPLIED, AND LICENSOR HEREBY DISCLAIMS ALL SUCH WARRANTIES,
+# INCLUDING WITHOUT LIMITATION, ANY WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE, QUIET ENJOYMENT, OR
+# NON-INFRINGEMENT. See the RPL for specific language governing rights
+# and limitations under the RPL.
+# 
+# You can obtain a full copy of the RPL from
+# http://opensource.org/licenses/rpl1.5.txt or geodata@soton.ac.uk
+__version__ = 0.1
+
+import argparse
+import logging
+from os.path import abspath
+from medin.dws import default_wsdl, DWSError
+from medin.mirror import Harvester
+
+def main():
+    """
+    Update the local mirror of the DWS records
+    """
+
+    parser = argparse.ArgumentParser(description='Harvest the Discovery Web Service records into the local search index.')
+    parser.add_argument('--full', action='store_true',
+                        help='Harvest every record, removing those no longer in the DWS (by default only changed records are harvested)')
+    parser.add_argument('--wsdl', metavar='FILE', default=default_wsdl(),
+                        help='The DWS WSDL file (defaults to the WSDL distributed with the portal)')
+    parser.add_argument('file', metavar='FILE', nargs=1,
+                        help='The SQLite database file to update')
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+    filename = abspath(args.file[0])
+
+    try:
+        harvester = Harvester(filename, logging.getLogger(), wsdl=abspath(args.wsdl))
+        changed = harvester.harvest(args.full)
+        logging.info('Finished: %d records changed', changed)
+    except DWSError, e:
+        logging.error('The harvest failed: %s', str(e))
+    except KeyboardInterrupt:
+        logging.warn("Interrupted!")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,109 @@
+# Created by Homme Zwaagstra
+# 
+# Copyright (c) 2010 GeoData Institute
+# http://www.geodata.soton.ac.uk
+# geodata@soton.ac.uk
+# 
+# Unless explicitly acquired and licensed from Licensor under another
+# license, the contents of this file are subject to the Reciprocal
+# Public License ("RPL") Version 1.5, or subsequent versions as
+# allowed by the RPL, and You may not copy or use this file in either
+# source code or executable form, except in compliance with the terms
+# and conditions of the RPL.
+# 
+# All software distributed under the RPL is provided strictly on an
+# "AS IS" basis, WITHOUT WARRANTY OF ANY KIND, EITHER EXPRESS OR
+# IMPLIED, AND LICENSOR HEREBY DISCLAIMS ALL SUCH WARRANTIES,
+# INCLUDING WITHOUT LIMITATION, ANY WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE, QUIET ENJOYMENT, OR
+# NON-INFRINGEMENT. See the RPL for specific language governing rights
+# and limitations under the RPL.
+# 
+# You can obtain a full copy of the RPL from
+# http://opensource.org/licenses/rpl1.5.txt or geodata@soton.ac.uk
+
+__version__ = 0.1
+
+import argparse
+import logging
+import os.path
+from ConfigParser import SafeConfigParser
+from medin import cache
+from medin.cache import MemoryCache
+from medin.mirror import record_bboxes
+from medin.spatial import ExtentRenderer
+
+def extent_mapfile(root):
+    """
+    Render the metadata extent mapfile as the portal does
+    """
+    from mako.lookup import TemplateLookup
+
+    lookup = TemplateLookup(directories=[os.path.join(root, 'templates')],
+                            input_encoding='utf-8',
+                            output_encoding='utf-8')
+    template = lookup.get_template(os.path.join('config', 'metadata-extent.xml'))
+    return template.render(root_dir=root)
+
+def main():
+    """
+    Render the metadata extent images into the portal extent cache
+    """
+
+    parser = argparse.ArgumentParser(description='Pre-render the metadata extent images of the records in the local mirror into the portal extent cache.')
+    parser.add_argument('--force', action='store_true',
+                        help='Render every image, including those already in the cache')
+    parser.add_argument('--mirror', metavar='FILE',
+                        help='The local mirror SQLite database (defaults to data/mirror.sqlite)')
+    parser.add_argument('root', metavar='DIR', nargs=1,
+                        help='The portal root directory')
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+    root = os.path.abspath(args.root[0])
+
+    config = SafeConfigParser()
+    config.read([os.path.join(root, 'etc', 'portal.ini')])
+
+    if args.mirror:
+        mirror = os.path.abspath(args.mirror)
+    elif config.has_option('search_index', 'path'):
+        mirror = config.get('search_index', 'path')
+    else:
+        mirror = os.path.join(root, 'data', 'mirror.sqlite')
+
+    if not os.path.exists(mirror):
+        parser.error('The local mirror does not exist: %s' % mirror)
+
+    # the background raster is created by the portal itself as it
+    # refers to the portal WMS
+    if not os.path.exists(os.path.join(root, 'tmp', 'background-wms.xml')):
+        parser.error('The background raster has not been created: request a metadata image from the portal first')
+
+    extent_cache = cache.from_config(config, 'extent_cache', root, backend='disk')
+    if extent_cache is None or isinstance(extent_cache, MemoryCache):
+        parser.error('The extent cache must use the disk or memcached backend')
+
+    renderer = ExtentRenderer(extent_mapfile(root))
+    rendered = skipped = 0
+    try:
+        for gid, bboxes in record_bboxes(mirror):
+            if not args.force and extent_cache.get(renderer.key(bboxes)) is not None:
+                skipped += 1
+                continue
+
+            try:
+                extent_cache.set(renderer.key(bboxes), renderer.image(bboxes).tostring('png'))
+            except Exception, e:
+                logging.error('The image for %s could not be rendered: %s', gid, str(e))
+                continue
+
+            rendered += 1
+            if not rendered % 100:
+                logging.info('rendered %d images', rendered)
+    except KeyboardInterrupt:
+        logging.warn("Interrupted!")
+
+    logging.info('Finished: %d images rendered, %d already cached', rendered, skipped)
+
+if __name__ == '__main__':
+    main()
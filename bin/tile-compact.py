@@ -0,0 +1,50 @@
+# Created by Homme Zwaagstra
+# 
+# Copyright (c) 2010 GeoData Institute
+# http://www.geodata.soton.ac.uk
+# geodata@soton.ac.uk
+# 
+# Unless explicitly acquired and licensed from Licensor under another
+# license, the contents of this file are subject to the Reciprocal
+# Public License ("RPL") Version 1.5, or subsequent versions as
+# allowed by the RPL, and You may not copy or use this file in either
+# source code or executable form, except in compliance with the terms
+# and conditions of the RPL.
+# 
+# All software distributed under the RPL is provided strictly on an
+# "AS IS" basis, WITHOUT WARRANTY OF ANY KIND, EITHER EXPRESS OR
+# IMPLIED, AND LICENSOR HEREBY DISCLAIMS ALL SUCH WARRANTIES,
+# INCLUDING WITHOUT LIMITATION, ANY WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE, QUIET ENJOYMENT, OR
+# NON-INFRINGEMENT. See the RPL for specific language governing rights
+# and limitations under the RPL.
+# 
+# You can obtain a full copy of the RPL from
+# http://opensource.org/licenses/rpl1.5.txt or geodata@soton.ac.uk
+
+__version__ = 0.1
+
+import argparse
+import logging
+from os.path import abspath
+from medin.bundle import Bundle
+
+def main():
+    """
+    Compact the bundles of a tile cache
+    """
+
+    parser = argparse.ArgumentParser(description='Remove the unused tile data from the bundle files of a tile cache.')
+    parser.add_argument('--block', metavar='N', default='128',
+                        help='The rows and columns of tiles in a bundle, as set in the cache configuration (defaults to 128)')
+    parser.add_argument('directory', metavar='DIR', nargs=1,
+                        help='The tile cache directory containing the bundles')
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+
+    cache = Bundle(abspath(args.directory[0]), args.block)
+    saved = cache.compact()
+    logging.info('Finished: %d bytes saved', saved)
+
+if __name__ == '__main__':
+    main()
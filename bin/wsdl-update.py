@@ -0,0 +1,51 @@
+# Created by Homme Zwaagstra
+# 
+# Copyright (c) 2010 GeoData Institute
+# http://www.geodata.soton.ac.uk
+# geodata@soton.ac.uk
+# 
+# Unless explicitly acquired and licensed from Licensor under another
+# license, the contents of this file are subject to the Reciprocal
+# Public License ("RPL") Version 1.5, or subsequent versions as
+# allowed by the RPL, and You may not copy or use this file in either
+# source code or executable form, except in compliance with the terms
+# and conditions of the RPL.
+# 
+# All software distributed under the RPL is provided strictly on an
+# "AS IS" basis, WITHOUT WARRANTY OF ANY KIND, EITHER EXPRESS OR
+# IMPLIED, AND LICENSOR HEREBY DISCLAIMS ALL SUCH WARRANTIES,
+# INCLUDING WITHOUT LIMITATION, ANY WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE, QUIET ENJOYMENT, OR
+# NON-INFRINGEMENT. See the RPL for specific language governing rights
+# and limitations under the RPL.
+# 
+# You can obtain a full copy of the RPL from
+# http://opensource.org/licenses/rpl1.5.txt or geodata@soton.ac.uk
+__version__ = 0.1
+
+import argparse
+import logging
+from os.path import abspath
+from medin.dws import default_wsdl, artifact_path, compile_wsdl
+
+def main():
+    """
+    Pre-parse the Discovery Web Service WSDL
+    """
+
+    parser = argparse.ArgumentParser(description='Parse the Discovery Web Service WSDL and schema into a pickled artifact loaded by the portal at startup.')
+    parser.add_argument('--wsdl', metavar='FILE', default=default_wsdl(),
+                        help='The WSDL file to parse (defaults to the WSDL distributed with the portal)')
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+
+    wsdl = abspath(args.wsdl)
+    artifact = artifact_path(wsdl)
+    try:
+        compile_wsdl(wsdl, artifact)
+        logging.info('written %s', artifact)
+    except KeyboardInterrupt:
+        logging.warn("Interrupted!")
+
+if __name__ == '__main__':
+    main()
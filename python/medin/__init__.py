@@ -180,48 +180,158 @@ class WSGITimer(object):
 
         return self.app(environ, start_response)
 
+def get_config(environ, name):
+    """
+    Return the ConfigParser created from an INI file
+
+    The file must reside in the etc directory of the application root
+    directory. It is only read once: the same instance is shared by
+    everything using the configuration.
+    """
+    global _configs
+
+    try:
+        return _configs[name]
+    except KeyError:
+        pass
+    except NameError:
+        _configs = {}
+
+    import os.path
+    from ConfigParser import SafeConfigParser
+
+    ini_file = os.path.join(environ.root, 'etc', name)
+    try:
+        fp = open(ini_file, 'r')
+    except Exception, e:
+        raise HTTPError('500 Configuration Error', 'the INI file could not be read: %s' % str(e))
+
+    try:
+        config = SafeConfigParser()
+        config.readfp(fp)
+    finally:
+        fp.close()
+
+    _configs[name] = config
+    return config
+
 class Config(object):
     """
     WSGI middleware used to configure an application
 
     This adds a key to the environ dictionary called config that has a
     ConfigParser instance as its value. This instance is created from
-    an INI file whose name is specified in the constructor. This file
-    must reside in the etc directory of the application root
-    directory.
+    an INI file whose name is specified in the constructor using
+    get_config().
     """
 
     def __init__(self, app, name):
         self.app = app
         self.name = name
-        self.config = None
 
     def getConfig(self, environ):
-        if self.config:
-            return self.config
+        return get_config(environ, self.name)
 
-        import os.path
+    def __call__(self, environ, start_response):
+        environ['config'] = self.getConfig(environ)
+
+        # delegate to the wrapped app
+        return self.app(environ, start_response)
+
+class CacheSetup(object):
+    """
+    WSGI middleware used to configure the portal caches
+
+    This also selects whether searches are answered by the DWS or the
+    local search index. The caches are created when the first request
+    is received as the portal root directory is only known from the
+    environ. Cache settings are read from optional sections of the
+    application configuration whose INI file name is specified in the
+    constructor (see get_config()); if the file does not exist the
+    cache defaults are used.
+    """
+
+    def __init__(self, app, name):
+        from threading import Lock
+
+        self.app = app
+        self.name = name
+        self.configured = False
+        self._lock = Lock()
+
+    def configure(self, environ):
         from ConfigParser import SafeConfigParser
+        from medin import dws, mirror, templates, metadata, spatial, cache
 
-        ini_file = os.path.join(environ.root, 'etc', self.name)
         try:
-            fp = open(ini_file, 'r')
-        except Exception, e:
-            raise HTTPError('500 Configuration Error', 'the INI file could not be read: %s' % str(e))
+            config = get_config(environ, self.name)
+        except HTTPError:
+            config = SafeConfigParser() # use the defaults
+
+        dws.set_response_cache(dws.response_cache_from_config(config, environ.root))
+        dws.set_freshness_cache(dws.response_cache_from_config(config, environ.root, 'freshness_cache', 60, 3600))
+        templates.set_page_cache(cache.from_config(config, 'page_cache', environ.root, max_entries=200))
+        metadata.set_metadata_cache(cache.from_config(config, 'metadata_cache', environ.root, max_entries=500))
+        if config.has_option('metadata', 'parser'):
+            metadata.set_parser(config.get('metadata', 'parser'))
+        spatial.set_extent_cache(cache.from_config(config, 'extent_cache', environ.root, backend='disk'))
+        dws.set_search_index(mirror.index_from_config(config, environ.root))
 
+    def __call__(self, environ, start_response):
+        if not self.configured:
+            with self._lock:
+                if not self.configured:
+                    self.configure(environ)
+                    self.configured = True
+
+        # delegate to the wrapped app
+        return self.app(environ, start_response)
+
+class ScopedResult(object):
+    """
+    Wrap a WSGI response iterable, calling a function when it is closed
+    """
+
+    def __init__(self, result, callback):
+        self.result = result
+        self.callback = callback
+
+    def __iter__(self):
+        return iter(self.result)
+
+    def close(self):
         try:
-            self.config = config = SafeConfigParser()
-            config.readfp(fp)
+            if hasattr(self.result, 'close'):
+                self.result.close()
         finally:
-            fp.close()
+            self.callback()
+
+class DatabaseScope(object):
+    """
+    WSGI middleware managing the database connections used by a request
+
+    A medin.db.RequestScope is added to the environ under the key
+    `portal.db-scope`. The connections it holds are returned to their
+    pools as soon as the app has returned: the queries made while
+    setting up a response are memoized, so a streamed response does
+    not hold a connection while it is being sent. A connection that
+    is borrowed again while the response is iterated over is returned
+    once the response has been sent.
+    """
 
-        return config
+    def __init__(self, app):
+        self.app = app
 
     def __call__(self, environ, start_response):
-        environ['config'] = self.getConfig(environ)
+        from medin.db import RequestScope
 
-        # delegate to the wrapped app
-        return self.app(environ, start_response)
+        scope = environ['portal.db-scope'] = RequestScope()
+        try:
+            result = self.app(environ, start_response)
+        finally:
+            scope.close()
+
+        return ScopedResult(result, scope.close)
 
 class EnvironNormalise(object):
     """
@@ -351,10 +461,13 @@ def wsgi_app():
     """
     Return an instance of the Portal's root WSGI application
     """
-    from medin import views
+    from medin import views, dws
     from medin.spatial import tilecache
     from medin.log import WSGILog, ExcludeUserMessageFilter, MakoFormatter
 
+    # load the DWS WSDL model up front rather than on the first request
+    dws.get_pool()
+
     # create the WSGI configuration middleware
     config = WSGIWrapper(Config, 'app', name='portal.ini')
 
@@ -376,6 +489,7 @@ def wsgi_app():
     # must be before the more generic ones.
     application = selector.Selector(consume_path=False)
     application.parser.patterns['id_list'] = r'\w+(,\w+)*'
+    application.parser.patterns['gid_list'] = r'[^/,]+(,[^/,]+)+'
 
     # replace the default 404 handler on the selector
     application.status404 = http404
@@ -385,10 +499,11 @@ def wsgi_app():
 
     # provide the Tile Mapping Service
     application.parser.patterns['tms'] = r'/.*'
-    application.add('/spatial/tms[{req:tms}]', _ANY_=tilecache) # for TMS requests to tilecache
+    application.add('/spatial/tms[{req:tms}]', _ANY_=config(tilecache)) # for TMS requests to tilecache
 
     # provide an API to the areas
     application.add('/spatial/areas/{id:word}/extent.json', GET=views.get_bbox)
+    application.add('/spatial/areas/intersecting.json', GET=views.get_intersecting)
 
     # provide a choice of HTML interfaces between light and full
     app = TemplateChooser(default_template)
@@ -464,6 +579,10 @@ def wsgi_app():
     view = views.SOAPRequest(views.MetadataCSV())
     application.add('/{template}/catalogue/{gid:segment}/csv', GET=view)
 
+    # download several metadata records as XML
+    view = views.SOAPRequest(views.MetadataBatchXML())
+    application.add('/{template}/catalogue/{gids:gid_list}/{format:segment}', GET=view)
+
     # download the metadata as XML
     view = views.SOAPRequest(views.MetadataXML())
     application.add('/{template}/catalogue/{gid:segment}/{format:segment}', GET=view)
@@ -505,6 +624,12 @@ def wsgi_app():
     #scl.addHandler(logging.StreamHandler())
     application = WSGILog(application, logger)
 
+    # set up the caches
+    application = CacheSetup(application, 'portal.ini')
+
+    # release the database connections at the end of each request
+    application = DatabaseScope(application)
+
     # add the Environ configuration middleware
     application = Environ(application)
 
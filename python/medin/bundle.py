@@ -0,0 +1,381 @@
+# Created by Homme Zwaagstra
+#
+# Copyright (c) 2010 GeoData Institute
+# http://www.geodata.soton.ac.uk
+# geodata@soton.ac.uk
+#
+# Unless explicitly acquired and licensed from Licensor under another
+# license, the contents of this file are subject to the Reciprocal
+# Public License ("RPL") Version 1.5, or subsequent versions as
+# allowed by the RPL, and You may not copy or use this file in either
+# source code or executable form, except in compliance with the terms
+# and conditions of the RPL.
+#
+# All software distributed under the RPL is provided strictly on an
+# "AS IS" basis, WITHOUT WARRANTY OF ANY KIND, EITHER EXPRESS OR
+# IMPLIED, AND LICENSOR HEREBY DISCLAIMS ALL SUCH WARRANTIES,
+# INCLUDING WITHOUT LIMITATION, ANY WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE, QUIET ENJOYMENT, OR
+# NON-INFRINGEMENT. See the RPL for specific language governing rights
+# and limitations under the RPL.
+#
+# You can obtain a full copy of the RPL from
+# http://opensource.org/licenses/rpl1.5.txt or geodata@soton.ac.uk
+
+"""
+A TileCache cache packing tiles into bundle files
+
+The Disk cache stores each tile in its own file. Instead, the Bundle
+cache stores the tiles of a layer in a square block of `block` x
+`block` tiles at each zoom level in a single bundle file. A bundle
+starts with an index holding an entry for every tile in the block,
+followed by the tile data. Each index entry is a little endian 64 bit
+integer encoding the offset of the tile data in the file (upper 40
+bits) and its length (lower 24 bits), or zero if the tile is not
+present.
+
+Bundles are read using mmap. Tiles are appended to a bundle under an
+exclusive lock, writing the data before its index entry. Replaced
+tiles leave unused data in the bundle which is removed by compacting
+it: the tiles are copied to a new bundle which replaces the old one.
+"""
+
+import os
+import struct
+from threading import Lock
+
+from TileCache.Cache import Cache
+
+ENTRY = struct.Struct('<Q')
+LENGTH_BITS = 24
+MAX_LENGTH = (1 << LENGTH_BITS) - 1
+
+def index_size(block):
+    return block * block * ENTRY.size
+
+def create(path, block, mode=0644):
+    """
+    Atomically create an empty bundle if it does not exist
+    """
+    from tempfile import mkstemp
+
+    fd, tmppath = mkstemp(dir=os.path.dirname(path), suffix='.tmp')
+    try:
+        os.fchmod(fd, mode)
+        os.ftruncate(fd, index_size(block)) # an index of empty entries
+        os.close(fd)
+        try:
+            os.link(tmppath, path)
+        except OSError:
+            if not os.path.exists(path):
+                raise
+    finally:
+        os.unlink(tmppath)
+
+def open_locked(path, block, mode=0644):
+    """
+    Open a bundle for writing, holding an exclusive lock on it
+
+    The bundle is created if necessary. As the bundle may be replaced
+    while waiting for the lock it is opened again until the locked
+    file is the current bundle.
+    """
+    from fcntl import flock, LOCK_EX
+
+    while True:
+        try:
+            fh = open(path, 'r+b')
+        except IOError:
+            create(path, block, mode)
+            continue
+
+        flock(fh.fileno(), LOCK_EX)
+        try:
+            if os.fstat(fh.fileno()).st_ino == os.stat(path).st_ino:
+                return fh
+        except OSError:
+            pass                # removed while waiting for the lock
+        fh.close()
+
+def append(path, block, index, data, mode=0644):
+    """
+    Append the data for a tile to a bundle
+    """
+
+    if len(data) > MAX_LENGTH:
+        raise ValueError('The tile is too large for a bundle: %d bytes' % len(data))
+
+    fh = open_locked(path, block, mode)
+    try:
+        fh.seek(0, os.SEEK_END)
+        offset = fh.tell()
+        fh.write(data)
+        fh.flush()
+
+        # the tile is only visible once its index entry is written
+        fh.seek(index * ENTRY.size)
+        fh.write(ENTRY.pack((offset << LENGTH_BITS) | len(data)))
+        fh.flush()
+    finally:
+        fh.close()              # releases the lock
+
+def remove(path, block, index, mode=0644):
+    """
+    Remove a tile from a bundle
+    """
+
+    if not os.path.exists(path):
+        return
+
+    fh = open_locked(path, block, mode)
+    try:
+        fh.seek(index * ENTRY.size)
+        fh.write(ENTRY.pack(0))
+        fh.flush()
+    finally:
+        fh.close()
+
+def compact(path, block):
+    """
+    Remove the unused data from a bundle, returning the bytes saved
+    """
+    from tempfile import mkstemp
+
+    fh = open_locked(path, block)
+    try:
+        size = index_size(block)
+        data = fh.read(size)
+        entries = [ENTRY.unpack_from(data, i * ENTRY.size)[0] for i in xrange(block * block)]
+        stat = os.fstat(fh.fileno())
+
+        fd, tmppath = mkstemp(dir=os.path.dirname(path), suffix='.tmp')
+        try:
+            os.fchmod(fd, stat.st_mode & 0777)
+            out = os.fdopen(fd, 'wb')
+            try:
+                out.truncate(size)
+                out.seek(size)
+                index = []
+                offset = size
+                for entry in entries:
+                    if not entry:
+                        index.append(ENTRY.pack(0))
+                        continue
+                    length = entry & MAX_LENGTH
+                    fh.seek(entry >> LENGTH_BITS)
+                    out.write(fh.read(length))
+                    index.append(ENTRY.pack((offset << LENGTH_BITS) | length))
+                    offset += length
+
+                out.seek(0)
+                out.write(''.join(index))
+            finally:
+                out.close()
+
+            os.rename(tmppath, path)
+        except:
+            os.unlink(tmppath)
+            raise
+    finally:
+        fh.close()
+
+    return stat.st_size - offset
+
+class Bundle(Cache):
+    """A TileCache cache storing tiles in bundle files
+
+    The cache is configured in the [cache] section by setting the
+    `type` to Bundle, the `module` to medin.bundle and the `base` to
+    the directory containing the bundles. The `block` option sets the
+    number of rows and columns of tiles in a bundle. Up to `max_maps`
+    bundles are kept mapped, each of which uses a file descriptor.
+    """
+
+    def __init__(self, base=None, block='128', max_maps='256', umask='002', **kwargs):
+        from medin.cache import LRUDict
+
+        Cache.__init__(self, **kwargs)
+        self.basedir = base
+        self.block = int(block)
+        self.max_maps = int(max_maps)
+        self.umask = int(umask, 0)
+        self.mode = 0666 & ~self.umask
+        self.sendfile = False   # tiles are not stored in their own files
+        self._maps = LRUDict() # bundle path -> (stat, mmap)
+        self._lock = Lock()
+
+        if not os.path.isdir(base):
+            self.makedirs(base)
+
+    def makedirs(self, path):
+        old_umask = os.umask(self.umask)
+        try:
+            os.makedirs(path)
+        except OSError:
+            if not os.path.isdir(path):
+                raise
+        finally:
+            os.umask(old_umask)
+
+    def getLocation(self, tile):
+        """
+        Return the path to the bundle containing a tile and its index
+        """
+        x, y = int(tile.x), int(tile.y)
+        name = 'R%04xC%04x.bundle' % (y // self.block, x // self.block)
+        path = os.path.join(self.basedir, tile.layer.name, '%02d' % tile.z, name)
+        return path, (y % self.block) * self.block + (x % self.block)
+
+    def getKey(self, tile):
+        return '%s.%d' % self.getLocation(tile)
+
+    def getMap(self, path, refresh=False):
+        """
+        Return the stat and a read only memory map of a bundle
+
+        The map is shared by the threads in the process. It is
+        replaced if `refresh` is True and the bundle has changed. None
+        is returned for both if the bundle does not exist.
+        """
+        import mmap
+
+        with self._lock:
+            try:
+                stat, mapped = self._maps.pop(path)
+            except KeyError:
+                stat, mapped = None, None
+            else:
+                self._maps[path] = (stat, mapped) # mark as most recently used
+
+        if mapped is not None and not refresh:
+            return stat, mapped
+
+        try:
+            fh = open(path, 'rb')
+        except IOError:
+            return None, None
+
+        try:
+            current = os.fstat(fh.fileno())
+            if mapped is not None and current.st_ino == stat.st_ino and current.st_size == len(mapped):
+                return stat, mapped # unchanged
+            stat = current
+            mapped = mmap.mmap(fh.fileno(), 0, access=mmap.ACCESS_READ)
+        finally:
+            fh.close()
+
+        # old maps are unmapped when the threads using them are done
+        with self._lock:
+            self._maps.pop(path, None)
+            self._maps[path] = (stat, mapped)
+            while len(self._maps) > self.max_maps:
+                self._maps.popitem(last=False)
+        return stat, mapped
+
+    def getSlice(self, tile):
+        """
+        Return the bundle map, offset and length of a tile, or None
+
+        This allows the tile data to be used without copying it.
+        """
+        found = self._find(tile)
+        if found is None:
+            return None
+        return found[1:]
+
+    def _find(self, tile):
+        path, index = self.getLocation(tile)
+        for refresh in (False, True):
+            stat, mapped = self.getMap(path, refresh)
+            if mapped is None:
+                return None
+
+            entry = ENTRY.unpack_from(mapped, index * ENTRY.size)[0]
+            offset, length = entry >> LENGTH_BITS, entry & MAX_LENGTH
+            if entry and offset + length <= len(mapped):
+                return stat, mapped, offset, length
+
+            # the tile may have been added since the bundle was mapped
+
+        return None
+
+    def locate(self, tile):
+        """
+        Return the StoredTile for a tile, or None
+
+        The bundle modification time is used as the tile modification
+        time.
+        """
+        from medin.spatial import StoredTile
+
+        found = self._find(tile)
+        if found is None:
+            return None
+
+        stat, mapped, offset, length = found
+        return StoredTile(stat.st_mtime, length, data=mapped[offset:offset+length])
+
+    def get(self, tile):
+        found = self.getSlice(tile)
+        if found is None:
+            return None
+
+        mapped, offset, length = found
+        tile.data = mapped[offset:offset+length]
+        return tile.data
+
+    def set(self, tile, data):
+        if self.readonly: return data
+        path, index = self.getLocation(tile)
+        dirname = os.path.dirname(path)
+        if not os.path.isdir(dirname):
+            self.makedirs(dirname)
+
+        append(path, self.block, index, data, self.mode)
+        tile.data = data
+        return data
+
+    def delete(self, tile):
+        path, index = self.getLocation(tile)
+        remove(path, self.block, index, self.mode)
+
+    def attemptLock(self, tile):
+        import time
+        import warnings
+
+        name = self.getLockName(tile)
+        try:
+            self.makedirs(os.path.dirname(name))
+            os.mkdir(name)
+            return True
+        except OSError:
+            pass
+
+        try:
+            if os.stat(name).st_ctime + self.stale < time.time():
+                warnings.warn("removing stale lock %s" % name)
+                self.unlock(tile)
+                os.mkdir(name)
+                return True
+        except OSError:
+            pass
+
+        return False
+
+    def unlock(self, tile):
+        try:
+            os.rmdir(self.getLockName(tile))
+        except OSError:
+            pass
+
+    def compact(self):
+        """
+        Compact every bundle in the cache, returning the bytes saved
+        """
+
+        saved = 0
+        for dirpath, dirnames, filenames in os.walk(self.basedir):
+            for filename in filenames:
+                if filename.endswith('.bundle'):
+                    saved += compact(os.path.join(dirpath, filename), self.block)
+        return saved
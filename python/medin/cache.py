@@ -0,0 +1,409 @@
+# Created by Homme Zwaagstra
+#
+# Copyright (c) 2010 GeoData Institute
+# http://www.geodata.soton.ac.uk
+# geodata@soton.ac.uk
+#
+# Unless explicitly acquired and licensed from Licensor under another
+# license, the contents of this file are subject to the Reciprocal
+# Public License ("RPL") Version 1.5, or subsequent versions as
+# allowed by the RPL, and You may not copy or use this file in either
+# source code or executable form, except in compliance with the terms
+# and conditions of the RPL.
+#
+# All software distributed under the RPL is provided strictly on an
+# "AS IS" basis, WITHOUT WARRANTY OF ANY KIND, EITHER EXPRESS OR
+# IMPLIED, AND LICENSOR HEREBY DISCLAIMS ALL SUCH WARRANTIES,
+# INCLUDING WITHOUT LIMITATION, ANY WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE, QUIET ENJOYMENT, OR
+# NON-INFRINGEMENT. See the RPL for specific language governing rights
+# and limitations under the RPL.
+#
+# You can obtain a full copy of the RPL from
+# http://opensource.org/licenses/rpl1.5.txt or geodata@soton.ac.uk
+
+"""
+Cache backends used by the portal
+
+Each backend maps string keys to picklable values and exposes the
+same get(), set() and delete() interface so that the caches used by
+the portal can be swapped between an in-process and a shared store.
+"""
+
+import os
+from time import time
+from threading import Lock
+
+class LRUDict(object):
+    """
+    A mapping that remembers the order its keys were set in
+
+    This provides the subset of the collections.OrderedDict interface
+    used for least recently used eviction, as OrderedDict is only
+    available from Python 2.7: setting a key makes it the newest and
+    popitem(last=False) removes the oldest. The entries are held in a
+    circular doubly linked list of [prev, next, key, value] lists.
+    """
+
+    def __init__(self):
+        self._root = root = []
+        root[:] = [root, root, None, None]
+        self._links = {}
+
+    def __len__(self):
+        return len(self._links)
+
+    def __contains__(self, key):
+        return key in self._links
+
+    def __getitem__(self, key):
+        return self._links[key][3]
+
+    def __setitem__(self, key, value):
+        try:
+            link = self._links[key]
+        except KeyError:
+            pass
+        else:
+            self._unlink(link)
+
+        root = self._root
+        last = root[0]
+        link = last[1] = root[0] = self._links[key] = [last, root, key, value]
+
+    def _unlink(self, link):
+        prev, next = link[0], link[1]
+        prev[1] = next
+        next[0] = prev
+
+    def pop(self, key, *default):
+        try:
+            link = self._links.pop(key)
+        except KeyError:
+            if default:
+                return default[0]
+            raise
+
+        self._unlink(link)
+        return link[3]
+
+    def popitem(self, last=True):
+        root = self._root
+        if root[0] is root:
+            raise KeyError('popitem(): the mapping is empty')
+
+        link = root[0] if last else root[1]
+        del self._links[link[2]]
+        self._unlink(link)
+        return link[2], link[3]
+
+class Cache(object):
+    """
+    Base class for the cache backends
+
+    Entries older than `timeout` seconds are treated as missing. A
+    timeout of None means entries never expire.
+    """
+
+    def __init__(self, timeout=None):
+        self.timeout = timeout
+
+    def expires(self):
+        if self.timeout is None:
+            return None
+        return time() + self.timeout
+
+    def get(self, key):
+        raise NotImplementedError('get must be overridden in a subclass')
+
+    def set(self, key, value):
+        raise NotImplementedError('set must be overridden in a subclass')
+
+    def delete(self, key):
+        raise NotImplementedError('delete must be overridden in a subclass')
+
+class MemoryCache(Cache):
+    """
+    An in-process cache with least recently used eviction
+
+    The number of entries is bounded by `max_entries`. The cache is
+    safe to share between threads.
+    """
+
+    def __init__(self, max_entries=1000, timeout=None):
+        super(MemoryCache, self).__init__(timeout)
+        self.max_entries = max_entries
+        self._entries = LRUDict()
+        self._lock = Lock()
+
+    def get(self, key):
+        with self._lock:
+            try:
+                expires, value = self._entries.pop(key)
+            except KeyError:
+                return None
+
+            if expires is not None and expires < time():
+                return None
+
+            self._entries[key] = (expires, value) # mark as most recently used
+            return value
+
+    def set(self, key, value):
+        with self._lock:
+            self._entries.pop(key, None)
+            self._entries[key] = (self.expires(), value)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False) # evict the least recently used
+
+    def delete(self, key):
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def __len__(self):
+        return len(self._entries)
+
+class DiskCache(Cache):
+    """
+    A cache storing pickled entries as files in a directory
+
+    The cache can be shared between processes. Files are written
+    atomically and the least recently used entries are removed when
+    the number of files exceeds `max_entries`.
+    """
+
+    def __init__(self, directory, max_entries=10000, timeout=None):
+        super(DiskCache, self).__init__(timeout)
+        self.directory = directory
+        self.max_entries = max_entries
+        self._sets = 0
+
+        try:
+            os.makedirs(directory)
+        except OSError:
+            if not os.path.isdir(directory):
+                raise
+
+    def getPath(self, key):
+        from hashlib import sha1
+        return os.path.join(self.directory, sha1(key).hexdigest())
+
+    def get(self, key):
+        from cPickle import load
+
+        path = self.getPath(key)
+        try:
+            fh = open(path, 'rb')
+        except IOError:
+            return None
+
+        try:
+            try:
+                expires, value = load(fh)
+            except Exception:
+                return None         # a corrupt or incompatible entry
+        finally:
+            fh.close()
+
+        if expires is not None and expires < time():
+            self.delete(key)
+            return None
+
+        try:
+            os.utime(path, None)    # mark as most recently used
+        except OSError:
+            pass
+
+        return value
+
+    def set(self, key, value):
+        from cPickle import dump, HIGHEST_PROTOCOL
+        from tempfile import mkstemp
+
+        fd, tmppath = mkstemp(dir=self.directory, suffix='.tmp')
+        try:
+            fh = os.fdopen(fd, 'wb')
+            try:
+                dump((self.expires(), value), fh, HIGHEST_PROTOCOL)
+            finally:
+                fh.close()
+            os.rename(tmppath, self.getPath(key))
+        except:
+            try:
+                os.unlink(tmppath)
+            except OSError:
+                pass
+            raise
+
+        # only check the size of the cache periodically
+        self._sets += 1
+        if self._sets >= max(self.max_entries / 10, 1):
+            self._sets = 0
+            self.prune()
+
+    def delete(self, key):
+        try:
+            os.unlink(self.getPath(key))
+        except OSError:
+            pass
+
+    def prune(self):
+        """
+        Remove the least recently used entries beyond `max_entries`
+        """
+
+        entries = []
+        for name in os.listdir(self.directory):
+            if name.endswith('.tmp'):
+                continue
+            path = os.path.join(self.directory, name)
+            try:
+                entries.append((os.path.getmtime(path), path))
+            except OSError:
+                pass            # removed by another process
+
+        excess = len(entries) - self.max_entries
+        if excess <= 0:
+            return
+
+        entries.sort()
+        for mtime, path in entries[:excess]:
+            try:
+                os.unlink(path)
+            except OSError:
+                pass
+
+class MemcachedCache(Cache):
+    """
+    A cache storing entries in one or more memcached servers
+
+    The cache can be shared between processes and hosts. This requires
+    the python-memcached module. Keys are hashed as memcached limits
+    their length and the characters they may contain.
+    """
+
+    def __init__(self, servers, prefix='medin', timeout=None):
+        import memcache
+
+        super(MemcachedCache, self).__init__(timeout)
+        self.prefix = prefix
+        self.client = memcache.Client(servers)
+
+    def getKey(self, key):
+        from hashlib import sha1
+        return '%s:%s' % (self.prefix, sha1(key).hexdigest())
+
+    def get(self, key):
+        return self.client.get(self.getKey(key))
+
+    def set(self, key, value):
+        # memcached treats a time of zero as never expiring
+        self.client.set(self.getKey(key), value, int(self.timeout or 0))
+
+    def delete(self, key):
+        self.client.delete(self.getKey(key))
+
+class FileMemo(object):
+    """
+    Memoize values derived from the contents of a file
+
+    Values are held in memory until the modification time of the file
+    changes, at which point they are all discarded. This suits data
+    read from a database file that is only updated by replacing or
+    rewriting it, such as the portal reference data.
+    """
+
+    def __init__(self, path, max_entries=1000):
+        self.path = path
+        self.max_entries = max_entries
+        self._mtime = None
+        self._cache = None
+        self._lock = Lock()
+
+    def getCache(self):
+        try:
+            mtime = os.stat(self.path).st_mtime
+        except OSError:
+            mtime = None
+
+        with self._lock:
+            if self._cache is None or mtime != self._mtime:
+                self._cache = MemoryCache(self.max_entries)
+                self._mtime = mtime
+            return self._cache
+
+    def get(self, key, create):
+        """
+        Return the value for a key, calling `create` to obtain it if necessary
+        """
+        cache = self.getCache()
+        value = cache.get(key)
+        if value is None:
+            value = create()
+            cache.set(key, value)
+        return value
+
+def file_memo(path):
+    """
+    Return the FileMemo shared by all users of a file
+
+    None is returned if there is no file, e.g. for an in memory
+    database.
+    """
+    if not path:
+        return None
+
+    path = os.path.abspath(path)
+    with _memos_lock:
+        try:
+            return _memos[path]
+        except KeyError:
+            memo = _memos[path] = FileMemo(path)
+            return memo
+
+_memos = {}
+_memos_lock = Lock()
+
+def memoize(memo, key, create):
+    """
+    Return a value from a FileMemo, which may be None
+    """
+    if memo is None:
+        return create()
+    return memo.get(key, create)
+
+def from_config(config, section, root, **defaults):
+    """
+    Create a cache backend from a section in an INI file
+
+    The `backend` option selects between `memory`, `disk`, `memcached`
+    or `none`, in which case None is returned. Options missing from
+    the section are taken from the keyword arguments. The `disk`
+    backend stores its entries under the portal tmp directory unless a
+    `directory` option is specified. The `memcached` backend connects
+    to the comma separated list of `servers`.
+    """
+
+    def get(option, default=None):
+        if config.has_section(section) and config.has_option(section, option):
+            return config.get(section, option)
+        return defaults.get(option, default)
+
+    backend = get('backend', 'memory').lower()
+    if backend == 'none':
+        return None
+
+    timeout = get('timeout')
+    if timeout is not None:
+        timeout = float(timeout)
+
+    if backend == 'memory':
+        return MemoryCache(int(get('max_entries', 1000)), timeout)
+    elif backend == 'disk':
+        directory = get('directory', os.path.join(root, 'tmp', section.replace('_', '-')))
+        return DiskCache(directory, int(get('max_entries', 10000)), timeout)
+    elif backend == 'memcached':
+        servers = [server.strip() for server in get('servers', '127.0.0.1:11211').split(',')]
+        return MemcachedCache(servers, get('prefix', section), timeout)
+
+    raise ValueError('Unknown cache backend in the [%s] section: %s' % (section, backend))
@@ -0,0 +1,235 @@
+# Created by Homme Zwaagstra
+#
+# Copyright (c) 2014 GeoData Institute
+# http://www.geodata.soton.ac.uk
+# geodata@soton.ac.uk
+#
+# Unless explicitly acquired and licensed from Licensor under another
+# license, the contents of this file are subject to the Reciprocal
+# Public License ("RPL") Version 1.5, or subsequent versions as
+# allowed by the RPL, and You may not copy or use this file in either
+# source code or executable form, except in compliance with the terms
+# and conditions of the RPL.
+#
+# All software distributed under the RPL is provided strictly on an
+# "AS IS" basis, WITHOUT WARRANTY OF ANY KIND, EITHER EXPRESS OR
+# IMPLIED, AND LICENSOR HEREBY DISCLAIMS ALL SUCH WARRANTIES,
+# INCLUDING WITHOUT LIMITATION, ANY WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE, QUIET ENJOYMENT, OR
+# NON-INFRINGEMENT. See the RPL for specific language governing rights
+# and limitations under the RPL.
+#
+# You can obtain a full copy of the RPL from
+# http://opensource.org/licenses/rpl1.5.txt or geodata@soton.ac.uk
+
+"""
+Connections to the portal sqlite databases
+
+There is a single pool of connections for every database file which
+is shared by all threads. A request borrows at most one connection
+from each pool through its RequestScope, and the connections are
+returned when the scope is closed once the WSGI app has returned, so
+they are not held while a streamed response is sent.
+
+The portal databases are only changed by the offline update scripts,
+so connections to them are read only. Idle connections are discarded
+when a database file is modified so that a rebuilt database is seen
+by subsequent requests. Databases that are updated in place while the
+portal is reading them, such as the mirror of the DWS records, are
+not opened as immutable.
+"""
+
+import os
+import sqlite3
+from threading import Lock, Condition
+
+class PoolTimeout(Exception):
+    pass
+
+def file_mtime(path):
+    try:
+        return os.stat(path).st_mtime
+    except OSError:
+        return None
+
+def connect(path, readonly=True, factory=sqlite3.Connection, immutable=True):
+    """
+    Open a connection to a sqlite database that can be used by any thread
+
+    Read only connections are opened using a `mode=ro` URI where the
+    sqlite module supports them, which is also `immutable=1` unless
+    `immutable` is False: sqlite then skips all file locking and
+    change detection. Otherwise the connection is set to reject writes
+    using the query_only pragma.
+    """
+    kwargs = dict(factory=factory, check_same_thread=False)
+    if readonly:
+        from urllib import quote
+
+        uri = 'file:%s?mode=ro' % quote(os.path.abspath(path))
+        if immutable:
+            uri += '&immutable=1'
+        try:
+            return sqlite3.connect(uri, uri=True, **kwargs)
+        except TypeError:
+            pass                # the sqlite module does not accept URIs
+
+    conn = sqlite3.connect(path, **kwargs)
+    if readonly:
+        conn.execute('PRAGMA query_only = 1')
+    return conn
+
+class Pool(object):
+    """
+    A bounded, thread safe pool of connections to a sqlite database
+
+    No more than `size` connections are open at once: acquire() waits
+    up to `timeout` seconds for a connection to be released before
+    raising PoolTimeout.
+    """
+
+    def __init__(self, path, size=8, timeout=30, factory=sqlite3.Connection, immutable=True):
+        self.path = path
+        self.size = size
+        self.timeout = timeout
+        self.factory = factory
+        self.immutable = immutable
+        self._cond = Condition(Lock())
+        self._idle = []         # connections available for use
+        self._used = {}         # connection -> the generation it belongs to
+        self._open = 0
+        self._generation = 0
+        self._mtime = file_mtime(path)
+
+    def checkFile(self):
+        """
+        Discard the idle connections if the database has changed
+        """
+        mtime = file_mtime(self.path)
+        with self._cond:
+            if mtime == self._mtime:
+                return
+            self._mtime = mtime
+            self._generation += 1
+            idle, self._idle = self._idle, []
+            self._open -= len(idle)
+            self._cond.notify_all()
+
+        for conn in idle:
+            conn.close()
+
+    def acquire(self):
+        from time import time
+
+        self.checkFile()
+        deadline = time() + self.timeout
+        with self._cond:
+            while not self._idle and self._open >= self.size:
+                remaining = deadline - time()
+                if remaining <= 0:
+                    raise PoolTimeout('No connection to %s became available within %s seconds' % (self.path, self.timeout))
+                self._cond.wait(remaining)
+
+            if self._idle:
+                conn = self._idle.pop()
+                self._used[conn] = self._generation
+                return conn
+
+            self._open += 1
+            generation = self._generation
+
+        try:
+            conn = connect(self.path, factory=self.factory, immutable=self.immutable)
+        except:
+            with self._cond:
+                self._open -= 1
+                self._cond.notify()
+            raise
+
+        with self._cond:
+            self._used[conn] = generation
+        return conn
+
+    def release(self, conn):
+        with self._cond:
+            generation = self._used.pop(conn)
+            if generation == self._generation:
+                self._idle.append(conn)
+                conn = None
+            else:
+                self._open -= 1
+            self._cond.notify()
+
+        if conn is not None:
+            conn.close()        # it belongs to an older version of the database
+
+def get_pool(path, factory=sqlite3.Connection, immutable=True):
+    """
+    Return the connection pool shared by all users of a database
+    """
+    path = os.path.abspath(path)
+    with _lock:
+        try:
+            return _pools[path]
+        except KeyError:
+            pool = _pools[path] = Pool(path, factory=factory, immutable=immutable)
+            return pool
+
+def get_engine(path, pool_size=8):
+    """
+    Return the SQLAlchemy engine shared by all users of a database
+
+    The engine's pooled connections are disposed of if the database
+    has changed since they were opened.
+    """
+    path = os.path.abspath(path)
+    mtime = file_mtime(path)
+    with _lock:
+        try:
+            engine, opened = _engines[path]
+        except KeyError:
+            from sqlalchemy import create_engine
+            from sqlalchemy.pool import QueuePool
+
+            engine = create_engine('sqlite:///%s' % path,
+                                   creator=lambda: connect(path),
+                                   poolclass=QueuePool,
+                                   pool_size=pool_size,
+                                   max_overflow=0)
+        else:
+            if opened != mtime:
+                engine.dispose()
+
+        _engines[path] = (engine, mtime)
+        return engine
+
+_pools = {}
+_engines = {}
+_lock = Lock()
+
+class RequestScope(object):
+    """
+    The database connections used by a request
+
+    Connections are borrowed from the pools when they are first
+    needed and returned when the scope is closed.
+    """
+
+    def __init__(self):
+        self._conns = {}        # path -> (pool, connection)
+
+    def connection(self, path, factory=sqlite3.Connection):
+        try:
+            return self._conns[path][1]
+        except KeyError:
+            pass
+
+        pool = get_pool(path, factory)
+        conn = pool.acquire()
+        self._conns[path] = (pool, conn)
+        return conn
+
+    def close(self):
+        conns, self._conns = self._conns, {}
+        for pool, conn in conns.itervalues():
+            pool.release(conn)
@@ -23,9 +23,12 @@
 # http://opensource.org/licenses/rpl1.5.txt or geodata@soton.ac.uk
 
 import os
+from time import time
+from threading import Lock
 
 # Third party modules
 import suds                             # for the SOAP client
+import suds.cache
 
 RESULT_SIMPLE = 1
 RESULT_BRIEF = 2
@@ -40,21 +43,174 @@ class DWSError(Exception):
     def __str__(self):
         return self.msg
 
-class Request(object):
+def default_wsdl():
+    """
+    Return the path to the DWS WSDL distributed with the portal
+    """
+    return os.path.abspath(os.path.join(os.path.dirname(__file__), 'data', 'dws.wsdl'))
 
-    def __init__(self, wsdl=None):
-        if wsdl is None:
-            wsdl = 'file://%s' % os.path.abspath(os.path.join(os.path.dirname(__file__), 'data', 'dws.wsdl'))
+def wsdl_version(wsdl):
+    """
+    Return a version string for a local WSDL file
 
-        self.client = suds.client.Client(wsdl, timeout=10)
+    The version changes whenever suds is upgraded or the WSDL or any
+    schema alongside it is edited, invalidating pre-parsed
+    definitions.
+    """
+    from hashlib import sha1
+    from glob import glob
 
-    def __call__(self):
+    digest = sha1(suds.__version__)
+    dirname = os.path.dirname(wsdl)
+    for path in [wsdl] + sorted(glob(os.path.join(dirname, '*.xsd'))):
+        fh = open(path, 'rb')
         try:
-            caller = self.caller
+            digest.update(fh.read())
+        finally:
+            fh.close()
+
+    return digest.hexdigest()
+
+def compile_wsdl(wsdl, artifact):
+    """
+    Parse a local WSDL and pickle the definitions to an artifact file
+
+    The artifact is read by DefinitionsCache and is intended to be
+    created when the portal is built.
+    """
+    from cPickle import dump, HIGHEST_PROTOCOL
+    from suds.cache import NoCache
+
+    client = suds.client.Client('file://%s' % wsdl, cache=NoCache())
+
+    tmppath = artifact + '.tmp'
+    fh = open(tmppath, 'wb')
+    try:
+        dump((wsdl_version(wsdl), client.wsdl), fh, HIGHEST_PROTOCOL)
+    finally:
+        fh.close()
+    os.rename(tmppath, artifact)
+
+class DefinitionsCache(suds.cache.Cache):
+    """
+    A suds cache serving WSDL definitions from a pre-parsed artifact
+
+    This avoids suds parsing the WSDL and its schema at runtime. The
+    artifact is ignored if its version does not match the current
+    WSDL, in which case suds parses the WSDL as usual.
+    """
+
+    def __init__(self, artifact, version):
+        self.artifact = artifact
+        self.version = version
+
+    def get(self, id):
+        from cPickle import load
+
+        try:
+            fh = open(self.artifact, 'rb')
+        except IOError:
+            return None
+
+        try:
+            version, definitions = load(fh)
+        finally:
+            fh.close()
+
+        if version != self.version:
+            return None
+
+        return definitions
+
+    def put(self, id, object):
+        return object           # the artifact is only written by compile_wsdl()
+
+def artifact_path(wsdl):
+    return os.path.splitext(wsdl)[0] + '.px'
+
+class ClientPool(object):
+    """
+    Per-thread copies of a shared suds client
+
+    The client holding the parsed WSDL is never called directly;
+    each thread gets its own clone for every combination of client
+    options it uses. Clones share the WSDL model so are cheap, and
+    are reused for the lifetime of the thread.
+    """
+
+    def __init__(self, client):
+        from threading import local
+
+        self.client = client
+        self.factory = client.factory
+        self._local = local()
+
+    def get(self, **options):
+        key = tuple(sorted(options.items()))
+        try:
+            clients = self._local.clients
         except AttributeError:
-            raise RuntimeError('The request has been called before it has been prepared')
+            clients = self._local.clients = {}
+
+        try:
+            return clients[key]
+        except KeyError:
+            pass
+
+        client = clients[key] = self.client.clone()
+        if options:
+            client.set_options(**options)
+
+        return client
+
+def get_pool(wsdl=None):
+    """
+    Return the client pool for a local WSDL file
+
+    The WSDL is loaded once per process, from its pre-parsed artifact
+    if one exists (see `bin/wsdl-update.py`).
+    """
+    if wsdl is None:
+        wsdl = default_wsdl()
+
+    try:
+        return _pools[wsdl]
+    except KeyError:
+        pass
+
+    with _pools_lock:
+        try:
+            return _pools[wsdl]
+        except KeyError:
+            pass
+
+        url = 'file://%s' % wsdl
+        artifact = artifact_path(wsdl)
+        if os.path.exists(artifact):
+            cache = DefinitionsCache(artifact, wsdl_version(wsdl))
+            client = suds.client.Client(url, timeout=10, cache=cache, cachingpolicy=1)
+        else:
+            client = suds.client.Client(url, timeout=10)
+
+        pool = _pools[wsdl] = ClientPool(client)
+
+    return pool
+
+_pools = {}
+_pools_lock = Lock()
+
+class Request(object):
+    """
+    Base class for creating calls to the DWS
 
-        return caller()
+    A Request holds no per-request state: prepareCaller() returns a
+    new SOAPCaller for each request which is then called to obtain
+    the response. Instances can therefore be shared between threads.
+    """
+
+    def __init__(self, wsdl=None):
+        self.pool = get_pool(wsdl)
+        self.client = self.pool.client
 
     def prepareCaller(self, *args, **kwargs):
         raise NotImplementedError('prepareCaller must be overridden in a subclass')
@@ -311,17 +467,167 @@ class OrderAnalyser(object):
         else:
             self.direction = 'descending'
 
+class ResponseCache(object):
+    """
+    Cache of raw DWS reply envelopes
+
+    Replies are keyed on the SOAP request envelope. A reply is fresh
+    for `ttl` seconds after which it is served stale for up to a
+    further `stale` seconds while it is refreshed in the background.
+    A `valid` function can be given to reject refreshed replies, which
+    are otherwise always stored.
+    """
+
+    def __init__(self, backend, ttl=300, stale=600):
+        self.backend = backend
+        self.ttl = ttl
+        self.stale = stale
+        self._refreshing = set()
+        self._lock = Lock()
+
+    def key(self, envelope):
+        from hashlib import sha1
+        return 'dws:%s' % sha1(envelope).hexdigest()
+
+    def get(self, key, fetch, logger, valid=None):
+        """
+        Return the reply for a key, calling `fetch` to obtain it if necessary
+        """
+
+        now = time()
+        entry = self.backend.get(key)
+        if entry is not None:
+            stored, xml = entry
+            age = now - stored
+            if age <= self.ttl:
+                return xml
+            if age <= self.ttl + self.stale:
+                self.revalidate(key, fetch, logger, valid)
+                return xml
+
+        xml = fetch()
+        self.set(key, xml)
+        return xml
+
+    def peek(self, key, fetch, logger, valid=None):
+        """
+        Return the reply for a key if one is cached, otherwise None
+
+        Unlike get() a missing reply is not fetched, although a stale
+        reply is refreshed in the background.
+        """
+
+        entry = self.backend.get(key)
+        if entry is None:
+            return None
+
+        stored, xml = entry
+        age = time() - stored
+        if age <= self.ttl:
+            return xml
+        if age <= self.ttl + self.stale:
+            self.revalidate(key, fetch, logger, valid)
+            return xml
+
+        return None
+
+    def set(self, key, xml):
+        self.backend.set(key, (time(), xml))
+
+    def delete(self, key):
+        self.backend.delete(key)
+
+    def revalidate(self, key, fetch, logger, valid=None):
+        """
+        Refresh a stale reply in a background thread
+
+        The stale reply is kept if the new one is not `valid`.
+        """
+        from threading import Thread
+
+        with self._lock:
+            if key in self._refreshing:
+                return          # another thread is already on it
+            self._refreshing.add(key)
+
+        def refresh():
+            try:
+                xml = fetch()
+                if valid is None or valid(xml):
+                    self.set(key, xml)
+                else:
+                    logger.error('The stale DWS response was not replaced by a failed reply')
+            except Exception:
+                logger.exception('The stale DWS response could not be refreshed')
+            finally:
+                with self._lock:
+                    self._refreshing.discard(key)
+
+        thread = Thread(target=refresh)
+        thread.daemon = True
+        thread.start()
+
+def response_cache_from_config(config, root, section='dws_cache', ttl=300, stale=600):
+    """
+    Create a ResponseCache from a section of an INI file
+    """
+    from medin.cache import from_config
+
+    def get(option, default):
+        if config.has_section(section) and config.has_option(section, option):
+            return config.getfloat(section, option)
+        return default
+
+    ttl = get('ttl', ttl)
+    stale = get('stale', stale)
+    backend = from_config(config, section, root, timeout=ttl+stale)
+    if backend is None:
+        return None
+
+    return ResponseCache(backend, ttl, stale)
+
+def set_response_cache(cache):
+    """
+    Set the cache used for all SOAP calls to the DWS
+
+    Setting the cache to None disables response caching.
+    """
+    global _response_cache
+    _response_cache = cache
+
+def get_response_cache():
+    return _response_cache
+
+_response_cache = None
+
+def set_freshness_cache(cache):
+    """
+    Set the cache of the Etag data for DWS records and searches
+
+    This is a ResponseCache used to answer conditional requests
+    without contacting the DWS. Setting the cache to None disables
+    this.
+    """
+    global _freshness_cache
+    _freshness_cache = cache
+
+def get_freshness_cache():
+    return _freshness_cache
+
+_freshness_cache = None
+
 class SOAPCaller(object):
     """
     An object that handles a calls to the SOAP service
 
     Each caller handles a specific request to a SOAP service method
-    using a client and calling arguments.
+    using a client and calling arguments. Replies are served from the
+    DWS response cache if one has been set.
     """
 
-    def __init__(self, client, soap_method, logger, *args, **kwargs):
-        self.client = client
-        self.method = getattr(client.service, soap_method)
+    def __init__(self, pool, soap_method, logger, *args, **kwargs):
+        self.pool = pool
+        self.soap_method = soap_method
         self.logger = logger
         self.args = args
         self.kwargs = kwargs
@@ -331,35 +637,61 @@ class SOAPCaller(object):
         Return the SOAP Envelope for the request
         """
 
-        self.client.set_options(nosend=True)
-        try:
-            req = self()
-        finally:
-            self.client.set_options(nosend=False)
-
-        return req.envelope
+        return self.invoke(nosend=True).envelope
 
     def responseXML(self):
         """
         Return the SOAP Envelope for the response
         """
 
-        self.client.set_options(retxml=True)
-        try:
-            xml = self()
-        finally:
-            self.client.set_options(retxml=False)
-
-        return xml
+        return self.invoke(retxml=True)
 
     def __call__(self):
+        """
+        Call the SOAP service, using the response cache if available
+        """
+
+        cache = get_response_cache()
+        if cache is None:
+            return self.invoke()
+
+        key = cache.key(self.requestXML())
+        xml = cache.get(key, self.responseXML, self.logger, self.isSuccess)
+
+        # unmarshal the reply without sending the request
+        result = self.invoke({'reply': xml})
+        if not getattr(result, 'Status', True):
+            cache.delete(key)   # don't hang on to failed replies
+
+        return result
+
+    def isSuccess(self, xml):
+        """
+        Return True unless a SOAP response envelope reports a failure
+        """
+
+        return bool(getattr(self.invoke({'reply': xml}), 'Status', True))
+
+    def invoke(self, inject=None, **options):
         """
         Wrap the call to the SOAP service with some error checking
+
+        If `inject` is specified it is passed to suds as a simulated
+        reply and the service is not contacted. Any keyword arguments
+        are suds client options used to select the client from the
+        pool.
         """
         from urllib2 import URLError
 
+        client = self.pool.get(**options)
+        method = getattr(client.service, self.soap_method)
+
+        kwargs = self.kwargs
+        if inject is not None:
+            kwargs = dict(kwargs, __inject=inject)
+
         try:
-            return self.method(*(self.args), **(self.kwargs))
+            return method(*(self.args), **kwargs)
         except URLError, e:
             try:
                 status, msg = e.reason
@@ -374,13 +706,187 @@ class SOAPCaller(object):
             self.logger.exception(msg)
             try:
                 status, reason = e.args[0]
-            except (ValueError, IndexError):
+            except (ValueError, IndexError, TypeError):
                 raise DWSError(msg)
             else:
                 if status == 503:
                     msg = 'The Discovery Web Service is temorarily unavailable'
                 raise DWSError(msg, status)
 
+class Future(object):
+    """
+    The pending result of a SOAPCaller run by a WorkerPool
+    """
+
+    def __init__(self, caller):
+        from threading import Event
+
+        self.caller = caller
+        self._done = Event()
+        self._result = None
+        self._exc_info = None
+
+    def run(self):
+        import sys
+
+        try:
+            self._result = self.caller()
+        except:
+            self._exc_info = sys.exc_info()
+        self._done.set()
+
+    def result(self):
+        """
+        Wait for the call to complete and return its result
+
+        Any exception raised by the call is re-raised here.
+        """
+        self._done.wait()
+        if self._exc_info:
+            exc_type, exc_value, traceback = self._exc_info
+            self._exc_info = None   # avoid a circular reference
+            raise exc_type, exc_value, traceback
+        return self._result
+
+class WorkerPool(object):
+    """
+    A fixed number of threads used to call the DWS concurrently
+
+    This allows a view needing several independent DWS calls to wait
+    for the slowest of them rather than their sum.
+    """
+
+    def __init__(self, size=8):
+        from Queue import Queue
+        from threading import Thread
+
+        self.queue = Queue()
+        for i in xrange(size):
+            thread = Thread(target=self.work)
+            thread.daemon = True
+            thread.start()
+
+    def work(self):
+        while True:
+            future = self.queue.get()
+            future.run()
+
+    def submit(self, caller):
+        """
+        Queue a caller for execution, returning a Future
+        """
+        future = Future(caller)
+        self.queue.put(future)
+        return future
+
+def get_worker_pool():
+    global _worker_pool
+
+    try:
+        return _worker_pool
+    except NameError:
+        pass
+
+    with _pools_lock:
+        try:
+            return _worker_pool
+        except NameError:
+            _worker_pool = WorkerPool()
+
+    return _worker_pool
+
+def submit(caller):
+    """
+    Start a DWS call in the background, returning a Future for its result
+    """
+    return get_worker_pool().submit(caller)
+
+def call_all(*callers):
+    """
+    Call the DWS with several callers at once, returning their results
+
+    The first caller is run in the current thread while the others
+    are run by the worker pool.
+    """
+    if not callers:
+        return []
+
+    futures = [submit(caller) for caller in callers[1:]]
+    results = [callers[0]()]
+    results.extend([future.result() for future in futures])
+    return results
+
+class SearchCaller(SOAPCaller):
+    """
+    A call to the DWS doSearch method
+
+    Calling the instance returns the reply wrapped in the
+    SearchResponse class specified in the constructor.
+    """
+
+    def __init__(self, pool, logger, ResponseClass, count, *args):
+        super(SearchCaller, self).__init__(pool, 'doSearch', logger, *args)
+        self.ResponseClass = ResponseClass
+        self.count = count
+
+    def __call__(self):
+        result = super(SearchCaller, self).__call__()
+
+        # send the query to the DWS
+        response = self.ResponseClass(result, self.count)
+
+        if not response:
+            msg = 'Data could not be retrieved as the Discovery Web Service failed'
+            self.logger.error(msg + ': %s' % response.message)
+            raise DWSError(msg)
+
+        return response
+
+def result_range(query):
+    """
+    Return the count, start index and number of documents to retrieve
+
+    This works around the fact that the DWS can't be asked to return
+    zero results and it can't deal with a negative start index.
+    """
+    count = query.getCount()
+
+    # do a sanity check on the start index
+    start_index = query.getStartIndex()
+    if start_index < (1 - count):
+        start_index = 1
+
+    if start_index < 1:
+        if count != 0:
+            # the count needs to be adjusted for negative start index
+            dws_count = count - (abs(start_index) + 1)
+        else:
+            # the count is zero so needs to be set to one
+            dws_count = 1
+        start_index = 1
+    elif count > 0:
+        # the count is fine, leave as is
+        dws_count = count
+    else:
+        # the count is zero so needs to be set to one
+        dws_count = 1
+
+    return count, start_index, dws_count
+
+def set_search_index(index):
+    """
+    Answer searches from a local index instead of the DWS
+
+    Setting the index to None sends searches to the DWS.
+    """
+    global _search_index
+    _search_index = index
+
+def get_search_index():
+    return _search_index
+
+_search_index = None
+
 class SearchRequest(Request):
 
     _result_map = {RESULT_SIMPLE: SimpleResponse,
@@ -388,17 +894,17 @@ class SearchRequest(Request):
                    RESULT_SUMMARY: SummaryResponse}
 
     def prepareCaller(self, query, result_type, logger):
+        # answer the search from the local index if there is one
+        index = get_search_index()
+        if index is not None:
+            return index.prepareCaller(query, result_type, logger)
+
         try:
             ResponseClass = self._result_map[result_type]
         except KeyError:
             raise ValueError('Unknown result type: %s' % str(result_type))
 
-        count = query.getCount()
         search_term = query.getSearchTerm(default=[], skip_errors=True)
-        
-        # do a sanity check on the start index
-        if query.getStartIndex() < (1 - count):
-            query.setStartIndex(1)
 
         # construct the RetrieveCriteria
         retrieve = self.client.factory.create('ns0:RetrieveCriteriaType')
@@ -474,49 +980,90 @@ class SearchRequest(Request):
         if search.TemporalSearch.DateRange.Date:
             search.TemporalSearch.DateRange.DateRangeTarget = 'TemporalCoverage'
 
-        # work around the fact that the DWS can't be asked to return
-        # zero results and it can't deal with a negative start index
-        start_index = query.getStartIndex()
-        if start_index < 1:
-            if count != 0:
-                # the count needs to be adjusted for negative start index
-                dws_count = count - (abs(start_index) + 1)
-            else:
-                # the count is zero so needs to be set to one
-                dws_count = 1
-            start_index = 1
-        elif count > 0:
-            # the count is fine, leave as is
-            dws_count = count
-        else:
-            # the count is zero so needs to be set to one
-            dws_count = 1
+        count, start_index, dws_count = result_range(query)
 
-        self.caller = SOAPCaller(self.client,
-                                 'doSearch',
-                                 logger,
-                                 search,
-                                 retrieve,
-                                 start_index,
-                                 dws_count)
-        self.count = count
-        self.ResponseClass = ResponseClass
+        return SearchCaller(self.pool,
+                            logger,
+                            ResponseClass,
+                            count,
+                            search,
+                            retrieve,
+                            start_index,
+                            dws_count)
+
+class ResultPager(object):
+    """
+    Iterate over every document matching a search
+
+    The DWS returns at most `query.max_count` documents per request,
+    so the result set is retrieved in pages starting from the query
+    start index. The first page is retrieved when the pager is created
+    in order to obtain the number of hits, at which point the callers
+    for the subsequent pages are also prepared: preparing a caller
+    uses the request's database connection so it must be done in the
+    request thread, whereas the pager may be iterated over elsewhere.
+    The subsequent pages are retrieved in the background, with up to
+    `concurrency` pages being requested ahead of the documents being
+    iterated over.
+
+    As each page request is independent an interrupted iteration can
+    be resumed from any index by creating a new pager, in which case
+    pages that have already been retrieved are served from the DWS
+    response cache.
+    """
+
+    def __init__(self, request, query, result_type, logger, concurrency=4):
+        self.request = request
+        self.query = query.clone()
+        self.result_type = result_type
         self.logger = logger
+        self.concurrency = concurrency
+        self.page_size = query.max_count
+        self.start = max(query.getStartIndex(), 1)
 
-        return self.caller
+        self.response = self.prepareCaller(self.start)()
+        self.hits = self.response.hits
+        self.callers = [self.prepareCaller(start_index) for start_index in
+                        xrange(self.start + self.page_size, self.end + 1, self.page_size)]
 
-    def __call__(self):
-        result = super(SearchRequest, self).__call__()
+    def prepareCaller(self, start_index):
+        query = self.query.clone()
+        query.setStartIndex(start_index)
+        query.setCount(self.page_size)
+        return self.request.prepareCaller(query, self.result_type, self.logger)
 
-        # send the query to the DWS
-        response = self.ResponseClass(result, self.count)
+    @property
+    def end(self):
+        """The index of the last document"""
+        return max(self.hits, self.start - 1)
 
-        if not response:
-            msg = 'Data could not be retrieved as the Discovery Web Service failed'
-            self.logger.error(msg + ': %s' % response.message)
-            raise DWSError(msg)
+    def lastModified(self):
+        return self.response.lastModified()
 
-        return response
+    def __len__(self):
+        return self.end - self.start + 1
+
+    def __nonzero__(self):
+        return len(self) > 0
+
+    def __iter__(self):
+        from collections import deque
+
+        for doc in self.response:
+            yield doc
+
+        pending = deque()
+        for caller in self.callers:
+            pending.append(submit(caller))
+            if len(pending) < self.concurrency:
+                continue
+
+            for doc in pending.popleft().result():
+                yield doc
+
+        while pending:
+            for doc in pending.popleft().result():
+                yield doc
 
 class MetadataResponse(object):
     """
@@ -526,8 +1073,9 @@ class MetadataResponse(object):
     doPresent Response as returned by the DWS
     """
 
-    def __init__(self, reply):
+    def __init__(self, reply, index=0):
         self.reply = reply              # the raw DWS reply
+        self.index = index              # the document in the reply
 
     @property
     def message(self):
@@ -536,14 +1084,14 @@ class MetadataResponse(object):
     @property
     def xml(self):
         try:
-            return str(self.reply.Documents.DocumentFull[0].Document)
+            return str(self.reply.Documents.DocumentFull[self.index].Document)
         except (AttributeError, IndexError):
             return None                 # no document found
 
     @property
     def gid(self):
         try:
-            return self.reply.Documents.DocumentFull[0].DocumentId
+            return self.reply.Documents.DocumentFull[self.index].DocumentId
         except (AttributeError, IndexError):
             return None                 # no document found
 
@@ -551,7 +1099,7 @@ class MetadataResponse(object):
     def date(self):
         """Last update date"""
         try:
-            return self.reply.Documents.DocumentFull[0].AdditionalInformation.DatasetUpdateDate
+            return self.reply.Documents.DocumentFull[self.index].AdditionalInformation.DatasetUpdateDate
         except (AttributeError, IndexError):
             return None                 # no document found
 
@@ -561,40 +1109,23 @@ class MetadataResponse(object):
         """
         return self.reply.Status
 
-class MetadataRequest(Request):
-
-    def getMetadataFormats(self, logger):
-        caller = SOAPCaller(self.client, 'getList', logger, 'MetadataFormatList')
-        response = caller()
-
-        return response.listMember
-
-    def prepareCaller(self, logger, gid, format):
-        # construct the RetrieveCriteria
-        retrieve = self.client.factory.create('ns0:RetrieveCriteriaType')
-        retrieve.RecordDetail = 'DocumentFull' # we want all the info
-        retrieve.MetadataFormat = format
+class MetadataCaller(SOAPCaller):
+    """
+    A call to the DWS doPresent method for a single metadata record
 
-        # construct the SimpleDocument
-        simpledoc = self.client.factory.create('ns0:SimpleDocument')
-        simpledoc.DocumentId = gid
+    Calling the instance returns a MetadataResponse.
+    """
 
-        # send the query to the DWS
-        self.caller = SOAPCaller(self.client,
-                                 'doPresent',
-                                 logger,
-                                 [simpledoc],
-                                 retrieve)
+    def __init__(self, pool, logger, gid, *args):
+        super(MetadataCaller, self).__init__(pool, 'doPresent', logger, *args)
         self.gid = gid
-        self.logger = logger
-        return self.caller
 
     def __call__(self):
         """
         Connect to the DWS and retrieve a metadata entry by its ID
         """
 
-        response = super(MetadataRequest, self).__call__()
+        response = super(MetadataCaller, self).__call__()
         response = MetadataResponse(response) # wrap the response in our more accessible object
 
         if not response:
@@ -604,28 +1135,125 @@ class MetadataRequest(Request):
 
         return response
 
-class MedinMetadataRequest(MetadataRequest):
+class MetadataBatchCaller(SOAPCaller):
+    """
+    A call to the DWS doPresent method for several metadata records
 
-    def prepareCaller(self, logger, gid, areas, vocab):
-        # get a document in MEDIN XML format
-        format = 'MEDIN_2.3'
+    Calling the instance returns a list of MetadataResponse objects,
+    one for each document returned by the DWS.
+    """
 
+    def __init__(self, pool, logger, gids, *args):
+        super(MetadataBatchCaller, self).__init__(pool, 'doPresent', logger, *args)
+        self.gids = gids
+
+    def __call__(self):
+        reply = super(MetadataBatchCaller, self).__call__()
+
+        if not reply.Status:
+            msg = 'Data could not be retrieved as the Discovery Web Service failed'
+            self.logger.error(msg + ': %s' % reply.StatusMessage)
+            raise DWSError(msg)
+
+        try:
+            count = len(reply.Documents.DocumentFull)
+        except AttributeError:
+            count = 0                   # no documents found
+
+        return [MetadataResponse(reply, i) for i in xrange(count)]
+
+class MedinMetadataCaller(MetadataCaller):
+    """
+    A call to the DWS returning a parser for a MEDIN metadata record
+    """
+
+    def __init__(self, pool, logger, gid, areas, vocab, *args):
+        super(MedinMetadataCaller, self).__init__(pool, logger, gid, *args)
         self.areas = areas
         self.vocab = vocab
-        return super(MedinMetadataRequest, self).prepareCaller(logger, gid, format)
 
     def __call__(self):
-        response = super(MedinMetadataRequest, self).__call__()
+        response = super(MedinMetadataCaller, self).__call__()
 
         xml = response.xml
         if xml is None:
             return None
 
-        # return a Metadata parser instance
-        from metadata import Parser
-        try:
-            return Parser(self.gid, xml, self.areas, self.vocab)
-        except ValueError, e:
-            msg = 'The metadata does not appear to be valid'
-            self.logger.exception(msg)
-            raise DWSError(msg)
+        # return a Metadata parser instance: the document is parsed
+        # when fields are first requested from it unless they have
+        # already been parsed from the same version of the record
+        from metadata import get_parser, metadata_cache_key
+        key = metadata_cache_key(self.gid, response.date)
+        return get_parser()(self.gid, xml, self.areas, self.vocab, key)
+
+class MetadataRequest(Request):
+
+    def getMetadataFormats(self, logger):
+        caller = SOAPCaller(self.pool, 'getList', logger, 'MetadataFormatList')
+        response = caller()
+
+        return response.listMember
+
+    def createArgs(self, gid, format):
+        """
+        Return the doPresent arguments for a metadata record
+        """
+
+        return self.createBatchArgs([gid], format)
+
+    def createBatchArgs(self, gids, format):
+        """
+        Return the doPresent arguments for several metadata records
+        """
+
+        # construct the RetrieveCriteria
+        retrieve = self.client.factory.create('ns0:RetrieveCriteriaType')
+        retrieve.RecordDetail = 'DocumentFull' # we want all the info
+        retrieve.MetadataFormat = format
+
+        # construct a SimpleDocument for each record
+        simpledocs = []
+        for gid in gids:
+            simpledoc = self.client.factory.create('ns0:SimpleDocument')
+            simpledoc.DocumentId = gid
+            simpledocs.append(simpledoc)
+
+        return simpledocs, retrieve
+
+    def prepareCaller(self, logger, gid, format):
+        # send the query to the DWS
+        return MetadataCaller(self.pool,
+                              logger,
+                              gid,
+                              *self.createArgs(gid, format))
+
+    def prepareBatchCallers(self, logger, gids, format, batch_size=50):
+        """
+        Return callers retrieving the metadata records in batches
+
+        Each caller requests up to `batch_size` records in a single
+        SOAP envelope. The callers are independent of each other so
+        can be run concurrently using call_all().
+        """
+
+        callers = []
+        for i in xrange(0, len(gids), batch_size):
+            batch = gids[i:i+batch_size]
+            callers.append(MetadataBatchCaller(self.pool,
+                                               logger,
+                                               batch,
+                                               *self.createBatchArgs(batch, format)))
+        return callers
+
+class MedinMetadataRequest(MetadataRequest):
+
+    def prepareCaller(self, logger, gid, areas, vocab):
+        # get a document in MEDIN XML format
+        format = 'MEDIN_2.3'
+
+        return MedinMetadataCaller(self.pool,
+                                   logger,
+                                   gid,
+                                   areas,
+                                   vocab,
+                                   *self.createArgs(gid, format))
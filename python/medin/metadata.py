@@ -24,6 +24,7 @@
 
 class MetadataError(Exception):
     def __init__(self, message, detail):
+        super(MetadataError, self).__init__(message, detail) # enables pickling
         self.message = message
         self.detail = detail
 
@@ -42,42 +43,54 @@ class Metadata(object):
     These elements are accessed via the object attributes and may
     themselves be compound objects.
     """
-    
-    title = None                        # element 1
-    alt_titles = None                   # element 2
-    abstract = None                     # element 3
-    resource_type = None                # element 4
-    online_resource = None              # element 5
-    unique_id = None                    # element 6
-    uid = None                          # id from the DWS
-    coupled_resource = None             # element 7 TO BE IMPLEMENTED
-    resource_language = None            # element 8
-    topic_category = None               # element 9
-    service_type = None                 # element 10
-    keywords = None                     # element 11
-    bboxes = None                       # element 12
-    extents = None                      # element 13
-    vertical_extent = None              # element 14
-    reference_system = None             # element 15
-    temporal_reference = None           # element 16
-    lineage = None                      # element 17
-    spatial_resolution = None           # element 18
-    additional_info = None              # element 19
-    access_limits = None                # element 20
-    access_conditions = None            # element 21
-    responsible_party = None            # element 22
-    data_format = None                  # element 23
-    update_frequency = None             # element 24
-    inspire_conformity = None           # element 25 TO BE IMPLEMENTED
-    date = None                         # element 26
-    name = None                         # element 27
-    version = None                      # element 28
-    language = None                     # element 29
-    parent_id = None                    # element 30
+
+    __slots__ = ('title',               # element 1
+                 'alt_titles',          # element 2
+                 'abstract',            # element 3
+                 'resource_type',       # element 4
+                 'online_resource',     # element 5
+                 'unique_id',           # element 6
+                 'uid',                 # id from the DWS
+                 'coupled_resource',    # element 7 TO BE IMPLEMENTED
+                 'resource_language',   # element 8
+                 'topic_category',      # element 9
+                 'service_type',        # element 10
+                 'keywords',            # element 11
+                 'bboxes',              # element 12
+                 'extents',             # element 13
+                 'vertical_extent',     # element 14
+                 'reference_system',    # element 15
+                 'temporal_reference',  # element 16
+                 'lineage',             # element 17
+                 'spatial_resolution',  # element 18
+                 'additional_info',     # element 19
+                 'access_limits',       # element 20
+                 'access_conditions',   # element 21
+                 'responsible_party',   # element 22
+                 'data_format',         # element 23
+                 'update_frequency',    # element 24
+                 'inspire_conformity',  # element 25 TO BE IMPLEMENTED
+                 'date',                # element 26
+                 'name',                # element 27
+                 'version',             # element 28
+                 'language',            # element 29
+                 'parent_id',           # element 30
+                 'author')              # the originating organisation
 
     def __init__(self, uid):
+        for attr in self.__slots__:
+            setattr(self, attr, None)
         self.uid = uid
 
+    # the state is required for pickling as the class has no __dict__
+
+    def __getstate__(self):
+        return dict([(attr, getattr(self, attr)) for attr in self.__slots__])
+
+    def __setstate__(self, state):
+        for attr in self.__slots__:
+            setattr(self, attr, state.get(attr))
+
 class HashSet(set):
 
     def __hash__(self):
@@ -399,14 +412,51 @@ class Contact(object):
         
         return serialise(self, 0)
 
-# a decorator that ensures the xpath context is correct
-def _assignContext(f):
-    def newf(self):
-        res = f(self)
-        self.xpath.setContextNode(self.document)
-        return res
-
-    return newf
+# the ISO 19139 namespaces used in MEDIN metadata
+NAMESPACES = {'gmd': 'http://www.isotc211.org/2005/gmd',
+              'gco': 'http://www.isotc211.org/2005/gco',
+              'srv': 'http://www.isotc211.org/2005/srv',
+              'gmx': 'http://www.isotc211.org/2005/gmx',
+              'xlink': 'http://www.w3.org/1999/xlink',
+              'gml': 'http://www.opengis.net/gml/3.2'}
+
+# resource language codes
+LANGUAGES = {'eng': 'English',
+             'cym': 'Welsh/Cymru',
+             'gle': 'Irish (Gaelic)',
+             'gla': 'Scottish (Gaelic)',
+             'cor': 'Cornish'}
+
+# mapping from extent citation title to area code
+AREA_CODES = {'Charting Progress 2 Sea Areas': 'cp',
+              'International Hydrographic Bureau, Limits of Oceans and Seas': 'sa'}
+
+# responsible party role descriptions
+ROLES = {'resourceProvider': 'Party that supplies the resource.',
+         'custodian': 'Party that accepts accountability and responsibility for the data and ensures appropriate care and maintenance of the resource.',
+         'owner': 'Party that owns the resource.',
+         'user': 'Party who uses the resource.',
+         'distributor': 'Party that distributes the resource.',
+         'originator': 'Party who created the resource.',
+         'pointOfContact': 'Party who can be contacted for acquiring knowledge about or acquisition of the resource.',
+         'principalInvestigator': 'Key party responsible for gathering information and conducting research.',
+         'processor': 'Party who has processed the data in a manner such that the resource has been modified.',
+         'publisher': 'Party who published the resource.',
+         'author': 'Party who authored the resource.'}
+
+# maintenance and update frequency codes
+UPDATE_FREQUENCIES = {'continual': 'Data is repeatedly and frequently updated',
+                      'daily': 'Data is updated each day',
+                      'weekly': 'Data is updated on a weekly basis',
+                      'fortnightly': 'Data is updated every two weeks',
+                      'monthly': 'Data is updated each month',
+                      'quarterly': 'Data is updated every three months',
+                      'biannually': 'Data is updated twice each year',
+                      'annually': 'Data is updated every year',
+                      'asNeeded': 'Data is updated as deemed necessary',
+                      'irregular': 'Data is updated at intervals that are uneven in duration',
+                      'notPlanned': 'There are no plans to update the data',
+                      'unknown': 'Frequency of maintenance for the data is not known'}
 
 class Proxy(object):
     """
@@ -421,6 +471,8 @@ class Proxy(object):
         self._obj = obj
 
     def __getattr__(self, name):
+        if name == '_obj':
+            raise AttributeError(name) # the proxy is being unpickled
         return getattr(self._obj, name)
 
 class Year(Proxy):
@@ -452,6 +504,15 @@ class YearMonth(Proxy):
     def __str__(self):
         return self.isoformat()
 
+# a decorator that ensures the xpath context is correct
+def _assignContext(f):
+    def newf(self):
+        res = f(self)
+        self.xpath.setContextNode(self.document)
+        return res
+
+    return newf
+
 class Parser(object):
     """Parses MEDIN XML creating an object model
 
@@ -459,7 +520,7 @@ class Parser(object):
     http://www.oceannet.org/marine_data_standards/medin_approved_standards/documents/medin_schema_documentation_2_3_2_10nov09.doc
     """
     
-    def __init__(self, uid, document, areas, vocab):
+    def __init__(self, uid, document, areas, vocab, cache_key=None):
         import re
         import libxml2
 
@@ -474,16 +535,23 @@ class Parser(object):
 
         # register the namespaces we need to search
         xpath = self.xpath = self.document.xpathNewContext()
-        xpath.xpathRegisterNs('gmd', 'http://www.isotc211.org/2005/gmd')
-        xpath.xpathRegisterNs('gco', 'http://www.isotc211.org/2005/gco')
-        xpath.xpathRegisterNs('srv', 'http://www.isotc211.org/2005/srv')
-        xpath.xpathRegisterNs('gmx', 'http://www.isotc211.org/2005/gmx')
-        xpath.xpathRegisterNs('xlink', 'http://www.w3.org/1999/xlink')
-        xpath.xpathRegisterNs('gml', 'http://www.opengis.net/gml/3.2')
+        for prefix, uri in NAMESPACES.iteritems():
+            xpath.xpathRegisterNs(prefix, uri)
 
         self._keyword_pattern = re.compile('\s*([A-Z]\d+)\s*')
 
-    def parse(self):
+    def parse(self, fields=None):
+        """
+        Return the Metadata with every field parsed
+
+        The `fields` are accepted for compatibility with StreamParser
+        and are ignored. The document is only parsed once.
+        """
+        try:
+            return self._metadata
+        except AttributeError:
+            pass
+
         m = Metadata(self.uid)
         m.title = self.title()          # element 1
         m.alt_titles = self.altTitles() # element 2
@@ -515,7 +583,9 @@ class Parser(object):
         m.version = self.version()      # element 28
         m.language = self.language()    # element 29
         m.parent_id = self.parentID()   # element 30
-        
+        m.author = self.author()
+
+        self._metadata = m
         return m
 
     def xsDate2pyDatetime(self, date):
@@ -648,19 +718,14 @@ class Parser(object):
 
     def resourceLanguage(self):
         """Element 8: Resource Language"""
-        
-        langs = {'eng': 'English',
-                 'cym': 'Welsh/Cymru',
-                 'gle': 'Irish (Gaelic)',
-                 'gla': 'Scottish (Gaelic)',
-                 'cor': 'Cornish'}
+
         try:
             code = self.xpath.xpathEval('//gmd:MD_DataIdentification/gmd:language/gmd:LanguageCode/@codeListValue')[0].content.strip()
         except IndexError:
             return None
 
         try:
-            return langs[code]
+            return LANGUAGES[code]
         except KeyError:
             try:
                 code = self.xpath.xpathEval('//gmd:MD_DataIdentification/gmd:language/gmd:LanguageCode/text()')[0].content.strip()
@@ -733,11 +798,7 @@ class Parser(object):
     @_assignContext
     def extents(self):
         """Element 13: Extent"""
-        
-        # mapping from citation title to area code
-        code_map = {'Charting Progress 2 Sea Areas': 'cp',
-                    'International Hydrographic Bureau, Limits of Oceans and Seas': 'sa'}
-        
+
         extents = []
         for node in self.xpath.xpathEval('//gmd:geographicIdentifier/gmd:MD_Identifier'):
             self.xpath.setContextNode(node)
@@ -752,7 +813,7 @@ class Parser(object):
                 continue
 
             try:
-                code = code_map[title]
+                code = AREA_CODES[title]
                 area_id = self.areas.getAreaId(name, code)
             except KeyError:
                 area_id = None
@@ -1014,18 +1075,6 @@ class Parser(object):
         return contacts.merge()
 
     def _contactDetails(self, node):
-        roles = {'resourceProvider': 'Party that supplies the resource.',
-                 'custodian': 'Party that accepts accountability and responsibility for the data and ensures appropriate care and maintenance of the resource.',
-                 'owner': 'Party that owns the resource.',
-                 'user': 'Party who uses the resource.',
-                 'distributor': 'Party that distributes the resource.',
-                 'originator': 'Party who created the resource.',
-                 'pointOfContact': 'Party who can be contacted for acquiring knowledge about or acquisition of the resource.',
-                 'principalInvestigator': 'Key party responsible for gathering information and conducting research.',
-                 'processor': 'Party who has processed the data in a manner such that the resource has been modified.',
-                 'publisher': 'Party who published the resource.',
-                 'author': 'Party who authored the resource.'}
-        
         self.xpath.setContextNode(node)
 
         try:
@@ -1079,7 +1128,7 @@ class Parser(object):
         except IndexError:
             pass
         else:
-            contact.roles.add(Role(role, roles.get(role, '')))
+            contact.roles.add(Role(role, ROLES.get(role, '')))
 
         try:
             OnlineResource = self.xpath.xpathEval('./gmd:contactInfo/gmd:CI_Contact/gmd:onlineResource/gmd:CI_OnlineResource')[0]
@@ -1123,19 +1172,6 @@ class Parser(object):
 
     def updateFrequency(self):
         """Element 24: Frequency of Update"""
-        
-        codes = {'continual': 'Data is repeatedly and frequently updated',
-                 'daily': 'Data is updated each day',
-                 'weekly': 'Data is updated on a weekly basis',
-                 'fortnightly': 'Data is updated every two weeks',
-                 'monthly': 'Data is updated each month',
-                 'quarterly': 'Data is updated every three months',
-                 'biannually': 'Data is updated twice each year',
-                 'annually': 'Data is updated every year',
-                 'asNeeded': 'Data is updated as deemed necessary',
-                 'irregular': 'Data is updated at intervals that are uneven in duration',
-                 'notPlanned': 'There are no plans to update the data',
-                 'unknown': 'Frequency of maintenance for the data is not known'}
 
         try:
             code = self.xpath.xpathEval('//gmd:MD_DataIdentification/gmd:resourceMaintenance/gmd:MD_MaintenanceInformation/gmd:maintenanceAndUpdateFrequency/gmd:MD_MaintenanceFrequencyCode/@codeListValue')[0].content.strip()
@@ -1143,7 +1179,7 @@ class Parser(object):
             return None
 
         try:
-            return codes[code]
+            return UPDATE_FREQUENCIES[code]
         except KeyError:
             return code
 
@@ -1159,7 +1195,7 @@ class Parser(object):
         else:
             try:
                 return self.xsDate2pyDatetime(date)
-            except ValueError, e:
+            except ValueError:
                 exception = MetadataError('The metadata date is not valid',
                                           'The date retrieved from the XML is not a valid date: %s' % date)
                 if raise_error:
@@ -1172,7 +1208,7 @@ class Parser(object):
             return None
         try:
             return self.xsDatetime2pyDatetime(datetime)
-        except ValueError, e:
+        except ValueError:
             exception = MetadataError('The metadata timestamp is not valid',
                                       'The timestamp retrieved from the XML is not a valid datetime: %s' % date)
             if raise_error:
@@ -1211,19 +1247,843 @@ class Parser(object):
         except IndexError:
             return None
 
+def _compile_path(path):
+    """
+    Compile an XPath location path to a regular expression
+
+    The expression matches the path to an element in the form
+    `/prefix:name/prefix:name...`. Only the child (/) and descendant
+    (//) axes and the * wildcard are supported.
+    """
+    import re
+
+    pattern = []
+    for separator, step in re.findall(r'(//?)([^/]+)', path):
+        step = re.escape(step).replace(r'\*', '[^/]+')
+        if separator == '//':
+            pattern.append('(?:/[^/]+)*/' + step)
+        else:
+            pattern.append('/' + step)
+
+    return re.compile('^%s$' % ''.join(pattern))
+
+def _qualify(path):
+    """
+    Expand the namespace prefixes in an ElementTree path
+
+    Older versions of ElementTree do not accept a namespace mapping.
+    """
+    global _qualified
+    try:
+        return _qualified[path]
+    except KeyError:
+        pass
+    except NameError:
+        _qualified = {}
+
+    steps = []
+    for step in path.split('/'):
+        if ':' in step:
+            prefix, name = step.split(':', 1)
+            step = '{%s}%s' % (NAMESPACES[prefix], name)
+        steps.append(step)
+
+    qualified = _qualified[path] = '/'.join(steps)
+    return qualified
+
+def _find(elem, path):
+    return elem.find(_qualify(path))
+
+def _findall(elem, path):
+    return elem.findall(_qualify(path))
+
+def _content(elem):
+    """
+    Return the stripped text content of an element and its descendants
+    """
+    text = []
+    for node in elem.getiterator():
+        if node.text:
+            text.append(node.text)
+        if node is not elem and node.tail:
+            text.append(node.tail)
+    return ''.join(text).strip()
+
+def _find_content(elem, path):
+    node = _find(elem, path)
+    if node is None:
+        return None
+    return _content(node)
+
+def _find_text(elem, path):
+    for node in _findall(elem, path):
+        if node.text is not None:
+            return node.text.strip()
+    return None
+
+def _find_identifier(elem, path):
+    """
+    Return the codeSpace and text of an identifier as a tuple
+    """
+    nodes = _findall(elem, path)
+    codes = [node.get('codeSpace') for node in nodes if node.get('codeSpace') is not None]
+    texts = [node.text for node in nodes if node.text is not None]
+    if codes and texts:
+        return (codes[0].strip(), texts[0].strip())
+    return None
+
+class StreamParser(object):
+    """Parses MEDIN XML in a single pass, creating an object model
+
+    Elements are parsed according to
+    http://www.oceannet.org/marine_data_standards/medin_approved_standards/documents/medin_schema_documentation_2_3_2_10nov09.doc
+
+    Only the fields of the Metadata that are asked for are extracted.
+    The document is read using iterparse and each element is tested
+    against the rules for the requested fields: only the subtrees of
+    matching elements are kept in memory. Fields are parsed on demand
+    and remembered, so a view needing a few fields asks for them
+    together with parse(fields).
+    """
+
+    # The rules used to populate the Metadata. Each rule is a tuple
+    # of the field, a bucket collecting values for the field, a
+    # location path and a method extracting a value from an element
+    # matching the path. A value of None is ignored.
+    rules = [
+        ('title', 'title', '//gmd:identificationInfo/gmd:MD_DataIdentification/gmd:citation/gmd:CI_Citation/gmd:title', '_getContent'),
+        ('alt_titles', 'alt_titles', '//gmd:alternateTitle/gco:CharacterString', '_getText'),
+        ('abstract', 'abstract', '//gmd:identificationInfo/gmd:MD_DataIdentification/gmd:abstract', '_getContent'),
+        ('resource_type', 'resource_type', '//gmd:hierarchyLevel/gmd:MD_ScopeCode', '_getText'),
+        ('online_resource', 'online_resource', '//gmd:transferOptions/gmd:MD_DigitalTransferOptions/gmd:onLine/gmd:CI_OnlineResource', '_getOnlineResource'),
+        ('unique_id', 'md', '//gmd:MD_DataIdentification//gmd:identifier/gmd:MD_Identifier/gmd:code/gco:CharacterString', '_getText'),
+        ('unique_id', 'rs', '//gmd:MD_DataIdentification//gmd:identifier/gmd:RS_Identifier/gmd:code/gco:CharacterString', '_getText'),
+        ('resource_language', 'resource_language', '//gmd:MD_DataIdentification/gmd:language/gmd:LanguageCode', '_getCode'),
+        ('topic_category', 'topic_category', '//gmd:MD_TopicCategoryCode', '_getText'),
+        ('service_type', 'service_type', '//srv:SV_ServiceIdentification/srv:serviceType/gco:LocalName', '_getText'),
+        ('keywords', 'keywords', '//gmd:descriptiveKeywords/gmd:MD_Keywords', '_getKeywords'),
+        ('bboxes', 'bboxes', '//gmd:EX_Extent/gmd:geographicElement/gmd:EX_GeographicBoundingBox', '_getBBOX'),
+        ('extents', 'extents', '//gmd:geographicIdentifier/gmd:MD_Identifier', '_getExtent'),
+        ('vertical_extent', 'vertical_extent', '//gmd:extent/gmd:EX_Extent/gmd:verticalElement/gmd:EX_VerticalExtent', '_getVerticalExtent'),
+        ('reference_system', 'reference_system', '//gmd:referenceSystemInfo/gmd:MD_ReferenceSystem/gmd:referenceSystemIdentifier/gmd:RS_Identifier/gmd:code/gco:CharacterString', '_getText'),
+        ('temporal_reference', 'begin', '//gmd:EX_Extent/gmd:temporalElement/gmd:EX_TemporalExtent//gml:beginPosition', '_getContent'),
+        ('temporal_reference', 'end', '//gmd:EX_Extent/gmd:temporalElement/gmd:EX_TemporalExtent//gml:endPosition', '_getContent'),
+        ('temporal_reference', 'single', '//gmd:MD_DataIdentification/gmd:citation/gmd:CI_Citation/gmd:date/gmd:CI_Date', '_getCitationDate'),
+        ('lineage', 'lineage', '//gmd:lineage/gmd:LI_Lineage/gmd:statement/gco:CharacterString', '_getContent'),
+        ('spatial_resolution', 'spatial_resolution', '//gmd:MD_DataIdentification/gmd:spatialResolution/gmd:MD_Resolution', '_getResolution'),
+        ('additional_info', 'additional_info', '//gmd:MD_DataIdentification/gmd:supplementalInformation/gco:CharacterString', '_getContent'),
+        ('access_limits', 'codes', '//gmd:MD_DataIdentification/gmd:resourceConstraints/gmd:MD_LegalConstraints/gmd:accessConstraints/gmd:MD_RestrictionCode', '_getContent'),
+        ('access_limits', 'other', '//gmd:MD_DataIdentification/gmd:resourceConstraints/gmd:MD_LegalConstraints/gmd:otherConstraints', '_getContent'),
+        ('access_conditions', 'access_conditions', '//gmd:MD_DataIdentification/gmd:resourceConstraints/gmd:*/gmd:useLimitation', '_getContent'),
+        ('responsible_party', 'contact', '//gmd:MD_Metadata/gmd:contact/gmd:CI_ResponsibleParty', '_getContact'),
+        ('responsible_party', 'identification', '//gmd:MD_Metadata/gmd:identificationInfo/gmd:MD_DataIdentification/gmd:pointOfContact/gmd:CI_ResponsibleParty', '_getContact'),
+        ('responsible_party', 'distribution', '//gmd:MD_Metadata/gmd:distributionInfo/gmd:MD_Distribution/gmd:distributor/gmd:MD_Distributor/gmd:distributorContact/gmd:CI_ResponsibleParty', '_getContact'),
+        ('data_format', 'data_format', '//gmd:MD_DataIdentification/gmd:resourceFormat/gmd:MD_Format', '_getFormat'),
+        ('update_frequency', 'update_frequency', '//gmd:MD_DataIdentification/gmd:resourceMaintenance/gmd:MD_MaintenanceInformation/gmd:maintenanceAndUpdateFrequency/gmd:MD_MaintenanceFrequencyCode', '_getCodeListValue'),
+        ('date', 'date', '/gmd:MD_Metadata/gmd:dateStamp/gco:Date', '_getContent'),
+        ('date', 'datetime', '/gmd:MD_Metadata/gmd:dateStamp/gco:DateTime', '_getContent'),
+        ('name', 'name', '//gmd:MD_Metadata/gmd:metadataStandardName/gco:CharacterString', '_getContent'),
+        ('version', 'version', '//gmd:MD_Metadata/gmd:metadataStandardVersion/gco:CharacterString', '_getContent'),
+        ('language', 'language', '//gmd:MD_Metadata/gmd:language/gmd:LanguageCode', '_getContent'),
+        ('parent_id', 'parent_id', '//gmd:MD_Metadata/gmd:parentIdentifier/gco:CharacterString', '_getContent'),
+        ('author', 'author', '//gmd:CI_ResponsibleParty', '_getAuthor')
+        ]
+
+    # the rules indexed by the name of the element they match
+    _rules = {}
+    for _field, _bucket, _path, _method in rules:
+        _rules.setdefault(_path.rsplit('/', 1)[-1], []).append((_compile_path(_path), _field, _bucket, _method))
+    del _field, _bucket, _path, _method
+
+    # the fields that can be parsed
+    fields = tuple(sorted(set([rule[0] for rule in rules])))
+
+    # fields that are not stored in the metadata cache: the spatial
+    # reference system is an object from the EPSG registry
+    uncached = frozenset(['reference_system'])
+
+    def __init__(self, uid, document, areas, vocab, cache_key=None):
+        self.uid = uid
+        self.document = document
+        self.areas = areas
+        self.vocab = vocab
+        self.cache_key = cache_key
+        self.metadata = Metadata(uid)
+        self._parsed = set()
+
+        # start from any fields parsed previously
+        from copy import copy
+        cache = get_metadata_cache()
+        if cache is not None and cache_key is not None:
+            entry = cache.get(cache_key)
+            if entry is not None:
+                metadata, parsed = entry
+                self.metadata = copy(metadata)
+                self._parsed.update(parsed)
+
+    def parse(self, fields=None):
+        """
+        Return the Metadata, ensuring the specified fields are parsed
+
+        All fields are parsed if `fields` is None. The fields are the
+        names of the Metadata attributes.
+        """
+        if fields is None:
+            fields = self.fields
+
+        missing = set(fields) - self._parsed
+        if missing:
+            unknown = missing.difference(self.fields)
+            if unknown:
+                raise ValueError('Unknown metadata fields: %s' % ', '.join(sorted(unknown)))
+
+            buckets = self.walk(missing)
+            for field in missing:
+                value = getattr(self, '_finish_' + field)(buckets)
+                setattr(self.metadata, field, value)
+            self._parsed.update(missing)
+
+            if not missing.issubset(self.uncached):
+                self.store()
+
+        return self.metadata
+
+    def store(self):
+        """
+        Store the parsed fields in the metadata cache
+
+        A copy is stored as views may modify the Metadata they are
+        given.
+        """
+        from copy import copy
+
+        cache = get_metadata_cache()
+        if cache is None or self.cache_key is None:
+            return
+
+        metadata = copy(self.metadata)
+        for field in self.uncached:
+            setattr(metadata, field, None)
+
+        cache.set(self.cache_key, (metadata, tuple(self._parsed - self.uncached)))
+
+    def walk(self, fields):
+        """
+        Make a single pass over the document applying the rules for the fields
+
+        A dictionary mapping bucket names to the list of values
+        extracted from the document is returned.
+        """
+        from xml.etree.cElementTree import iterparse
+        from cStringIO import StringIO
+
+        # only apply the rules for the requested fields
+        rules = {}
+        buckets = {}
+        for name, candidates in self._rules.iteritems():
+            candidates = [rule for rule in candidates if rule[1] in fields]
+            if candidates:
+                rules[name] = candidates
+            for regex, field, bucket, method in candidates:
+                buckets[bucket] = []
+
+        prefixes = dict([(uri, prefix) for prefix, uri in NAMESPACES.iteritems()])
+        names = {}                      # element tag -> prefixed name
+        path = []                       # the prefixed names of the open elements
+        matches = []                    # the rules matching each open element
+        keep = 0                        # the number of open elements being kept
+
+        try:
+            for event, elem in iterparse(StringIO(self.document), ('start', 'end')):
+                if event == 'start':
+                    tag = elem.tag
+                    try:
+                        name = names[tag]
+                    except KeyError:
+                        uri, local = tag[1:].split('}', 1) if tag.startswith('{') else ('', tag)
+                        name = names[tag] = '%s:%s' % (prefixes.get(uri, uri), local)
+                    path.append(name)
+
+                    matched = None
+                    try:
+                        candidates = rules[name]
+                    except KeyError:
+                        pass
+                    else:
+                        elem_path = '/' + '/'.join(path)
+                        matched = [rule for rule in candidates if rule[0].match(elem_path)]
+                        if matched:
+                            keep += 1
+                    matches.append(matched)
+                else:
+                    matched = matches.pop()
+                    if matched:
+                        for regex, field, bucket, method in matched:
+                            value = getattr(self, method)(elem)
+                            if value is not None:
+                                buckets[bucket].append(value)
+                        keep -= 1
+
+                    if not keep:
+                        elem.clear()    # the element is no longer needed
+                    path.pop()
+        except SyntaxError, e:
+            raise ValueError('The metadata document could not be parsed: %s' % str(e))
+
+        return buckets
+
+    def xsDate2pyDatetime(self, date):
+        """
+        Parse a date string into a datetime object
+        """
+        import datetime
+        global _datep
+        try:
+            datep = _datep
+        except NameError:
+            from re import compile
+            # create a pattern that matches any isoformat date or time
+            datep = _datep = compile('^(?P<year>\d{4})(?:-(?P<month>\d{2})(?:-(?P<day>\d{2}))?)?$')
+
+        try:
+            groups = datep.match(date.strip()).groupdict()
+        except AttributeError:
+            raise ValueError('Bad date value: %s' % str(date))
+
+        if groups['day']:
+            # it is a date object
+            return datetime.date(*[int(groups[k]) for k in ('year', 'month', 'day')])
+        elif groups['month']:
+            #  it is a YearMonth object
+            return YearMonth(*[int(groups[k]) for k in ('year', 'month')])
+
+        # it's a Year object
+        return Year(int(groups['year']))
+        
+    def xsDatetime2pyDatetime(self, timestamp):
+        import datetime
+        return datetime.datetime.strptime(timestamp, '%Y-%m-%dT%H:%M:%S')
+
+    def author(self):
+        """The organisation of the originator"""
+        return self.parse(['author']).author
+
+    # ELEMENTS ACCORDING TO THE MEDIN STANDARD:
+
+    def title(self):
+        """Element 1: Resource Title"""
+        return self.parse(['title']).title
+
+    def altTitles(self):
+        """Element 2: Alternative Resource Title"""
+        return self.parse(['alt_titles']).alt_titles
+
+    def abstract(self):
+        """Element 3: Resource Abstract"""
+        return self.parse(['abstract']).abstract
+
+    def resourceType(self):
+        """Element 4: Resource Type"""
+        return self.parse(['resource_type']).resource_type
+
+    def resourceLocators(self):
+        """Element 5: Resource Locator"""
+        return self.parse(['online_resource']).online_resource
+
+    def uniqueID(self):
+        """Element 6: Unique Resource Identifier"""
+        return self.parse(['unique_id']).unique_id
+
+    def resourceLanguage(self):
+        """Element 8: Resource Language"""
+        return self.parse(['resource_language']).resource_language
+
+    def topicCategory(self):
+        """Element 9: Topic Category"""
+        return self.parse(['topic_category']).topic_category
+
+    def serviceType(self):
+        """Element 10: Spatial Data Service Type"""
+        return self.parse(['service_type']).service_type
+
+    def keywords(self):
+        """Element 11: Keywords"""
+        return self.parse(['keywords']).keywords
+
+    def bboxes(self):
+        """Element 12: Geographic Bounding Box"""
+        return self.parse(['bboxes']).bboxes
+
+    def extents(self):
+        """Element 13: Extent"""
+        return self.parse(['extents']).extents
+
+    def verticalExtent(self):
+        """Element 14: Vertical Extent Information"""
+        return self.parse(['vertical_extent']).vertical_extent
+
+    def referenceSystem(self):
+        """Element 15: Spatial Reference System"""
+        return self.parse(['reference_system']).reference_system
+
+    def temporalReference(self):
+        """Element 16: Temporal Reference"""
+        return self.parse(['temporal_reference']).temporal_reference
+
+    def lineage(self):
+        """Element 17: Lineage"""
+        return self.parse(['lineage']).lineage
+
+    def spatialResolution(self):
+        """Element 18: Spatial Resolution"""
+        return self.parse(['spatial_resolution']).spatial_resolution
+
+    def additionalInfo(self):
+        """Element 19: Additional Information Source"""
+        return self.parse(['additional_info']).additional_info
+
+    def accessLimits(self):
+        """Element 20: Limitations On Public Access"""
+        return self.parse(['access_limits']).access_limits
+
+    def accessConditions(self):
+        """Element 21: Conditions Applying For Access And Use"""
+        return self.parse(['access_conditions']).access_conditions
+
+    def responsibleParty(self):
+        """Element 22: Responsible Party"""
+        return self.parse(['responsible_party']).responsible_party
+
+    def dataFormat(self):
+        """Element 23: Data Format"""
+        return self.parse(['data_format']).data_format
+
+    def updateFrequency(self):
+        """Element 24: Frequency of Update"""
+        return self.parse(['update_frequency']).update_frequency
+
+    def date(self, raise_error=True):
+        """Element 26: Metadata Date"""
+        date = self.parse(['date']).date
+        if raise_error and isinstance(date, MetadataError):
+            raise date
+        return date
+
+    def name(self):
+        """Element 27: Metadata Standard Name"""
+        return self.parse(['name']).name
+
+    def version(self):
+        """Element 28: Metadata Standard Version"""
+        return self.parse(['version']).version
+
+    def language(self):
+        """Element 29: Metadata Language"""
+        return self.parse(['language']).language
+
+    def parentID(self):
+        """Element 30: Parent ID"""
+        return self.parse(['parent_id']).parent_id
+
+    # Methods extracting values from elements
+
+    def _getContent(self, elem):
+        return _content(elem)
+
+    def _getText(self, elem):
+        if elem.text is None:
+            return None
+        return elem.text.strip()
+
+    def _getCodeListValue(self, elem):
+        value = elem.get('codeListValue')
+        if value is None:
+            return None
+        return value.strip()
+
+    def _getCode(self, elem):
+        return (self._getCodeListValue(elem), self._getText(elem))
+
+    def _getOnlineResource(self, elem):
+        link = _find_text(elem, 'gmd:linkage/gmd:URL')
+        if link is None:
+            return None
+
+        return {'link': link,
+                'name': _find_text(elem, 'gmd:name/gco:CharacterString'),
+                'description': _find_text(elem, 'gmd:description/gco:CharacterString')}
+
+    def _getKeywords(self, elem):
+        tags = ('{%s}CharacterString' % NAMESPACES['gco'], '{%s}Anchor' % NAMESPACES['gmx'])
+        keywords = []
+        for keyword in _findall(elem, 'gmd:keyword'):
+            for node in keyword:
+                if node.tag in tags and node.text is not None:
+                    keywords.append(node.text.strip())
+        return keywords
+
+    def _getBBOX(self, elem):
+        ordinates = []
+        for direction, latlon in (('west', 'Longitude'), ('south', 'Latitude'), ('east', 'Longitude'), ('north', 'Latitude')):
+            ordinate = _find_text(elem, 'gmd:%sBound%s/gco:Decimal' % (direction, latlon))
+            if ordinate is None:
+                return False    # this invalidates all the boxes
+            ordinates.append(float(ordinate))
+        return tuple(ordinates)
+
+    def _getExtent(self, elem):
+        title = _find_text(elem, 'gmd:authority/gmd:CI_Citation/gmd:title/gco:CharacterString')
+        name = _find_text(elem, 'gmd:code/gco:CharacterString')
+        if title is None or name is None:
+            return None
+        return (title, name)
+
+    def _getVerticalExtent(self, elem):
+        extents = {}
+        for text, path in (('min-value', 'gmd:minimumValue/gco:Real'),
+                           ('max-value', 'gmd:maximumValue/gco:Real')):
+            content = _find_content(elem, path)
+            if content is not None:
+                extents[text] = content
+
+        href = '{%s}href' % NAMESPACES['xlink']
+        for node in _findall(elem, 'gmd:verticalCRS'):
+            if node.get(href) is not None:
+                extents['crs'] = node.get(href).strip()
+                break
+
+        node = _find(elem, 'gmd:verticalCRS/gml:VerticalCRS')
+        if node is None:
+            return extents
+
+        cs = 'gml:verticalCS/gml:VerticalCS/'
+        axis = cs + 'gml:axis/gml:CoordinateSystemAxis/'
+        datum = 'gml:verticalDatum/gml:VerticalDatum/'
+        for key, path in (('crs-id', 'gml:identifier'),
+                          ('cs-id', cs + 'gml:identifier'),
+                          ('csaxis-id', axis + 'gml:identifier'),
+                          ('datum-id', datum + 'gml:identifier')):
+            identifier = _find_identifier(node, path)
+            if identifier:
+                extents[key] = identifier
+
+        for key, path in (('crs-name', 'gml:name'),
+                          ('crs-scope', 'gml:scope'),
+                          ('cs-name', cs + 'gml:name'),
+                          ('datum-name', datum + 'gml:name'),
+                          ('datum-scope', datum + 'gml:scope'),
+                          ('datum-info', datum + 'gml:anchorDefinition')):
+            content = _find_content(node, path)
+            if content is not None:
+                extents[key] = content
+
+        abbrev = _find_text(node, axis + 'gml:axisAbbrev')
+        direction = _find_text(node, axis + 'gml:axisDirection')
+        if abbrev is not None and direction is not None:
+            extents['csaxis-info'] = (abbrev, direction)
+
+        return extents
+
+    def _getCitationDate(self, elem):
+        date = _find_content(elem, 'gmd:date/gco:Date')
+        code = _find_content(elem, 'gmd:dateType/gmd:CI_DateTypeCode')
+        if date is None or code is None:
+            return None
+        return (code, date)
+
+    def _getResolution(self, elem):
+        entry = {}
+        distance = _find_content(elem, 'gmd:distance/gco:Distance')
+        if distance is not None:
+            entry['distance'] = distance
+
+        scale = _find_content(elem, 'gmd:equivalentScale/gmd:MD_RepresentativeFraction/gmd:denominator')
+        if scale is not None:
+            entry['scale'] = scale
+
+        return entry or None
+
+    def _getContact(self, elem):
+        contact = Contact(_find_content(elem, 'gmd:organisationName'))
+
+        name = _find_content(elem, 'gmd:individualName')
+        if name is not None:
+            contact.name = name
+
+        position = _find_content(elem, 'gmd:positionName')
+        if position is not None:
+            contact.position = position
+
+        address = [_content(node) for node in _findall(elem, 'gmd:contactInfo/gmd:CI_Contact/gmd:address/gmd:CI_Address/gmd:deliveryPoint')]
+        for tag in ('city', 'postalCode', 'country'):
+            content = _find_content(elem, 'gmd:contactInfo/gmd:CI_Contact/gmd:address/gmd:CI_Address/gmd:%s' % tag)
+            if content is not None:
+                address.append(content)
+
+        if address:
+            contact.address = ', '.join(address)
+
+        for attr, path in (('tel', 'gmd:contactInfo/gmd:CI_Contact/gmd:phone/gmd:CI_Telephone/gmd:voice'),
+                           ('fax', 'gmd:contactInfo/gmd:CI_Contact/gmd:phone/gmd:CI_Telephone/gmd:facsimile'),
+                           ('email', 'gmd:contactInfo/gmd:CI_Contact/gmd:address/gmd:CI_Address/gmd:electronicMailAddress')):
+            content = _find_content(elem, path)
+            if content is not None:
+                setattr(contact, attr, content)
+
+        role = _find_content(elem, 'gmd:role/gmd:CI_RoleCode')
+        if role is not None:
+            contact.roles.add(Role(role, ROLES.get(role, '')))
+
+        node = _find(elem, 'gmd:contactInfo/gmd:CI_Contact/gmd:onlineResource/gmd:CI_OnlineResource')
+        if node is not None:
+            resource = self._getOnlineResource(node)
+            if resource:
+                contact.url = resource['link']
+
+        return contact
+
+    def _getFormat(self, elem):
+        return _find_content(elem, 'gmd:name/gco:CharacterString')
+
+    def _getAuthor(self, elem):
+        for code in _findall(elem, 'gmd:role/gmd:CI_RoleCode'):
+            if code.get('codeListValue') == 'originator':
+                return _find_content(elem, 'gmd:organisationName/gco:CharacterString')
+        return None
+
+    # Methods creating the fields from the extracted values
+
+    def _first(self, values):
+        try:
+            return values[0]
+        except IndexError:
+            return None
+
+    def _defn(self, key, collection):
+        concept = self.vocab.getMatchingConcept(key, collection)
+        if not concept:
+            return {'short': key,
+                    'long': key,
+                    'defn': 'Unknown term'}
+
+        return {'short': concept.prefLabel,
+                'long': concept.prefLabel,
+                'defn': concept.definition}
+
+    def _finish_title(self, buckets):
+        return self._first(buckets['title'])
+
+    def _finish_alt_titles(self, buckets):
+        return buckets['alt_titles']
+
+    def _finish_abstract(self, buckets):
+        return self._first(buckets['abstract'])
+
+    def _finish_resource_type(self, buckets):
+        code = self._first(buckets['resource_type'])
+        if code is None:
+            return None
+        return self._defn(code, 'medin-resource-types.xml')
+
+    def _finish_online_resource(self, buckets):
+        return buckets['online_resource']
+
+    def _finish_unique_id(self, buckets):
+        return self._first(buckets['md'] or buckets['rs'])
+
+    def _finish_resource_language(self, buckets):
+        codes = [code for code, text in buckets['resource_language'] if code is not None]
+        if not codes:
+            return None
+
+        try:
+            return LANGUAGES[codes[0]]
+        except KeyError:
+            texts = [text for code, text in buckets['resource_language'] if text is not None]
+            return self._first(texts) or codes[0]
+
+    def _finish_topic_category(self, buckets):
+        return dict([(key, self._defn(key, 'http://vocab.nerc.ac.uk/collection/P05/current')) for key in buckets['topic_category']])
+
+    def _finish_service_type(self, buckets):
+        return buckets['service_type']
+
+    def _finish_keywords(self, buckets):
+        keywords = []
+        for words in buckets['keywords']:
+            keywords.extend(words)
+        return keywords
+
+    def _finish_bboxes(self, buckets):
+        boxes = buckets['bboxes']
+        if False in boxes:
+            return []
+        return boxes
+
+    def _finish_extents(self, buckets):
+        extents = []
+        for title, name in buckets['extents']:
+            try:
+                area_id = self.areas.getAreaId(name, AREA_CODES[title])
+            except KeyError:
+                area_id = None
+            extents.append(dict(title=title, name=name, id=area_id))
+        return extents
+
+    def _finish_vertical_extent(self, buckets):
+        return self._first(buckets['vertical_extent'])
+
+    def _finish_reference_system(self, buckets):
+        code = self._first(buckets['reference_system'])
+        if code is None:
+            return MetadataError('Unknown spatial reference system', 'The spatial reference system could not be extracted from the metadata')
+
+        from sr import resolve
+        return resolve(code)
+
+    def _finish_temporal_reference(self, buckets):
+        dates = {}
+        if buckets['begin'] and buckets['end']:
+            try:
+                dates['range'] = [self.xsDate2pyDatetime(buckets['begin'][0]), self.xsDate2pyDatetime(buckets['end'][0])]
+            except ValueError:
+                pass
+
+        single = []
+        for code, date in buckets['single']:
+            try:
+                single.append((code, self.xsDate2pyDatetime(date)))
+            except ValueError:
+                continue
+
+        if single:
+            dates['single'] = single
+
+        return dates
+
+    def _finish_lineage(self, buckets):
+        return self._first(buckets['lineage'])
+
+    def _finish_spatial_resolution(self, buckets):
+        return buckets['spatial_resolution']
+
+    def _finish_additional_info(self, buckets):
+        return self._first(buckets['additional_info'])
+
+    def _finish_access_limits(self, buckets):
+        limits = [self._defn(key, 'medin-access-types.xml') for key in buckets['codes']]
+        limits.extend([{'other': other} for other in buckets['other']])
+        return limits
+
+    def _finish_access_conditions(self, buckets):
+        return buckets['access_conditions']
+
+    def _finish_responsible_party(self, buckets):
+        contacts = Contacts(buckets['contact'] + buckets['identification'] + buckets['distribution'])
+        return contacts.merge()
+
+    def _finish_data_format(self, buckets):
+        return dict([(key, self._defn(key, 'http://vocab.nerc.ac.uk/collection/M01/current')) for key in buckets['data_format'] if key])
+
+    def _finish_update_frequency(self, buckets):
+        code = self._first(buckets['update_frequency'])
+        if code is None:
+            return None
+        return UPDATE_FREQUENCIES.get(code, code)
+
+    def _finish_date(self, buckets):
+        date = self._first(buckets['date'])
+        if date is not None:
+            try:
+                return self.xsDate2pyDatetime(date)
+            except ValueError:
+                return MetadataError('The metadata date is not valid',
+                                     'The date retrieved from the XML is not a valid date: %s' % date)
+
+        timestamp = self._first(buckets['datetime'])
+        if timestamp is None:
+            return None
+        try:
+            return self.xsDatetime2pyDatetime(timestamp)
+        except ValueError:
+            return MetadataError('The metadata timestamp is not valid',
+                                 'The timestamp retrieved from the XML is not a valid datetime: %s' % timestamp)
+
+    def _finish_name(self, buckets):
+        return self._first(buckets['name'])
+
+    def _finish_version(self, buckets):
+        return self._first(buckets['version'])
+
+    def _finish_language(self, buckets):
+        return self._first(buckets['language'])
+
+    def _finish_parent_id(self, buckets):
+        return self._first(buckets['parent_id'])
+
+    def _finish_author(self, buckets):
+        return self._first(buckets['author'])
+
+def set_metadata_cache(cache):
+    """
+    Set the cache used to share parsed Metadata between requests
+
+    Entries are keyed on the metadata record identifier and its update
+    date so a new version of a record is always parsed afresh. A cache
+    of None disables the caching.
+    """
+    global _metadata_cache
+    _metadata_cache = cache
+
+def get_metadata_cache():
+    return _metadata_cache
+
+_metadata_cache = None
+
+PARSERS = {'stream': StreamParser,
+           'libxml2': Parser}
+
+_parser = StreamParser
+
+def set_parser(name):
+    """
+    Set the parser used for metadata records by name
+
+    The `stream` parser (StreamParser) extracts the requested fields
+    using ElementTree. The `libxml2` parser (Parser) extracts every
+    field using libxml2 XPath queries.
+    """
+    global _parser
+    try:
+        _parser = PARSERS[name.lower()]
+    except KeyError:
+        raise ValueError('Unknown metadata parser: %s' % name)
+
+def get_parser():
+    return _parser
+
+def metadata_cache_key(gid, updated):
+    """
+    Return the metadata cache key for a record, or None
+
+    None is returned if the update date of the record is unknown.
+    """
+    if not updated:
+        return None
+    return 'metadata:%s:%s' % (gid, updated)
 
 # This could usefully be turned into an object; at the moment it's a
 # bit of a hack.
-def metadata2csv(metadata, file):
+def metadata2rows(metadata):
     """
-    Write a metadata object to a file in CSV format
+    Generate the CSV rows representing a metadata object
     """
 
-    import csv, itertools
+    import itertools
     from itertools import repeat
 
     def iter_element_values(element_no, element_title, values):
-        """Returns an iterator suitable for passing to the CSV writerows method"""
+        """Returns an iterator over the CSV rows for an element"""
 
         if isinstance(values, Exception):
             values = [['ERROR', values.message, values.detail]]
@@ -1261,13 +2121,10 @@ def metadata2csv(metadata, file):
             for row in iter_contacts(contact.contacts, depth+1):
                 yield row
 
-    def write_element(writer, number, name, element):
+    def element_row(number, name, element):
         if isinstance(element, Exception):
-            row = [number, name, 'ERROR', element.message, element.detail]
-        else:
-            row = [number, name, element]
-
-        writer.writerow(row)
+            return [number, name, 'ERROR', element.message, element.detail]
+        return [number, name, element]
 
     def vocab2row(vocab, default=None):
         if vocab:
@@ -1278,27 +2135,25 @@ def metadata2csv(metadata, file):
 
         return default
 
-    writer = csv.writer(file)
-
-    writer.writerow(['Element number', 'Element title', 'Element Values']) # header row
+    yield ['Element number', 'Element title', 'Element Values'] # header row
 
-    write_element(writer, 1, 'Title', metadata.title)
-    writer.writerows(iter_element_values(2, 'Alternative resource title', metadata.alt_titles))
-    write_element(writer, 3, 'Abstract', metadata.abstract)
+    yield element_row(1, 'Title', metadata.title)
+    for line in iter_element_values(2, 'Alternative resource title', metadata.alt_titles): yield line
+    yield element_row(3, 'Abstract', metadata.abstract)
 
     row = metadata.resource_type
     if row and not isinstance(row, Exception):
         row = [vocab2row(row, [])]
-    writer.writerows(iter_element_values(4, 'Resource type', row))
+    for line in iter_element_values(4, 'Resource type', row): yield line
 
     row = metadata.online_resource
     if row and not isinstance(row, Exception):
         row = [[i['link'], i['name'], i['description']] for i in row]
-    writer.writerows(iter_element_values(5, 'Resource locator', row))
+    for line in iter_element_values(5, 'Resource locator', row): yield line
 
-    write_element(writer, 6, 'Unique resource identifier', metadata.unique_id)
-    writer.writerow([7, 'Coupled resource', 'NOT IMPLEMENTED IN THE PORTAL YET'])
-    write_element(writer, 8, 'Resource language', metadata.resource_language)
+    yield element_row(6, 'Unique resource identifier', metadata.unique_id)
+    yield [7, 'Coupled resource', 'NOT IMPLEMENTED IN THE PORTAL YET']
+    yield element_row(8, 'Resource language', metadata.resource_language)
 
     row = metadata.topic_category
     if row and not isinstance(row, Exception):
@@ -1307,11 +2162,11 @@ def metadata2csv(metadata, file):
             entry = vocab2row(defn, [keyword])
             tmp.append(entry)
         row = tmp
-    writer.writerows(iter_element_values(9, 'Topic category', row))
+    for line in iter_element_values(9, 'Topic category', row): yield line
 
-    writer.writerows(iter_element_values(10, 'Spatial data service type', metadata.service_type))
+    for line in iter_element_values(10, 'Spatial data service type', metadata.service_type): yield line
 
-    writer.writerows(iter_element_values(11, 'Keywords', metadata.keywords))
+    for line in iter_element_values(11, 'Keywords', metadata.keywords): yield line
 
     row = metadata.bboxes
     boxes = []
@@ -1323,14 +2178,14 @@ def metadata2csv(metadata, file):
                  ['East', box[2]],
                  ['North', box[3]]]
                 )
-    writer.writerows(iter_element_values(12, 'Geographic extent', boxes))
+    for line in iter_element_values(12, 'Geographic extent', boxes): yield line
 
     row = metadata.extents
     if row and not isinstance(row, Exception):
         row = [[i['title'], i['name']] for i in row]
-    writer.writerows(iter_element_values(13, 'Extent', row))
+    for line in iter_element_values(13, 'Extent', row): yield line
 
-    writer.writerows(iter_element_values(14, 'Vertical extent information', metadata.vertical_extent))
+    for line in iter_element_values(14, 'Vertical extent information', metadata.vertical_extent): yield line
 
     row = metadata.reference_system
     if row and not isinstance(row, Exception):
@@ -1340,7 +2195,7 @@ def metadata2csv(metadata, file):
                 continue
             tmp.append([key.capitalize(), getattr(row, key)])
         row = tmp
-    writer.writerows(iter_element_values(15, 'Spatial reference system', row))
+    for line in iter_element_values(15, 'Spatial reference system', row): yield line
 
     row = metadata.temporal_reference
     if row and not isinstance(row, Exception):
@@ -1352,9 +2207,9 @@ def metadata2csv(metadata, file):
         if 'single' in row:
             tmp.extend([[code, str(date)] for code, date in row['single']])
         row = tmp
-    writer.writerows(iter_element_values(16, 'Temporal reference', row))
+    for line in iter_element_values(16, 'Temporal reference', row): yield line
 
-    write_element(writer, 17, 'Lineage', metadata.lineage)
+    yield element_row(17, 'Lineage', metadata.lineage)
 
     row = metadata.spatial_resolution
     if row and not isinstance(row, Exception):
@@ -1365,9 +2220,9 @@ def metadata2csv(metadata, file):
             if 'scale' in entry:
                 tmp.append(['Scale 1:', entry['scale']])
         row = tmp
-    writer.writerows(iter_element_values(18, 'Spatial resolution', row))
+    for line in iter_element_values(18, 'Spatial resolution', row): yield line
 
-    write_element(writer, 19, 'Additional information', metadata.additional_info)
+    yield element_row(19, 'Additional information', metadata.additional_info)
 
     row = metadata.access_limits
     if row and not isinstance(row, Exception):
@@ -1379,10 +2234,10 @@ def metadata2csv(metadata, file):
                 entry = vocab2row(defn, [])
             tmp.append(entry)
         row = tmp
-    writer.writerows(iter_element_values(20, 'Limitations on public access', row))
+    for line in iter_element_values(20, 'Limitations on public access', row): yield line
 
-    writer.writerows(iter_element_values(21, 'Conditions for access and use constraints', metadata.access_conditions))
-    writer.writerows(iter_element_values(22, 'Responsible party', list(iter_contacts(metadata.responsible_party))))
+    for line in iter_element_values(21, 'Conditions for access and use constraints', metadata.access_conditions): yield line
+    for line in iter_element_values(22, 'Responsible party', list(iter_contacts(metadata.responsible_party))): yield line
 
     row = metadata.data_format
     if row and not isinstance(row, Exception):
@@ -1391,19 +2246,29 @@ def metadata2csv(metadata, file):
             entry = vocab2row(defn, [keyword])
             tmp.append(entry)
         row = tmp
-    writer.writerows(iter_element_values(23, 'Data format', row))
+    for line in iter_element_values(23, 'Data format', row): yield line
 
-    write_element(writer, 24, 'Frequency of update', metadata.update_frequency)
-    write_element(writer, 25, 'INSPIRE conformity', 'NOT IMPLEMENTED IN THE PORTAL YET')
+    yield element_row(24, 'Frequency of update', metadata.update_frequency)
+    yield element_row(25, 'INSPIRE conformity', 'NOT IMPLEMENTED IN THE PORTAL YET')
 
     date = metadata.date
     if date and not isinstance(date, Exception): date = str(date)
-    write_element(writer, 26, 'Date of update of metadata', date)
+    yield element_row(26, 'Date of update of metadata', date)
 
-    write_element(writer, 27, 'Metadata standard name', metadata.name)  
-    write_element(writer, 28, 'Metadata standard version', metadata.version)
-    write_element(writer, 29, 'Metadata language', metadata.language)
-    write_element(writer, 30, 'Parent ID', metadata.parent_id)
+    yield element_row(27, 'Metadata standard name', metadata.name)
+    yield element_row(28, 'Metadata standard version', metadata.version)
+    yield element_row(29, 'Metadata language', metadata.language)
+    yield element_row(30, 'Parent ID', metadata.parent_id)
+
+def metadata2csv(metadata, file):
+    """
+    Write a metadata object to a file in CSV format
+    """
+
+    import csv
+
+    writer = csv.writer(file)
+    writer.writerows(metadata2rows(metadata))
 
 
 if __name__ == '__main__':
@@ -0,0 +1,574 @@
+# Created by Homme Zwaagstra
+#
+# Copyright (c) 2010 GeoData Institute
+# http://www.geodata.soton.ac.uk
+# geodata@soton.ac.uk
+#
+# Unless explicitly acquired and licensed from Licensor under another
+# license, the contents of this file are subject to the Reciprocal
+# Public License ("RPL") Version 1.5, or subsequent versions as
+# allowed by the RPL, and You may not copy or use this file in either
+# source code or executable form, except in compliance with the terms
+# and conditions of the RPL.
+#
+# All software distributed under the RPL is provided strictly on an
+# "AS IS" basis, WITHOUT WARRANTY OF ANY KIND, EITHER EXPRESS OR
+# IMPLIED, AND LICENSOR HEREBY DISCLAIMS ALL SUCH WARRANTIES,
+# INCLUDING WITHOUT LIMITATION, ANY WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE, QUIET ENJOYMENT, OR
+# NON-INFRINGEMENT. See the RPL for specific language governing rights
+# and limitations under the RPL.
+#
+# You can obtain a full copy of the RPL from
+# http://opensource.org/licenses/rpl1.5.txt or geodata@soton.ac.uk
+
+"""
+A local mirror of the DWS metadata records
+
+The Harvester copies the summary of every record in the DWS into a
+SQLite database with a full text index. A SearchIndex answers portal
+searches from this database, providing the same interface as the
+dws.SearchRequest so it can be used in its place. The DWS remains the
+source of truth: the mirror is brought up to date by harvesting the
+records that have changed since it was last updated.
+"""
+
+import os
+import sqlite3
+from datetime import datetime
+
+from medin.dws import Request, SearchCaller, SummaryResponse, DWSError, \
+     RESULT_SIMPLE, RESULT_BRIEF, RESULT_SUMMARY, result_range
+
+# the format used by the DWS for dates
+DATE_FORMAT = '%Y-%m-%d %H:%M:%S.%f'
+
+# the columns in the full text index
+TEXT_COLUMNS = ('title', 'abstract', 'authors', 'parameters', 'resource_type',
+                'topic_category', 'lineage', 'public_access', 'originator', 'format')
+
+SCHEMA = ['''
+CREATE TABLE IF NOT EXISTS documents (
+    id INTEGER PRIMARY KEY,
+    gid TEXT NOT NULL UNIQUE,
+    title TEXT,
+    abstract TEXT,
+    authors TEXT,
+    parameters TEXT,
+    resource_type TEXT,
+    topic_category TEXT,
+    lineage TEXT,
+    public_access TEXT,
+    originator TEXT,
+    format TEXT,
+    updated TEXT,
+    temporal_start TEXT,
+    temporal_end TEXT
+)''',
+'CREATE INDEX IF NOT EXISTS documents_updated ON documents (updated)',
+'CREATE INDEX IF NOT EXISTS documents_title ON documents (title COLLATE NOCASE)',
+'CREATE INDEX IF NOT EXISTS documents_originator ON documents (originator COLLATE NOCASE)',
+'''
+CREATE TABLE IF NOT EXISTS bboxes (
+    document_id INTEGER NOT NULL REFERENCES documents (id),
+    minx REAL NOT NULL,
+    miny REAL NOT NULL,
+    maxx REAL NOT NULL,
+    maxy REAL NOT NULL
+)''',
+'CREATE INDEX IF NOT EXISTS bboxes_document ON bboxes (document_id)',
+'CREATE VIRTUAL TABLE IF NOT EXISTS documents_fts USING fts4(%s, tokenize=porter)' % ', '.join(TEXT_COLUMNS),
+'''
+CREATE TABLE IF NOT EXISTS harvests (
+    finished TEXT NOT NULL,
+    full INTEGER NOT NULL,
+    records INTEGER NOT NULL
+)''']
+
+class HarvestResponse(SummaryResponse):
+    """
+    A DWS summary response including the temporal extent of each record
+    """
+
+    def _processDocument(self, doc):
+        dates = []
+        for temporal in getattr(doc, 'Temporal', None) or []:
+            try:
+                values = temporal.DateRange.Date
+            except AttributeError:
+                continue
+            for value in values:
+                date = getattr(value, 'DateValue', None)
+                if date:
+                    dates.append(str(date)[:10]) # an ISO date
+
+        ret = super(HarvestResponse, self)._processDocument(doc)
+        if dates:
+            ret['temporal'] = (min(dates), max(dates))
+        else:
+            ret['temporal'] = (None, None)
+
+        return ret
+
+class Harvester(Request):
+    """
+    Copy the DWS records into the mirror database
+
+    Records are retrieved from the DWS in pages of `page_size` summary
+    documents, most recently updated first.
+    """
+
+    def __init__(self, path, logger, page_size=300, wsdl=None):
+        super(Harvester, self).__init__(wsdl)
+        self.path = path
+        self.logger = logger
+        self.page_size = page_size
+
+    def prepareCaller(self, start_index):
+        # retrieve the most recently updated summaries first, ordered
+        # by the update date that store() compares
+        retrieve = self.client.factory.create('ns0:RetrieveCriteriaType')
+        retrieve.RecordDetail = HarvestResponse.doc_type
+        order_by = self.client.factory.create('ns0:OrderByType')
+        order_by.OrderByField = 'DatasetUpdateDate'
+        order_by.OrderByDirection = 'descending'
+        retrieve.OrderBy.append(order_by)
+
+        # search for everything
+        search = self.client.factory.create('ns0:SearchCriteria')
+        term = self.client.factory.create('ns0:SearchCriteria.TermSearch')
+        term.TermTarget = 'FullText'
+        search.TermSearch.append(term)
+
+        return SearchCaller(self.pool,
+                            self.logger,
+                            HarvestResponse,
+                            self.page_size,
+                            search,
+                            retrieve,
+                            start_index,
+                            self.page_size)
+
+    def harvest(self, full=False):
+        """
+        Update the mirror from the DWS, returning the number of records changed
+
+        An incremental harvest stops at the first page in which every
+        record is already up to date. A full harvest retrieves every
+        record and removes those no longer in the DWS.
+        """
+
+        conn = sqlite3.connect(self.path)
+        try:
+            for statement in SCHEMA:
+                conn.execute(statement)
+
+            seen = set()
+            changed = 0
+            start_index = 1
+            while True:
+                response = self.prepareCaller(start_index)()
+                documents = list(response)
+                if not documents:
+                    break
+
+                updates = 0
+                with conn:
+                    for document in documents:
+                        seen.add(document['id'])
+                        if self.store(conn, document):
+                            updates += 1
+
+                self.logger.info('harvested records %d to %d of %d (%d changed)',
+                                 start_index, start_index + len(documents) - 1, response.hits, updates)
+                changed += updates
+                start_index += len(documents)
+
+                if start_index > response.hits or (not updates and not full):
+                    break
+
+            with conn:
+                if full:
+                    changed += self.prune(conn, seen)
+                conn.execute('INSERT INTO harvests (finished, full, records) VALUES (?, ?, ?)',
+                             (datetime.utcnow().strftime(DATE_FORMAT), int(full), changed))
+        finally:
+            conn.close()
+
+        return changed
+
+    def store(self, conn, document):
+        """
+        Add or update a record, returning False if it is unchanged
+        """
+
+        updated = document['updated'].strftime(DATE_FORMAT)
+        row = conn.execute('SELECT id, updated FROM documents WHERE gid = ?', (document['id'],)).fetchone()
+        if row and row[1] == updated:
+            return False
+
+        values = (document['title'],
+                  document['abstract'],
+                  '; '.join(document['authors']),
+                  '; '.join(document['parameters']),
+                  document['resource-type'],
+                  document['topic-category'],
+                  document['lineage'],
+                  document['public-access'],
+                  document['originator'],
+                  document['format'])
+        values = tuple([(unicode(value) if value is not None else None) for value in values])
+
+        if row:
+            doc_id = row[0]
+            conn.execute('UPDATE documents SET %s, updated = ?, temporal_start = ?, temporal_end = ? WHERE id = ?' % \
+                             ', '.join(['%s = ?' % column for column in TEXT_COLUMNS]),
+                         values + (updated,) + document['temporal'] + (doc_id,))
+            conn.execute('DELETE FROM documents_fts WHERE docid = ?', (doc_id,))
+            conn.execute('DELETE FROM bboxes WHERE document_id = ?', (doc_id,))
+        else:
+            cur = conn.execute('INSERT INTO documents (gid, %s, updated, temporal_start, temporal_end) VALUES (?, %s, ?, ?, ?)' % \
+                                   (', '.join(TEXT_COLUMNS), ', '.join('?' * len(TEXT_COLUMNS))),
+                               (document['id'],) + values + (updated,) + document['temporal'])
+            doc_id = cur.lastrowid
+
+        conn.execute('INSERT INTO documents_fts (docid, %s) VALUES (?, %s)' % \
+                         (', '.join(TEXT_COLUMNS), ', '.join('?' * len(TEXT_COLUMNS))),
+                     (doc_id,) + values)
+        conn.executemany('INSERT INTO bboxes (document_id, minx, miny, maxx, maxy) VALUES (?, ?, ?, ?, ?)',
+                         [(doc_id,) + tuple(bbox) for bbox in document['bbox']])
+
+        return True
+
+    def prune(self, conn, gids):
+        """
+        Remove the records whose ids are not in `gids`
+        """
+
+        removed = 0
+        for doc_id, gid in conn.execute('SELECT id, gid FROM documents').fetchall():
+            if gid in gids:
+                continue
+            conn.execute('DELETE FROM documents WHERE id = ?', (doc_id,))
+            conn.execute('DELETE FROM documents_fts WHERE docid = ?', (doc_id,))
+            conn.execute('DELETE FROM bboxes WHERE document_id = ?', (doc_id,))
+            removed += 1
+
+        return removed
+
+def record_bboxes(path):
+    """
+    Generate the bounding boxes of each record in the mirror
+
+    Each item is a tuple of the record id and a list of its bounding
+    boxes as (minx, miny, maxx, maxy) tuples. Records without a
+    bounding box are not included.
+    """
+
+    conn = sqlite3.connect(path)
+    try:
+        rows = conn.execute('SELECT d.gid, b.minx, b.miny, b.maxx, b.maxy FROM documents d JOIN bboxes b ON (b.document_id = d.id) ORDER BY d.id, b.rowid')
+        gid, bboxes = None, []
+        for row in rows:
+            if row[0] != gid:
+                if bboxes:
+                    yield gid, bboxes
+                gid, bboxes = row[0], []
+            bboxes.append(tuple(row[1:]))
+
+        if bboxes:
+            yield gid, bboxes
+    finally:
+        conn.close()
+
+class LocalResponse(object):
+    """
+    A search response from the local index
+
+    This provides the same interface as the dws.SearchResponse
+    classes.
+    """
+
+    message = None
+
+    def __init__(self, documents, hits, count):
+        self.documents = documents
+        self.hits = hits
+        self.count = count
+
+    def lastModified(self):
+        try:
+            return max((r['updated'] for r in self))
+        except ValueError:
+            return datetime.utcnow()
+
+    def __nonzero__(self):
+        return True
+
+    def __len__(self):
+        return len(self.documents)
+
+    def __iter__(self):
+        return iter(self.documents)
+
+class LocalSearchCaller(object):
+    """
+    A search of the local index
+
+    The SQL is created from the query when the caller is prepared and
+    executed when the instance is called, returning a LocalResponse.
+    """
+
+    def __init__(self, index, logger, result_type, count, where, params, order, offset, limit):
+        self.index = index
+        self.logger = logger
+        self.result_type = result_type
+        self.count = count
+        self.where = where
+        self.params = params
+        self.order = order
+        self.offset = offset
+        self.limit = limit
+
+    def requestXML(self):
+        raise DWSError('Searches are answered by the local index so no SOAP request is made')
+
+    responseXML = requestXML
+
+    def __call__(self):
+        pool = self.index.getPool()
+        conn = pool.acquire()
+        try:
+            return self.search(conn)
+        finally:
+            pool.release(conn)
+
+    def search(self, conn):
+        try:
+            hits = conn.execute('SELECT COUNT(*) FROM documents WHERE %s' % self.where, self.params).fetchone()[0]
+            rows = conn.execute('SELECT id, gid, title, updated, authors, resource_type, topic_category, '
+                                'lineage, public_access, originator, format, parameters, abstract '
+                                'FROM documents WHERE %s ORDER BY %s LIMIT ? OFFSET ?' % (self.where, self.order),
+                                self.params + [self.limit, self.offset]).fetchall()
+        except sqlite3.Error:
+            msg = 'The local search index could not be queried'
+            self.logger.exception(msg)
+            raise DWSError(msg)
+
+        if self.result_type == RESULT_SIMPLE:
+            return LocalResponse([row[1] for row in rows], hits, self.count)
+
+        bboxes = {}
+        if self.result_type == RESULT_SUMMARY and rows:
+            ids = [row[0] for row in rows]
+            for doc_id, minx, miny, maxx, maxy in conn.execute(
+                'SELECT document_id, minx, miny, maxx, maxy FROM bboxes WHERE document_id IN (%s)' % \
+                    ','.join('?' * len(ids)), ids):
+                bboxes.setdefault(doc_id, []).append([minx, miny, maxx, maxy])
+
+        def to_list(field):
+            if field:
+                return [e.strip() for e in field.split(';')]
+            return []
+
+        documents = []
+        for row in rows:
+            if row[3]:
+                updated = datetime.strptime(row[3], DATE_FORMAT)
+            else:
+                updated = datetime.utcnow()
+
+            document = {'id': row[1],
+                        'title': row[2],
+                        'updated': updated,
+                        'authors': to_list(row[4]),
+                        'resource-type': row[5],
+                        'topic-category': row[6],
+                        'lineage': row[7],
+                        'public-access': row[8],
+                        'originator': row[9],
+                        'format': row[10],
+                        'parameters': to_list(row[11])}
+
+            if self.result_type == RESULT_SUMMARY:
+                document['bbox'] = bboxes.get(row[0], [])
+                document['abstract'] = row[12]
+
+            documents.append(document)
+
+        return LocalResponse(documents, hits, self.count)
+
+class SearchIndex(object):
+    """
+    Answer portal searches from the mirror database
+
+    This implements the dws.SearchRequest prepareCaller() interface.
+    The callers may run outside the request thread, so each search
+    borrows a connection from the database pool for its duration.
+    """
+
+    # map query term targets to index columns
+    targets = {'': 'documents_fts',
+               'a': 'authors',
+               'p': 'parameters',
+               'rt': 'resource_type',
+               'tc': 'topic_category',
+               'l': 'lineage',
+               'al': 'public_access',
+               'o': 'originator',
+               'f': 'format'}
+
+    # map sort fields to columns
+    orders = {'updated': 'updated',
+              'title': 'title COLLATE NOCASE',
+              'originator': 'originator COLLATE NOCASE'}
+
+    def __init__(self, path):
+        self.path = path
+
+    def getPool(self):
+        from medin.db import get_pool
+
+        # the mirror is updated in place by the harvester
+        return get_pool(self.path, immutable=False)
+
+    def phrase(self, word):
+        """
+        Quote a search word as a full text phrase
+        """
+        word = word.strip('"').replace('"', ' ').strip()
+        if not word:
+            return None
+        return '"%s"' % word
+
+    def match(self, column, phrases):
+        """
+        Return SQL matching documents containing any of the phrases
+        """
+        sql = 'id IN (SELECT docid FROM documents_fts WHERE %s MATCH ?)' % column
+        return sql, [' OR '.join(phrases)]
+
+    def prepareCaller(self, query, result_type, logger):
+        if result_type not in (RESULT_SIMPLE, RESULT_BRIEF, RESULT_SUMMARY):
+            raise ValueError('Unknown result type: %s' % str(result_type))
+
+        clauses = []
+        params = []
+
+        # combine the search terms from left to right
+        expr = None
+        for token in query.getSearchTerm(default=[], skip_errors=True):
+            phrase = self.phrase(token.word)
+            if not phrase:
+                continue
+
+            column = self.targets.get(token.target.lower(), self.targets[''])
+            sql, args = self.match(column, [phrase])
+            params.extend(args)
+
+            if expr is None:
+                expr = ('NOT %s' % sql) if token.not_ else sql
+            elif token.or_ and token.not_:
+                expr = '(%s OR NOT %s)' % (expr, sql)
+            elif token.not_:
+                expr = '(%s AND NOT %s)' % (expr, sql)
+            elif token.or_:
+                expr = '(%s OR %s)' % (expr, sql)
+            else:
+                expr = '(%s AND %s)' % (expr, sql)
+
+        if expr:
+            clauses.append(expr)
+
+        # add the parameters, data holders, access types and formats
+        for target, values in (('p', query.getParameterLabels()),
+                               ('o', query.getDataHolders(default=[])),
+                               ('al', [type_.prefLabel for type_ in query.getAccessTypes(default=[])]),
+                               ('f', [fmt.prefLabel for fmt in query.getDataFormats(default=[])])):
+            phrases = filter(None, [self.phrase(value) for value in values or []])
+            if not phrases:
+                continue
+            sql, args = self.match(self.targets[target], phrases)
+            clauses.append(sql)
+            params.extend(args)
+
+        # add the spatial criteria
+        aid = query.getArea(cast=False)
+        boxes = []
+        if aid:
+            bbox = query.areas.getBBOX(aid)
+            if bbox:
+                boxes.append(bbox)
+        else:
+            boxes.extend(query.getBoxes())
+
+        if boxes:
+            overlaps = []
+            for minx, miny, maxx, maxy in boxes:
+                overlaps.append('(minx <= ? AND maxx >= ? AND miny <= ? AND maxy >= ?)')
+                params.extend([maxx, minx, maxy, miny])
+            clauses.append('id IN (SELECT document_id FROM bboxes WHERE %s)' % ' OR '.join(overlaps))
+
+        # add the temporal criteria
+        start = query.getStartDate()
+        if start:
+            clauses.append('temporal_end >= ?')
+            params.append(start.date().isoformat())
+
+        end = query.getEndDate()
+        if end:
+            clauses.append('temporal_start <= ?')
+            params.append(end.date().isoformat())
+
+        # add the ordering criteria
+        order = query.getSort()
+        if not order:
+            order = ('updated', False)
+        field, ascending = order
+        try:
+            column = self.orders[field]
+        except KeyError:
+            raise ValueError('Unknown sort field: %s. Choose one of %s.' % (field, ', '.join(self.orders.keys())))
+        order = '%s %s, id' % (column, ('ASC' if ascending else 'DESC')) # ensure a stable order
+
+        count, start_index, limit = result_range(query)
+
+        return LocalSearchCaller(self,
+                                 logger,
+                                 result_type,
+                                 count,
+                                 ' AND '.join(clauses) or '1',
+                                 params,
+                                 order,
+                                 start_index - 1,
+                                 limit)
+
+def index_from_config(config, root):
+    """
+    Create the SearchIndex specified in the [search_index] section
+
+    None is returned if searches are to be sent to the DWS.
+    """
+
+    section = 'search_index'
+    if not config.has_section(section):
+        return None
+
+    backend = 'dws'
+    if config.has_option(section, 'backend'):
+        backend = config.get(section, 'backend').lower()
+
+    if backend == 'dws':
+        return None
+    elif backend != 'local':
+        raise ValueError('Unknown search index backend in the [%s] section: %s' % (section, backend))
+
+    if config.has_option(section, 'path'):
+        path = config.get(section, 'path')
+    else:
+        path = os.path.join(root, 'data', 'mirror.sqlite')
+
+    if not os.path.exists(path):
+        raise ValueError('The local search index does not exist: %s' % path)
+
+    return SearchIndex(path)
@@ -27,17 +27,56 @@ import re
 class QueryError(ValueError):
     pass
 
+def parse_qsl(qsl):
+    """
+    Return the parameters in a query string as a tuple of pairs
+
+    The result is cached as the same query strings are requested
+    repeatedly when paging through results.
+    """
+    from medin.cache import MemoryCache
+
+    global _parsed
+    try:
+        params = _parsed.get(qsl)
+    except NameError:
+        _parsed = MemoryCache(1000)
+        params = None
+
+    if params is None:
+        import cgi
+
+        params = tuple(cgi.parse_qsl(qsl))
+        _parsed.set(qsl, params)
+
+    return params
+
 class GETParams(object):
     """Stores HTTP GET query parameters"""
 
-    def __init__(self, qsl=''):
-        import cgi
+    frozen = False
 
+    def __init__(self, qsl=''):
         self.params = {}
-        for k, v in cgi.parse_qsl(qsl):
+        for k, v in parse_qsl(qsl):
             self.append(k, v)
 
+    def freeze(self):
+        """
+        Prevent any further changes to the parameters
+
+        The parameters of a frozen instance can only be modified in a
+        clone.
+        """
+        self.frozen = True
+        return self
+
+    def checkFrozen(self):
+        if self.frozen:
+            raise TypeError('The parameters cannot be changed: modify a clone instead')
+
     def __delitem__(self, k):
+        self.checkFrozen()
         del self.params[k]
 
     def __getitem__(self, k):
@@ -45,6 +84,7 @@ class GETParams(object):
 
     def __setitem__(self, k, v):
         """Sets the value of the FIRST item"""
+        self.checkFrozen()
         try:
             self.params[k][0] = v
         except KeyError:
@@ -62,6 +102,7 @@ class GETParams(object):
         return '&'.join(params)
 
     def append(self, k, v):
+        self.checkFrozen()
         try:
             self.params[k].append(v)
         except KeyError:
@@ -72,8 +113,42 @@ class GETParams(object):
             for p in v:
                 yield (k, p)
 
+def memoized(method):
+    """
+    Decorate a Query method so its results are cached once it is frozen
+
+    The results are cached for each combination of arguments,
+    including the error raising setting. Exceptions are not cached.
+    """
+    name = method.__name__
+
+    def wrapper(self, *args, **kwargs):
+        if not self.frozen:
+            return method(self, *args, **kwargs)
+
+        key = (name, self.raise_errors, args, tuple(sorted(kwargs.items())))
+        try:
+            return self._memo[key]
+        except KeyError:
+            pass
+        except TypeError:
+            return method(self, *args, **kwargs) # unhashable arguments
+
+        value = self._memo[key] = method(self, *args, **kwargs)
+        return value
+
+    wrapper.__name__ = name
+    wrapper.__doc__ = method.__doc__
+    return wrapper
+
 class Query(GETParams):
-    """Provides an interface to MEDIN OpenSearch query parameters"""
+    """
+    Provides an interface to MEDIN OpenSearch query parameters
+
+    The accessors of a frozen Query are memoized, so the parameters
+    are only parsed and checked against the vocabularies and areas
+    once.
+    """
 
     def __init__(self, qsl, areas, fields, vocabs, db, max_count=300, *args, **kwargs):
         super(Query, self).__init__(qsl, *args, **kwargs)
@@ -83,6 +158,7 @@ class Query(GETParams):
         self.vocabs = vocabs
         self.db = db
         self.max_count = max_count
+        self._memo = {}
 
         # join multiple search terms into a single term
         try:
@@ -96,6 +172,7 @@ class Query(GETParams):
     def __deepcopy__(self, memo):
         return self.clone()
 
+    @memoized
     def verify(self):
         """
         Check the validity of the Query, logging any errors
@@ -156,6 +233,7 @@ class Query(GETParams):
             
         return errors
 
+    @memoized
     def getSearchTerm(self, cast=True, default='', skip_errors=False):
         try:
             qstring = self['q'][0]
@@ -171,19 +249,18 @@ class Query(GETParams):
 
     def addSearchTerm(self, term):
         try:
-            self['q'][0] += ' %s' % term
-        except KeyError, AttributeError:
-            self['q'] = [term]
+            self['q'] = '%s %s' % (self['q'][0], term)
+        except KeyError:
+            self['q'] = term
 
     def replaceSearchTerm(self, find, replace):
         import re
         pattern = re.compile(r'^("%s"|%s)$' % (find, find), re.IGNORECASE)
         terms = []
         for token in self.getSearchTerm(skip_errors=True):
-            token.word = pattern.sub(replace, token.word)
-            terms.append(str(token))
+            terms.append(str(token.replace(pattern.sub(replace, token.word))))
         if terms:
-            self['q'][0] = ' '.join(terms)
+            self['q'] = ' '.join(terms)
 
     def getStartDate(self, cast=True, default=''):
         return self.asDate('sd', cast, default, True)
@@ -191,6 +268,7 @@ class Query(GETParams):
     def getEndDate(self, cast=True, default=''):
         return self.asDate('ed', cast, default, False)
 
+    @memoized
     def asDate(self, key, cast, default, is_start):
         try:
             date = self[key][0].strip()
@@ -225,6 +303,7 @@ class Query(GETParams):
         if cast: return dt
         return date
 
+    @memoized
     def getBoxes(self, cast=True, default=''):
         try:
             bboxes = self['bbox']
@@ -264,6 +343,7 @@ class Query(GETParams):
     def setBoxes(self, bboxes):
         self['bbox'] = [','.join((str(i) for i in box)) for box in bboxes]
 
+    @memoized
     def getDataThemes(self, cast=True, default=''):
         try:
             themes = self['dt']
@@ -278,6 +358,7 @@ class Query(GETParams):
     def setDataThemes(self, themes):
         self['dt'] = self.vocabs.getIdsFromConcepts(themes)
 
+    @memoized
     def getSubThemes(self, cast=True, default=''):
         try:
             themes = self['st']
@@ -292,6 +373,7 @@ class Query(GETParams):
     def setSubThemes(self, themes):
         self['st'] = self.vocabs.getIdsFromConcepts(themes)
 
+    @memoized
     def getParameters(self, cast=True, default=''):
         try:
             parameters = self['p']
@@ -306,6 +388,7 @@ class Query(GETParams):
     def setParameters(self, parameters):
         self['p'] = self.vocabs.getIdsFromConcepts(parameters)
 
+    @memoized
     def getParameterLabels(self):
         parameters = self.getParameters(cast=False)
         if parameters:
@@ -315,6 +398,7 @@ class Query(GETParams):
             return self.vocabs.getParametersFromSubThemeIds(sub_themes)
         return self.vocabs.getParametersFromDataThemeIds(self.getDataThemes(cast=False))
 
+    @memoized
     def getDataHolders(self, cast=True, default=''):
         try:
             holders = filter(None, self['dh'])
@@ -329,6 +413,7 @@ class Query(GETParams):
 
         return self.db.getDataHoldersFromIds(holders)
 
+    @memoized
     def getAccessTypes(self, cast=True, default=''):
         try:
             types = filter(None, self['at'])
@@ -343,6 +428,7 @@ class Query(GETParams):
 
         return self.vocabs.getAccessTypesFromIds(types)
 
+    @memoized
     def getDataFormats(self, cast=True, default=''):
         try:
             formats = filter(None, self['f'])
@@ -357,6 +443,7 @@ class Query(GETParams):
 
         return self.vocabs.getDataFormatsFromIds(formats)
 
+    @memoized
     def getSort(self, cast=True, default=''):
         try:
             sort = self['s'][0]
@@ -395,6 +482,7 @@ class Query(GETParams):
     def delSort(self):
         del self['s']
 
+    @memoized
     def getCount(self, cast=True, default=20):
         try:
             count = self['c'][0]
@@ -424,6 +512,7 @@ class Query(GETParams):
     def delCount(self):
         del self['c']
 
+    @memoized
     def getStartIndex(self, cast=True, default=1):
         try:
             idx = self['i'][0]
@@ -444,6 +533,18 @@ class Query(GETParams):
     def setStartIndex(self, value):
         self['i'] = value
 
+    def getExport(self, default=False):
+        """
+        Return True if the whole result set is being requested
+        """
+        try:
+            export = self['export'][0]
+        except KeyError:
+            return default
+
+        return export.lower() in ('1', 'true', 'yes')
+
+    @memoized
     def getArea(self, cast=True, default=''):
         def check_area(area):
             if self.raise_errors and len(self['a']) > 1:
@@ -470,6 +571,7 @@ class Query(GETParams):
     def setArea(self, value):
         self['a'] = value
 
+    @memoized
     def asDict(self, verify=True):
         """
         Return the query as a dictionary structure
@@ -523,14 +625,24 @@ class TermToken(object):
     A combination of a word, target and query operators
 
     Multiple TermTokens can be combined to define a query. Query
-    operators are `OR` and `-` (NOT).
+    operators are `OR` and `-` (NOT). Tokens are immutable so that
+    parsed terms can be shared: use replace() to change the word.
     """
 
+    __slots__ = ('word', 'target', 'not_', 'or_')
+
     def __init__(self, word, target=None, not_=False, or_=False):
-        self.word = word
-        self.target = target
-        self.not_ = not_
-        self.or_ = or_
+        setattr = super(TermToken, self).__setattr__
+        setattr('word', word)
+        setattr('target', target)
+        setattr('not_', not_)
+        setattr('or_', or_)
+
+    def __setattr__(self, name, value):
+        raise AttributeError('TermToken instances are immutable')
+
+    def replace(self, word):
+        return TermToken(word, self.target, self.not_, self.or_)
 
     def __str__(self):
         ret = ''
@@ -547,10 +659,10 @@ class TermToken(object):
 
 class TermParser(object):
     """
-    Parse a search term into a list of tokens
+    Parse a search term into a tuple of tokens
 
-    The returned list contains the <or>, <not>, <target> and <word>
-    for each term.
+    The returned tuple contains the <or>, <not>, <target> and <word>
+    for each term. Parsed terms are cached by their query string.
     """
 
     # The following pattern is designed to parse out the <or>, <not>,
@@ -569,7 +681,10 @@ class TermParser(object):
     targets = set(('', 'a', 'al', 'f', 'l', 'o', 'p', 'rt', 'tc'))
     reserved_words = set(('and', 'or', 'not')) # search terms reserved by the discovery web service
 
-    def __call__(self, querystr, skip_errors=False):
+    def parse(self, querystr):
+        """
+        Return the tokens and unrecognised targets in a query string
+        """
         matches = self.pattern.findall(querystr)
 
         # Extract all the words and target groups from the query
@@ -584,6 +699,23 @@ class TermParser(object):
             token = TermToken(word, target, bool(op_not), bool(op_or))
             tokens.append(token)
 
+        return tuple(tokens), tuple(bad_targets)
+
+    def __call__(self, querystr, skip_errors=False):
+        from medin.cache import MemoryCache
+
+        global _terms
+        try:
+            parsed = _terms.get(querystr)
+        except NameError:
+            _terms = MemoryCache(1000)
+            parsed = None
+
+        if parsed is None:
+            parsed = self.parse(querystr)
+            _terms.set(querystr, parsed)
+
+        tokens, bad_targets = parsed
         if not skip_errors and bad_targets:
             targets = [t for t in self.targets if t]
             targets.sort()
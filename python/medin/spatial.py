@@ -25,26 +25,124 @@
 import sys, traceback, os
 from TileCache.Service import Service, Layer, Cache, wsgiHandler  # for our TileCache service
 
+def trigrams(text):
+    """
+    Return the set of three character sequences in some text
+    """
+    text = text.lower()
+    return set([text[i:i+3] for i in xrange(len(text) - 2)])
+
+def index_areas(db):
+    """
+    Create the indexes used to look up areas
+
+    The areas view is a union of the individual area tables so cannot
+    itself be indexed. Instead its contents are copied into the
+    `area_lookup` table, with an R*Tree (`area_rtree`) indexing the
+    area bounding boxes and a trigram table (`area_trigrams`) indexing
+    the area names. This must be run whenever the area tables change.
+    """
+
+    db.executescript('''
+DROP TABLE IF EXISTS area_trigrams;
+DROP TABLE IF EXISTS area_rtree;
+DROP TABLE IF EXISTS area_lookup;
+
+CREATE TABLE area_lookup (
+       key INTEGER PRIMARY KEY,
+       id varchar(4) UNIQUE NOT NULL,
+       type varchar(2) NOT NULL,
+       name varchar(255) NOT NULL,
+       minx double NOT NULL,
+       miny double NOT NULL,
+       maxx double NOT NULL,
+       maxy double NOT NULL
+);
+
+CREATE VIRTUAL TABLE area_rtree USING rtree(key, minx, maxx, miny, maxy);
+
+CREATE TABLE area_trigrams (
+       trigram char(3) NOT NULL,
+       key INTEGER NOT NULL REFERENCES area_lookup (key),
+       PRIMARY KEY (trigram, key)
+);
+
+INSERT INTO area_lookup (id, type, name, minx, miny, maxx, maxy)
+  SELECT id, type, name, minx, miny, maxx, maxy FROM areas ORDER BY type, id;
+
+-- areas crossing the antimeridian are split into an eastern part
+-- and a western part keyed on the negated area key
+INSERT INTO area_rtree (key, minx, maxx, miny, maxy)
+  SELECT key, minx, maxx, miny, maxy FROM area_lookup WHERE minx <= maxx;
+
+INSERT INTO area_rtree (key, minx, maxx, miny, maxy)
+  SELECT key, minx, 180, miny, maxy FROM area_lookup WHERE minx > maxx;
+
+INSERT INTO area_rtree (key, minx, maxx, miny, maxy)
+  SELECT -key, -180, maxx, miny, maxy FROM area_lookup WHERE minx > maxx;
+''')
+
+    cur = db.cursor()
+    cur.execute('SELECT key, name FROM area_lookup')
+    rows = []
+    for key, name in cur.fetchall():
+        rows.extend([(trigram, key) for trigram in trigrams(name)])
+    db.executemany('INSERT INTO area_trigrams (trigram, key) VALUES (?, ?)', rows)
+    db.commit()
+
 class Areas(object):
     """
     Interface for interacting with areas stored in a sqlite database
+
+    The lookups use the indexes created by index_areas().
     """
 
     def __init__(self, db):
+        from medin.cache import file_memo
+
         self._db = db
 
+        # the area lists are memoized until the database changes
+        cur = db.cursor()
+        cur.execute('PRAGMA database_list')
+        paths = dict([(row[1], row[2]) for row in cur])
+        self._memo = file_memo(paths.get('main'))
+
+    def _list(self, sql):
+        from medin.cache import memoize
+
+        def query():
+            cur = self._db.cursor()
+            cur.execute(sql)
+            return tuple(cur)
+
+        return memoize(self._memo, sql, query)
+
     def getArea(self, id):
         cur = self._db.cursor()
-        cur.execute('SELECT name, minx, miny, maxx, maxy FROM areas WHERE id = ?', (id,))
+        cur.execute('SELECT name, minx, miny, maxx, maxy FROM area_lookup WHERE id = ?', (id,))
         res = cur.fetchone()
         if res:
             return (res[0], tuple(res[1:]))
         return None
 
     def getAreaId(self, name, type):
+        """
+        Return the id of the shortest area name containing `name`
+        """
         cur = self._db.cursor()
-        name = '%'+name+'%'
-        cur.execute('SELECT id FROM areas WHERE name like ? AND type = ? ORDER BY length(name)', (name, type))
+        grams = trigrams(name)
+        pattern = '%'+name+'%'
+        if not grams:
+            # the name is too short to use the trigram index
+            cur.execute('SELECT id FROM area_lookup WHERE name like ? AND type = ? ORDER BY length(name)', (pattern, type))
+        else:
+            # only check the names containing every trigram in the name
+            cur.execute('''SELECT id FROM area_lookup WHERE key IN (
+                             SELECT key FROM area_trigrams WHERE trigram IN (%s)
+                             GROUP BY key HAVING count(*) = ?)
+                           AND name like ? AND type = ? ORDER BY length(name)''' % ','.join('?' * len(grams)),
+                        list(grams) + [len(grams), pattern, type])
         aid = cur.fetchone()
         if aid:
             return aid[0]
@@ -52,15 +150,18 @@ class Areas(object):
 
     def getAreaName(self, id):
         cur = self._db.cursor()
-        cur.execute('SELECT name FROM areas WHERE id = ?', (id,))
+        cur.execute('SELECT name FROM area_lookup WHERE id = ?', (id,))
         area = cur.fetchone()
         if area:
             return area[0]
         return None
 
     def getAreaType(self, id):
+        if not id:
+            return None
+
         cur = self._db.cursor()
-        cur.execute('SELECT type FROM areas WHERE id = ?', (id,))
+        cur.execute('SELECT type FROM area_lookup WHERE id = ?', (id,))
         area = cur.fetchone()
         if area:
             return area[0]
@@ -68,36 +169,50 @@ class Areas(object):
 
     def getBBOX(self, id):
         cur = self._db.cursor()
-        cur.execute('SELECT minx, miny, maxx, maxy FROM areas WHERE id = ?', (id,))
+        cur.execute('SELECT minx, miny, maxx, maxy FROM area_lookup WHERE id = ?', (id,))
         bbox = cur.fetchone()
         if bbox:
             return bbox
         return None
 
-    def countries(self):
+    def getIntersecting(self, bbox, type=None):
+        """
+        Return the id, name and type of the areas intersecting a bounding box
+
+        A bounding box crossing the antimeridian has a `minx` greater
+        than its `maxx`.
+        """
+        minx, miny, maxx, maxy = bbox
+        sql = '''SELECT DISTINCT l.id, l.name, l.type FROM area_rtree r JOIN area_lookup l ON l.key = abs(r.key)
+                 WHERE r.miny <= ? AND r.maxy >= ?'''
+        args = [maxy, miny]
+        if minx > maxx:
+            sql += ' AND (r.maxx >= ? OR r.minx <= ?)' # the eastern or western part
+        else:
+            sql += ' AND r.maxx >= ? AND r.minx <= ?'
+        args.extend((minx, maxx))
+        if type:
+            sql += ' AND l.type = ?'
+            args.append(type)
+
         cur = self._db.cursor()
-        cur.execute('SELECT id, name FROM countries ORDER BY name')
-        return [row for row in cur]
+        cur.execute(sql + ' ORDER BY l.name', args)
+        return cur.fetchall()
+
+    def countries(self):
+        return self._list('SELECT id, name FROM countries ORDER BY name')
 
     def britishIsles(self):
-        cur = self._db.cursor()
-        cur.execute('SELECT id, name FROM british_isles')
-        return [row for row in cur]
+        return self._list('SELECT id, name FROM british_isles')
 
     def chartingProgressAreas(self):
-        cur = self._db.cursor()
-        cur.execute('SELECT id, name FROM charting_progress_areas')
-        return [row for row in cur]
+        return self._list('SELECT id, name FROM charting_progress_areas')
 
     def icesRectangles(self):
-        cur = self._db.cursor()
-        cur.execute('SELECT id, name FROM ices_rectangles')
-        return [row for row in cur]
+        return self._list('SELECT id, name FROM ices_rectangles')
 
     def seaAreas(self):
-        cur = self._db.cursor()
-        cur.execute('SELECT id, name FROM sea_areas')
-        return [row for row in cur]
+        return self._list('SELECT id, name FROM sea_areas')
 
     def __deepcopy__(self, memo):
         """
@@ -147,6 +262,413 @@ class TileService(Service):
             metadata['traceback'] = "".join(traceback.format_tb(sys.exc_traceback))
         return cls(cache, layers, metadata)
 
+    def __init__(self, cache, layers, metadata={}):
+        from threading import Lock
+
+        super(TileService, self).__init__(cache, layers, metadata)
+        self._flights = {}              # tiles being rendered in this process
+        self._flights_lock = Lock()
+
+    def renderTile(self, tile, force=False):
+        """
+        Render a tile, coalescing concurrent requests for the same tile
+
+        Only one thread in the process renders a tile that is missing
+        from the cache: other threads requesting the tile wait for the
+        render and share its result, or its error. Across processes
+        the cache lock is used so only one process renders the tile.
+        """
+
+        if force:
+            return super(TileService, self).renderTile(tile, force)
+
+        key = self.cache.getKey(tile)
+        with self._flights_lock:
+            try:
+                flight = self._flights[key]
+            except KeyError:
+                flight = self._flights[key] = TileFlight()
+                leader = True
+            else:
+                leader = False
+
+        if not leader:
+            if flight.wait(self.cache.timeout):
+                return flight.result()
+
+            # the render is taking too long so render the tile here
+            return super(TileService, self).renderTile(tile, force)
+
+        try:
+            result = self.renderShared(tile)
+        except Exception, e:
+            flight.fail(e)
+            raise
+        else:
+            flight.succeed(result)
+            return result
+        finally:
+            with self._flights_lock:
+                del self._flights[key]
+            flight.done()
+
+    def renderShared(self, tile):
+        """
+        Render a tile unless another process is rendering it
+
+        If the cache is locked for the tile then the cache is polled
+        until the tile appears. Metatiled layers lock their metatiles
+        when rendering so these are rendered directly.
+        """
+        from time import time, sleep
+
+        render = super(TileService, self).renderTile
+        if getattr(tile.layer, 'metaTile', False) or self.cache.get(tile):
+            return render(tile)
+
+        try:
+            locked = self.cache.attemptLock(tile)
+        except NotImplementedError:
+            return render(tile)         # the cache does not support locking
+
+        if locked:
+            try:
+                return render(tile)
+            finally:
+                self.cache.unlock(tile)
+
+        # wait for the other process to add the tile to the cache
+        expires = time() + self.cache.timeout
+        while time() < expires:
+            sleep(0.1)
+            if self.cache.get(tile):
+                return render(tile)
+
+        # the other process is taking too long so render the tile
+        # here: the cache removes stale locks itself
+        return render(tile)
+
+    def locateTile(self, tile):
+        """
+        Return the StoredTile for a tile, rendering it if necessary
+        """
+
+        stored = locate_tile(self.cache, tile)
+        if stored is not None:
+            return stored
+
+        format, image = self.renderTile(tile)
+        stored = locate_tile(self.cache, tile)
+        if stored is None:
+            stored = StoredTile(data=image) # e.g. the cache is read only
+        return stored
+
+class TileFlight(object):
+    """
+    A tile render shared by the threads requesting the tile
+    """
+
+    def __init__(self):
+        from threading import Event
+
+        self._event = Event()
+        self._result = None
+        self._error = None
+
+    def succeed(self, result):
+        self._result = result
+
+    def fail(self, error):
+        self._error = error
+
+    def done(self):
+        self._event.set()
+
+    def wait(self, timeout=None):
+        """
+        Wait for the render, returning False if it did not finish in time
+        """
+        self._event.wait(timeout)
+        return self._event.isSet()  # wait() returns None before Python 2.7
+
+    def result(self):
+        if self._error is not None:
+            raise self._error
+        return self._result
+
+class StoredTile(object):
+    """
+    A tile in a cache
+
+    The tile is either the `data` in memory or a file at `path`
+    relative to the cache `base` directory, which is served without
+    reading it. The Etag is a hash of the tile content, so it is the
+    same whichever cache the tile is served from.
+    """
+
+    def __init__(self, mtime=None, length=None, path=None, base=None, data=None, digest=None):
+        self.mtime = mtime
+        self.path = path
+        self.base = base
+        self.data = data
+        if length is None:
+            length = len(data)
+        self.length = length
+
+        if digest is None:
+            from hashlib import sha1
+            digest = sha1(data).hexdigest()
+        self.etag = '"%s"' % digest
+
+def file_digest(path, stat):
+    """
+    Return the SHA1 hex digest of a tile file
+
+    The digest is stored alongside the tile in a file with a .sha1
+    extension, together with the modification time and size of the
+    tile so that a replaced tile is detected. Digests are also held in
+    memory so the file is usually not read at all.
+    """
+    global _digests
+    try:
+        digests = _digests
+    except NameError:
+        from medin.cache import MemoryCache
+        digests = _digests = MemoryCache(10000)
+
+    key = (path, stat.st_mtime, stat.st_size)
+    digest = digests.get(key)
+    if digest is not None:
+        return digest
+
+    # the stored values that must match the tile
+    validator = '%r %d' % (stat.st_mtime, stat.st_size)
+    sidecar = path + '.sha1'
+    try:
+        fh = open(sidecar, 'rb')
+    except IOError:
+        pass
+    else:
+        try:
+            stored = fh.read().split(' ', 1)
+        finally:
+            fh.close()
+        if len(stored) == 2 and stored[1] == validator:
+            digest = stored[0]
+
+    if digest is None:
+        from hashlib import sha1
+
+        hasher = sha1()
+        fh = open(path, 'rb')
+        try:
+            for chunk in iter(lambda: fh.read(65536), ''):
+                hasher.update(chunk)
+        finally:
+            fh.close()
+        digest = hasher.hexdigest()
+
+        tmpfile = sidecar + '.%d.tmp' % os.getpid()
+        try:
+            fh = open(tmpfile, 'wb')
+            try:
+                fh.write('%s %s' % (digest, validator))
+            finally:
+                fh.close()
+            os.rename(tmpfile, sidecar)
+        except (IOError, OSError):
+            pass                # e.g. a read only cache
+
+    digests.set(key, digest)
+    return digest
+
+def locate_tile(cache, tile):
+    """
+    Return the StoredTile for a tile in a TileCache cache, or None
+
+    Tiles in the Disk cache are located without being read.
+    """
+    from TileCache.Caches.Disk import Disk
+
+    try:
+        locate = cache.locate
+    except AttributeError:
+        pass
+    else:
+        return locate(tile)
+
+    if isinstance(cache, Disk):
+        path = cache.getKey(tile)
+        try:
+            stat = os.stat(path)
+        except OSError:
+            return None
+        return StoredTile(stat.st_mtime, stat.st_size, path, cache.basedir, digest=file_digest(path, stat))
+
+    data = cache.get(tile)
+    if not data:
+        return None
+    return StoredTile(data=data)
+
+class MemoryTier(Cache.Cache):
+    """A TileCache cache holding recently used tiles in memory
+
+    The tiles are held in front of another TileCache cache, such as
+    Disk, Memcached or S3, so that frequently requested tiles are
+    served without accessing the backend. The memory used is bounded
+    by `max_bytes`, evicting the least recently used tiles. Single
+    TMS tiles stored in files by the backend are served from the file
+    without passing through Python (see `locate`), so the memory is
+    used for the other requests and for backends without files. The
+    cache is configured in the [cache] section by setting the `type` to
+    MemoryTier, the `module` to medin.spatial and the `backend` to the
+    type of the backend cache, which is the full name of the class if
+    it is not a TileCache cache. The other options in the section are
+    passed to the backend.
+    """
+
+    def __init__(self, backend='Disk', max_bytes='33554432', **kwargs):
+        from threading import Lock
+        from TileCache.Service import import_module
+        from medin.cache import LRUDict
+
+        if '.' in backend:
+            name, backend = backend.rsplit('.', 1) # e.g. medin.bundle.Bundle
+        else:
+            backend = backend.replace('Cache', '')
+            name = 'TileCache.Caches.%s' % backend
+        self.backend = getattr(import_module(name), backend)(**kwargs)
+
+        # share the backend settings used by the TileCache service
+        self.timeout = self.backend.timeout
+        self.stale = self.backend.stale
+        self.readonly = self.backend.readonly
+        self.expire = self.backend.expire
+        self.sendfile = getattr(self.backend, 'sendfile', False)
+
+        self.max_bytes = int(max_bytes)
+        self.size = 0                   # the total bytes held
+        self._tiles = LRUDict()
+        self._lock = Lock()
+
+    def getMemoryKey(self, tile):
+        return (tile.layer.name, tile.x, tile.y, tile.z)
+
+    def remember(self, tile, data, mtime=None, digest=None):
+        """
+        Add a tile to memory, evicting the least recently used tiles
+
+        The tile is held as a StoredTile so that its Etag is only
+        calculated once.
+        """
+        if len(data) > self.max_bytes:
+            return
+
+        stored = StoredTile(mtime, data=data, digest=digest)
+        key = self.getMemoryKey(tile)
+        with self._lock:
+            old = self._tiles.pop(key, None)
+            if old is not None:
+                self.size -= old.length
+
+            self._tiles[key] = stored
+            self.size += stored.length
+            while self.size > self.max_bytes:
+                key, old = self._tiles.popitem(last=False)
+                self.size -= old.length
+
+    def forget(self, tile):
+        with self._lock:
+            stored = self._tiles.pop(self.getMemoryKey(tile), None)
+            if stored is not None:
+                self.size -= stored.length
+
+    def recall(self, tile):
+        """
+        Return the StoredTile for a tile held in memory, or None
+        """
+        key = self.getMemoryKey(tile)
+        with self._lock:
+            try:
+                stored = self._tiles.pop(key)
+            except KeyError:
+                return None
+            self._tiles[key] = stored # mark as most recently used
+        return stored
+
+    def getModified(self, tile):
+        """
+        Return the modification time of a tile in a Disk backend
+        """
+        from TileCache.Caches.Disk import Disk
+
+        if not isinstance(self.backend, Disk):
+            return None
+        try:
+            return os.stat(self.backend.getKey(tile)).st_mtime
+        except OSError:
+            return None
+
+    def get(self, tile):
+        stored = self.recall(tile)
+        if stored is not None:
+            tile.data = stored.data
+            return stored.data
+
+        data = self.backend.get(tile)
+        if data and not self.sendfile:
+            # when sending files the data is the filename
+            self.remember(tile, data, self.getModified(tile))
+        return data
+
+    def set(self, tile, data):
+        data = self.backend.set(tile, data)
+        if self.sendfile:
+            self.forget(tile)           # the data is not the filename
+        else:
+            self.remember(tile, data, self.getModified(tile))
+        return data
+
+    def delete(self, tile):
+        self.forget(tile)
+        self.backend.delete(tile)
+
+    def locate(self, tile):
+        """
+        Return the StoredTile for a tile, or None
+
+        Tiles that the backend stores as files are located in the
+        backend so that they can be served without being read. Other
+        tiles are served from memory.
+        """
+        from TileCache.Caches.Disk import Disk
+
+        if isinstance(self.backend, Disk):
+            return locate_tile(self.backend, tile)
+
+        stored = self.recall(tile)
+        if stored is not None:
+            return stored
+
+        data = self.get(tile)
+        if not data:
+            return None
+        return self.recall(tile) or StoredTile(data=data)
+
+    # the keys and locks are those of the backend
+
+    def getKey(self, tile):
+        return self.backend.getKey(tile)
+
+    def getLockName(self, tile):
+        return self.backend.getLockName(tile)
+
+    def attemptLock(self, tile):
+        return self.backend.attemptLock(tile)
+
+    def unlock(self, tile):
+        return self.backend.unlock(tile)
+
 def get_tileservice(environ):
     global _tilecache_service
 
@@ -196,72 +718,296 @@ def tilecache (environ, start_response):
         environ['SCRIPT_NAME'] += environ['PATH_INFO']
         environ['PATH_INFO'] = ''
         
-    return wsgiHandler(environ, start_response, _tilecache_service)
+    return tile_response(environ, start_response, svc)
 
-def metadata_image(bboxes, mapfile):
-    """Create a metadata image"""
+def not_modified(environ, stored):
+    """
+    Return True if the client has the current version of a StoredTile
 
-    from json import dumps as tojson
-    import mapnik2 as mapnik
+    If-Modified-Since is only used when there is no If-None-Match.
+    """
+    from email.utils import parsedate_tz, mktime_tz
 
-    features = []
+    if 'HTTP_IF_NONE_MATCH' in environ:
+        etags = [etag.strip() for etag in environ['HTTP_IF_NONE_MATCH'].split(',')]
+        return stored.etag in etags or '*' in etags
 
-    for bbox in bboxes:
-        minx, miny, maxx, maxy = bbox
+    if stored.mtime is None:
+        return False
+
+    try:
+        since = mktime_tz(parsedate_tz(environ['HTTP_IF_MODIFIED_SINCE']))
+    except (KeyError, TypeError, ValueError, OverflowError):
+        return False                # missing or invalid
+
+    return int(stored.mtime) <= since
+
+def tile_response(environ, start_response, service):
+    """
+    Respond to a TileCache request
+
+    Requests for a single TMS tile are answered from the cache
+    location of the tile with an Etag and Last-Modified header, so
+    conditional requests are answered without the tile data. Browsers
+    may use a tile for the `max_age` seconds in the [tiles] section of
+    the portal configuration before revalidating it. Tiles
+    stored in their own file are not read: the file is passed to the
+    server using wsgi.file_wrapper, or to the front end web server
+    using a header according to the `sendfile` option in the [tiles]
+    section of the portal configuration. Other requests are handled
+    by the TileCache wsgiHandler.
+    """
+    from TileCache.Service import TileCacheException
+    from TileCache.Services.TMS import TMS
+    from TileCache.Layer import Tile
+
+    if environ['REQUEST_METHOD'] not in ('GET', 'HEAD') or environ.get('QUERY_STRING') or \
+            service.metadata.has_key('exception'):
+        return wsgiHandler(environ, start_response, service)
 
-        # create the bounding box as a json string
-        width, height = (maxx - minx, maxy - miny)
-        min_dim = 0.0125                        # minimum dimension for display as a rectangle (in degrees)
-        if width < min_dim or height < min_dim:   # it should be a point
-            feature = { "type": "Feature",
-                        "geometry": {
-                            "type": "Point",
-                            "coordinates": [minx, miny]
-                            },
-                        "properties": {
-                            "type": "point"
+    try:
+        # there are no form fields without a query string
+        tile = TMS(service).parse({}, environ.get('PATH_INFO', ''), 'http://localhost/')
+        if not isinstance(tile, Tile):
+            return wsgiHandler(environ, start_response, service) # e.g. capabilities
+
+        stored = service.locateTile(tile)
+    except TileCacheException, E:
+        start_response("404 Tile Not Found", [('Content-Type','text/plain')])
+        return ["An error occurred: %s" % (str(E))]
+    except Exception, E:
+        start_response("500 Internal Server Error", [('Content-Type','text/plain')])
+        return ["An error occurred: %s\n%s\n" % (
+            str(E),
+            "".join(traceback.format_tb(sys.exc_traceback)))]
+
+    from email.utils import formatdate
+    from time import time
+
+    config = environ['config']
+    if config.has_option('tiles', 'max_age'):
+        max_age = config.getint('tiles', 'max_age')
+    else:
+        max_age = 86400
+
+    headers = [('Etag', stored.etag),
+               ('Cache-Control', 'public, max-age=%d' % max_age)]
+    if stored.mtime is not None:
+        headers.append(('Last-Modified', formatdate(stored.mtime, usegmt=True)))
+    if service.cache.expire:
+        headers.append(('Expires', formatdate(time() + service.cache.expire, usegmt=True)))
+
+    if not_modified(environ, stored):
+        start_response('304 Not Modified', headers)
+        return []
+
+    headers.append(('Content-Type', tile.layer.mime_type))
+    if stored.path is None:
+        headers.append(('Content-Length', str(stored.length)))
+        start_response('200 OK', headers)
+        return [stored.data]
+
+    if config.has_option('tiles', 'sendfile'):
+        sendfile = config.get('tiles', 'sendfile').lower()
+    else:
+        sendfile = 'none'
+
+    if sendfile == 'x-accel-redirect' and not config.has_option('tiles', 'accel_prefix'):
+        sendfile = 'none'       # the file cannot be located by nginx
+
+    if sendfile == 'x-sendfile':
+        headers.append(('X-Sendfile', stored.path))
+        start_response('200 OK', headers)
+        return []
+    elif sendfile == 'x-accel-redirect':
+        prefix = config.get('tiles', 'accel_prefix').rstrip('/')
+        path = os.path.relpath(stored.path, stored.base).replace(os.sep, '/')
+        headers.append(('X-Accel-Redirect', '%s/%s' % (prefix, path)))
+        start_response('200 OK', headers)
+        return []
+    elif sendfile != 'none':
+        raise ValueError('Unknown sendfile option in the [tiles] section: %s' % sendfile)
+
+    try:
+        fh = open(stored.path, 'rb')
+    except IOError:
+        # the tile has been removed since it was located
+        return wsgiHandler(environ, start_response, service)
+
+    headers.append(('Content-Length', str(os.fstat(fh.fileno()).st_size)))
+    start_response('200 OK', headers)
+    try:
+        file_wrapper = environ['wsgi.file_wrapper']
+    except KeyError:
+        try:
+            return [fh.read()]
+        finally:
+            fh.close()
+
+    return file_wrapper(fh, 65536)
+
+class ExtentRenderer(object):
+    """
+    Render images showing the bounding boxes of metadata records
+
+    The images are rendered using a Mapnik mapfile. Loading the
+    mapfile is expensive so a Map is loaded once for each thread and
+    reused. The `version` identifies the mapfile so that cached images
+    can be discarded when the map style changes.
+    """
+
+    def __init__(self, mapfile, width=250, height=250):
+        from hashlib import sha1
+        from threading import local
+
+        self.mapfile = mapfile
+        self.width = width
+        self.height = height
+        self.version = sha1(mapfile).hexdigest()
+        self._local = local()
+
+    def getMap(self):
+        """
+        Return the Mapnik Map for the current thread
+        """
+        try:
+            return self._local.map
+        except AttributeError:
+            pass
+
+        import mapnik2 as mapnik
+
+        m = self._local.map = mapnik.Map(self.width, self.height)
+        mapnik.load_map_from_string(m, self.mapfile)
+        return m
+
+    def key(self, bboxes):
+        """
+        Return the cache key for the image of some bounding boxes
+        """
+        boxes = ';'.join([','.join(['%r' % float(ordinate) for ordinate in bbox]) for bbox in bboxes])
+        return 'extent:%s:%s' % (self.version, boxes)
+
+    def image(self, bboxes):
+        """
+        Return a Mapnik Image of some bounding boxes
+        """
+
+        from json import dumps as tojson
+        import mapnik2 as mapnik
+
+        features = []
+
+        for bbox in bboxes:
+            minx, miny, maxx, maxy = bbox
+
+            # create the bounding box as a json string
+            width, height = (maxx - minx, maxy - miny)
+            min_dim = 0.0125                        # minimum dimension for display as a rectangle (in degrees)
+            if width < min_dim or height < min_dim:   # it should be a point
+                feature = { "type": "Feature",
+                            "geometry": {
+                                "type": "Point",
+                                "coordinates": [minx, miny]
+                                },
+                            "properties": {
+                                "type": "point"
+                                }
                             }
-                        }
-            width, height = (9, 9)
-        else:
-            feature = { "type": "Feature",
-                        "geometry": {
-                            "type": "Polygon",
-                            "coordinates": [[[minx, miny], [maxx, miny], [maxx, maxy], [minx, maxy], [minx, miny]]]
-                            },
-                        "properties": {
-                            "type": "bbox"
+                width, height = (9, 9)
+            else:
+                feature = { "type": "Feature",
+                            "geometry": {
+                                "type": "Polygon",
+                                "coordinates": [[[minx, miny], [maxx, miny], [maxx, maxy], [minx, maxy], [minx, miny]]]
+                                },
+                            "properties": {
+                                "type": "bbox"
+                                }
                             }
-                        }
-        features.append(feature)
-
-    json = tojson({
-            "type": "FeatureCollection",
-            "features": features
-            })
-
-    # instantiate the map
-    m = mapnik.Map(250, 250)
-    mapnik.load_map_from_string(m, mapfile)
-
-    # set the datasource for the last layer to show the bounding box
-    datasource = mapnik.Ogr(file=json, layer='OGRGeoJSON')
-    m.layers[-1].datasource = datasource
-
-    # create an image of the area of interest with a border
-    border = 80.0                       # percentage border
-    dx = width * (border / 100)
-    minx2 = minx - dx; maxx2 = maxx + dx
-    dy = height * (border / 100)
-    miny2 = miny - dy; maxy2 = maxy + dy
-
-    # don't create a border larger than the globe's extent
-    if minx2 < -180.0 or maxx2 > 180.0 or miny2 < -90.0 or maxy2 > 90.0:
-        minx2 = minx; maxx2 = maxx; miny2 = miny; maxy2 = maxy
-    
-    bbox = mapnik.Envelope(mapnik.Coord(minx2, miny2), mapnik.Coord(maxx2, maxy2))
-    m.zoom_to_box(bbox)
-    image = mapnik.Image(m.width, m.height)
-    mapnik.render(m, image)
+            features.append(feature)
+
+        json = tojson({
+                "type": "FeatureCollection",
+                "features": features
+                })
+
+        # set the datasource for the last layer to show the bounding box
+        m = self.getMap()
+        datasource = mapnik.Ogr(file=json, layer='OGRGeoJSON')
+        m.layers[-1].datasource = datasource
+
+        # create an image of the area of interest with a border
+        border = 80.0                       # percentage border
+        dx = width * (border / 100)
+        minx2 = minx - dx; maxx2 = maxx + dx
+        dy = height * (border / 100)
+        miny2 = miny - dy; maxy2 = maxy + dy
+
+        # don't create a border larger than the globe's extent
+        if minx2 < -180.0 or maxx2 > 180.0 or miny2 < -90.0 or maxy2 > 90.0:
+            minx2 = minx; maxx2 = maxx; miny2 = miny; maxy2 = maxy
+
+        bbox = mapnik.Envelope(mapnik.Coord(minx2, miny2), mapnik.Coord(maxx2, maxy2))
+        m.zoom_to_box(bbox)
+        image = mapnik.Image(m.width, m.height)
+        mapnik.render(m, image)
+
+        return image
+
+    def __call__(self, bboxes, cache=None):
+        """
+        Return a PNG image of some bounding boxes as a string
+
+        The image is retrieved from `cache` if it has already been
+        rendered, otherwise it is rendered and added to the cache.
+        """
+
+        if cache is not None:
+            key = self.key(bboxes)
+            png = cache.get(key)
+            if png is not None:
+                return png
+
+        png = self.image(bboxes).tostring('png')
+
+        if cache is not None:
+            cache.set(key, png)
+
+        return png
+
+def get_extent_renderer(mapfile):
+    """
+    Return the ExtentRenderer shared by all users of a mapfile
+    """
+
+    global _extent_renderer
+    try:
+        renderer = _extent_renderer
+    except NameError:
+        pass
+    else:
+        if renderer.mapfile == mapfile:
+            return renderer
+
+    renderer = _extent_renderer = ExtentRenderer(mapfile)
+    return renderer
+
+def set_extent_cache(cache):
+    """
+    Set the cache used to store rendered metadata extent images
+
+    A cache of None disables the caching.
+    """
+    global _extent_cache
+    _extent_cache = cache
+
+def get_extent_cache():
+    return _extent_cache
+
+_extent_cache = None
+
+def metadata_image(bboxes, mapfile):
+    """Create a metadata image"""
 
-    return image
+    return get_extent_renderer(mapfile).image(bboxes)
@@ -118,17 +118,62 @@ class MakoApp(object):
         
         kwargs = self.get_template_vars(environ, ctxt.title)
         kwargs.update(ctxt.tvars)
-    
-        output = template.render(**kwargs)
 
-        # run the rendered template through any filters
-        for filt in self.filters:
-            output = filt(output)
+        if ctxt.stream:
+            start_response(ctxt.status, ctxt.headers)
+            return stream_template(template, self.filters, **kwargs)
+
+        # use a previous rendering of the page if possible
+        cache = get_page_cache()
+        key = self.get_cache_key(environ, ctxt, template, kwargs)
+        output = None
+        if key is not None:
+            # the runtime differs for each request so is filled in later
+            kwargs['runtime'] = RUNTIME_MARKER
+            output = cache.get(key)
+
+        if output is None:
+            output = template.render(**kwargs)
+
+            # run the rendered template through any filters
+            for filt in self.filters:
+                output = filt(output)
+
+            if key is not None:
+                cache.set(key, output)
+
+        if key is not None:
+            output = output.replace(RUNTIME_MARKER, format_runtime(environ))
 
         # send the output to the client
         start_response(ctxt.status, ctxt.headers)
         return [output]
 
+    def get_cache_key(self, environ, ctxt, template, tvars):
+        """
+        Return the key identifying the rendered page in the page cache
+
+        None is returned if the page should not be cached. Only
+        successful responses with an Etag are cached, and not those
+        displaying messages to the user.
+        """
+        if get_page_cache() is None or ctxt.status != '200 OK':
+            return None
+
+        etags = [value for name, value in ctxt.headers if name.lower() == 'etag']
+        if not etags:
+            return None
+
+        if tvars['notices'] or tvars['warnings'] or tvars['errors']:
+            return None
+
+        cls = self.__class__
+        return '\n'.join(('%s.%s' % (cls.__module__, cls.__name__),
+                          template.uri,
+                          tvars['content_type'],
+                          etags[0],
+                          environ.request_uri()))
+
     def get_template(self, environ, path, expand=True):
         template_lookup = TemplateLookup(environ)
         lookup = template_lookup.lookup()
@@ -161,7 +206,7 @@ class MakoApp(object):
                     errors=environ['logging.handler'].errors(),
                     version=version,
                     year=date.today().year,
-                    runtime=environ['portal.timer'].runtime(),
+                    runtime=format_runtime(environ),
                     environ=environ)
 
         # Add some useful environment variables to the template
@@ -179,9 +224,129 @@ class MakoApp(object):
         vars.update(kwargs)
         return vars
 
+# stands in for the runtime in pages stored in the page cache
+RUNTIME_MARKER = '<!--portal:runtime-->'
+
+def format_runtime(environ):
+    """
+    Return the seconds taken so far to serve the request as text
+    """
+    return '%.2f' % environ['portal.timer'].runtime()
+
+def set_page_cache(cache):
+    """
+    Set the cache used for rendered pages
+
+    Setting the cache to None disables page caching.
+    """
+    global _page_cache
+    _page_cache = cache
+
+def get_page_cache():
+    return _page_cache
+
+_page_cache = None
+
+def stream_template(template, filters, chunk_size=8192, **kwargs):
+    """
+    Render a template, generating the output in chunks
+
+    The template is rendered in a separate thread so that the output
+    can be sent to the client while the template is still being
+    rendered. The output is buffered into chunks of around
+    `chunk_size` bytes and the filters are applied to each chunk. The
+    chunks end at whitespace or a tag delimiter so that the filters
+    see every word, such as an email address, in one piece. The
+    thread is started when the output is first iterated over and is
+    waited for when the output is closed.
+    """
+    from threading import Thread
+    from Queue import Queue, Full
+    from mako.runtime import Context, _kwargs_for_callable
+
+    queue = Queue(4)                    # bound the output held in memory
+    done = object()                     # signals the end of the output
+    state = {'cancelled': False}
+
+    class Cancelled(Exception):
+        pass
+
+    def put(item):
+        while True:
+            if state['cancelled']:
+                raise Cancelled()
+            try:
+                return queue.put(item, timeout=1)
+            except Full:
+                pass
+
+    class Buffer(object):
+        def __init__(self):
+            self.data = []
+            self.size = 0
+            self.limit = chunk_size
+
+        def write(self, text):
+            if isinstance(text, unicode):
+                text = text.encode('utf-8')
+            self.data.append(text)
+            self.size += len(text)
+            if self.size >= self.limit:
+                self.flush(False)
+
+        def flush(self, final=True):
+            text = ''.join(self.data)
+            held = ''
+            if not final:
+                # hold back the text after the last boundary
+                end = max([text.rfind(c) for c in ' \t\r\n<>']) + 1
+                text, held = text[:end], text[end:]
+
+            if text:
+                for filt in filters:
+                    text = filt(text)
+                put(text)
+            self.data = [held]
+            self.size = len(held)
+            self.limit = self.size + chunk_size
+
+    def render():
+        import sys
+
+        buf = Buffer()
+        try:
+            template.render_context(Context(buf, **kwargs),
+                                    **_kwargs_for_callable(template.callable_, kwargs))
+            buf.flush()
+            put(done)
+        except Cancelled:
+            pass
+        except:
+            try:
+                put(sys.exc_info())
+            except Cancelled:
+                pass
+
+    thread = Thread(target=render)
+    thread.daemon = True
+    thread.start()
+
+    try:
+        while True:
+            item = queue.get()
+            if item is done:
+                break
+            elif isinstance(item, tuple):
+                raise item[0], item[1], item[2]
+            yield item
+    finally:
+        state['cancelled'] = True   # the client has gone away
+        thread.join()               # it may be using the request's resources
+
 class TemplateContext(object):
-    def __init__(self, title, headers=None, tvars=None, status='200 OK'):
+    def __init__(self, title, headers=None, tvars=None, status='200 OK', stream=False):
         self.status = status
+        self.stream = stream            # render the template incrementally?
         if headers is None:
             # always check validation and always obey freshness information
             headers = [('Cache-Control', 'no-cache, must-revalidate')] 
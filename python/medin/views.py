@@ -67,6 +67,37 @@ def check_etag(environ, etag):
 
     return server_etag
 
+def check_fresh(environ, key, fetch):
+    """
+    Check a client Etag against the cached Etag data for a resource
+
+    This answers conditional requests without contacting the DWS. The
+    `key` identifies the resource and the cached data is the argument
+    last passed to check_etag() for it. A HTTPNotModified exception
+    is raised if the client Etag matches. Stale data is refreshed in
+    the background by calling `fetch`, which must therefore not use
+    any resources belonging to the request.
+    """
+    from medin.dws import get_freshness_cache
+
+    cache = get_freshness_cache()
+    if cache is None or 'HTTP_IF_NONE_MATCH' not in environ:
+        return
+
+    data = cache.peek(cache.key(key), fetch, environ['logging.logger'])
+    if data is not None:
+        check_etag(environ, data)
+
+def set_fresh(key, data):
+    """
+    Cache the Etag data for a resource for use by check_fresh()
+    """
+    from medin.dws import get_freshness_cache
+
+    cache = get_freshness_cache()
+    if cache is not None:
+        cache.set(cache.key(key), data)
+
 def get_metadata_date(environ, parser):
     """
     Return the metadata date as a string
@@ -89,6 +120,9 @@ def get_query(environ, from_referrer=False):
     The query is obtained from the environ QUERY_STRING variable by
     default or the HTTP_REFERER query string if the from_referrer
     parameter is True.
+
+    The query is frozen and shared by everything handling the request
+    so it is only analysed once: it must be cloned to be modified.
     """
     from medin.query import Query
 
@@ -112,67 +146,46 @@ def get_query(environ, from_referrer=False):
             else:
                 qsl = ''
 
+    try:
+        queries = environ['portal.queries']
+    except KeyError:
+        queries = environ['portal.queries'] = {}
+
+    try:
+        return queries[qsl]
+    except KeyError:
+        pass
+
     fields = ('updated', 'originator', 'title')
-    return Query(qsl, get_areas(environ), fields, get_vocab(environ), get_db(environ))
+    query = queries[qsl] = Query(qsl, get_areas(environ), fields, get_vocab(environ), get_db(environ)).freeze()
+    return query
 
 def get_areas(environ):
     """
     Returns the area interface
 
-    Because this object references the thread sensitive sqlite
-    database this function returns an object which is unique to the
-    calling thread.
+    The interface uses the portal database connection belonging to
+    the request.
     """
-    from thread import get_ident
-
-    thread_id = get_ident()
-
-    global _areas
     try:
-        return _areas[thread_id]
-    except NameError:
-        _areas = {}
-        pass
+        return environ['portal.areas']
     except KeyError:
         pass
 
     from medin.spatial import Areas
 
-    areas = _areas[thread_id] = Areas(get_db(environ))
+    areas = environ['portal.areas'] = Areas(get_db(environ))
     return areas
 
 def get_vocab(environ):
     """
     Returns the vocabulary interface
-
-    Because this object references the thread sensitive sqlite
-    database this function returns an object which is unique to the
-    calling thread.
     """
     from medin.vocab import Vocabularies
-    from thread import get_ident
-
-    thread_id = get_ident()
-
-    global _vocab_engines
-    engine = None
-    try:
-        engine = _vocab_engines[thread_id]
-    except NameError:
-        _vocab_engines = {}
-        pass
-    except KeyError:
-        pass
-
-    if not engine:
-        from sqlalchemy import create_engine
-        import os.path
-
-        filepath = os.path.abspath(os.path.join(environ.root, 'data', 'vocabularies.sqlite'))
-        connstr = 'sqlite:///%s' % filepath
-        _vocab_engines[thread_id] = engine = create_engine(connstr)
+    from medin.db import get_engine
+    import os.path
 
-    return Vocabularies(engine)
+    return Vocabularies(get_engine(os.path.join(environ.root, 'data', 'vocabularies.sqlite')))
 
 import sqlite3
 class Connection(sqlite3.Connection):
@@ -180,6 +193,17 @@ class Connection(sqlite3.Connection):
     Attach portal specific queries to the connection
     """
 
+    def __init__(self, *args, **kwargs):
+        from medin.cache import file_memo
+
+        super(Connection, self).__init__(*args, **kwargs)
+
+        # the database may have been opened using a URI
+        cur = self.cursor()
+        cur.execute('PRAGMA database_list')
+        paths = dict([(row[1], row[2]) for row in cur])
+        self.memo = file_memo(paths.get('main'))
+
     def getDataHoldersFromIds(self, ids):
         sql = "SELECT name FROM data_holders WHERE id in (%s)" % ','.join('?' * len(ids))
         cur = self.cursor()
@@ -187,34 +211,26 @@ class Connection(sqlite3.Connection):
         return [row[0] for row in cur]
 
     def getDataHolders(self):
-        cur = self.cursor()
-        cur.execute('SELECT id,name FROM data_holders ORDER BY name')
-        return cur.fetchall()
+        from medin.cache import memoize
+
+        def query():
+            cur = self.cursor()
+            cur.execute('SELECT id,name FROM data_holders ORDER BY name')
+            return tuple(cur)
+
+        return memoize(self.memo, 'data_holders', query)
 
 def get_db(environ):
     """
     Returns the portal sqlite database object
 
-    The database object is unique to the calling thread to ensure
-    thread related problems such as database locking are avoided.
+    The connection is borrowed from a pool shared between threads and
+    is returned to it when the request has been served.
     """
-    from thread import get_ident
-
-    thread_id = get_ident()
-    global _dbs
-    try:
-        return _dbs[thread_id]
-    except NameError:
-        _dbs = {}
-        pass
-    except KeyError:
-        pass
-
     import os.path
     filepath = os.path.join(environ.root, 'data', 'portal.sqlite')
 
-    db = _dbs[thread_id] = sqlite3.connect(filepath, factory=Connection)
-    return db
+    return environ['portal.db-scope'].connection(filepath, Connection)
 
 def get_post(environ):
     """
@@ -225,6 +241,41 @@ def get_post(environ):
     fp = environ['wsgi.input']
     return FieldStorage(fp, environ=environ)
 
+def iter_csv(rows, chunk_size=8192):
+    """
+    Generate CSV output from an iterable of rows
+
+    Rows are serialised as they are produced and yielded in chunks of
+    around `chunk_size` bytes. This allows a CSV document to be used
+    as the body of a WSGI response without it being held in memory.
+    """
+    import csv
+
+    class Buffer(object):
+        def __init__(self):
+            self.data = []
+            self.size = 0
+
+        def write(self, data):
+            self.data.append(data)
+            self.size += len(data)
+
+        def pop(self):
+            data = ''.join(self.data)
+            self.data = []
+            self.size = 0
+            return data
+
+    buf = Buffer()
+    writer = csv.writer(buf)
+    for row in rows:
+        writer.writerow(row)
+        if buf.size >= chunk_size:
+            yield buf.pop()
+
+    if buf.size:
+        yield buf.pop()
+
 # Output filters that can be added to `templates.MakoApp.filters`
 import re
 class ObfuscateEmails(object):
@@ -369,6 +420,7 @@ class Search(MakoApp):
             for error in errors:
                 msg_error(environ, error)
 
+        q = q.clone()
         q.setCount(0)                   # we only need one result
 
         # Get the results in descending order so the result can be
@@ -379,20 +431,28 @@ class Search(MakoApp):
         # generate the soap caller
         return self.request.prepareCaller(q, RESULT_SIMPLE, environ['logging.logger'])
 
+    def getEtagData(self, response):
+        """
+        Return the id of the most recently updated record
+        """
+        try:
+            return list(response)[0]
+        except IndexError:
+            return 'none'
+
     def setup(self, environ):
+        from medin.dws import submit
+
         db = get_db(environ)
         vocab = get_vocab(environ)
 
-        # run the query
-        self.prepareSOAP(environ)
-        r = self.request()
+        # answer conditional requests from the last known result
+        caller = self.prepareSOAP(environ)
+        key = 'search:%s' % environ.get('QUERY_STRING', '')
+        check_fresh(environ, key, lambda: self.getEtagData(caller()))
 
-        # check the etag
-        try:
-            docid = list(r)[0]
-        except IndexError:
-            docid = 'none'
-        etag = check_etag(environ, docid)
+        # run the query in the background while the form is set up
+        result = submit(caller)
 
         areas = get_areas(environ)
         q = get_query(environ)
@@ -433,6 +493,12 @@ class Search(MakoApp):
         data_holders = db.getDataHolders()
         selected_data_holders = set([int(item[0]) for item in criteria['data_holders']])
 
+        # check the etag
+        r = result.result()
+        docid = self.getEtagData(r)
+        set_fresh(key, docid)
+        etag = check_etag(environ, docid)
+
         tvars=dict(search_term=search_term,
                    hits=r.hits,
                    criteria=criteria,
@@ -595,18 +661,43 @@ class ResultsRequest(object):
 
         return self.request.prepareCaller(q, self.result_type, environ['logging.logger'])
 
-    def __call__(self, environ):
-        self.prepareSOAP(environ)
-        r = self.request()
+    def __call__(self, environ, export=False):
+        """
+        Return the response and etag for the query
+
+        If `export` is True the response is a ResultPager iterating
+        over every result from the query start index onwards.
+        """
+        if export:
+            from medin.dws import ResultPager
+
+            self.prepareSOAP(environ) # log any errors in the query
+            r = ResultPager(self.request, get_query(environ), self.result_type, environ['logging.logger'])
+            timestamp = self.getEtagData(r) + ' %d-%d' % (r.start, r.end)
+        else:
+            # answer conditional requests from the last known result
+            caller = self.prepareSOAP(environ)
+            key = 'results:%s:%s' % (self.result_type, environ.get('QUERY_STRING', ''))
+            check_fresh(environ, key, lambda: self.getEtagData(caller()))
+
+            r = caller()
+            timestamp = self.getEtagData(r)
+            set_fresh(key, timestamp)
 
-        updated = r.lastModified()
-        timestamp = updated.strftime("%a, %d %b %Y %H:%M:%S GMT")
         etag = check_etag(environ, timestamp)
 
         return r, etag
 
+    def getEtagData(self, response):
+        """
+        Return the update time of the results
+        """
+        return response.lastModified().strftime("%a, %d %b %Y %H:%M:%S GMT")
+
 class Results(MakoApp):
 
+    exportable = True                   # can the whole result set be requested?
+
     def __init__(self, path, result_type, **kwargs):
         from medin.dws import SearchRequest
 
@@ -619,9 +710,10 @@ class Results(MakoApp):
         return self.request.prepareSOAP(environ)
 
     def setup(self, environ):
-        r, etag = self.request(environ);
-
         q = get_query(environ)
+        export = self.exportable and q.getExport()
+        r, etag = self.request(environ, export)
+
         nav = Navigation(r.hits, q)
         search_term = q.getSearchTerm(cast=False)
         tvars=dict(hits=r.hits,
@@ -636,8 +728,16 @@ class Results(MakoApp):
                    last_link = nav.getLastLink(),
                    first_link = nav.getFirstLink(),
                    current_page = nav.current_page,
-                   page_count = nav.page_count,
-                   results=list(r))
+                   page_count = nav.page_count)
+
+        if export:
+            # iterate over the results as the output is streamed
+            tvars.update(count = len(r),
+                         start_index = r.start,
+                         end_index = r.end,
+                         results = r)
+        else:
+            tvars['results'] = list(r)
 
         title = 'Results'
 
@@ -654,9 +754,12 @@ class Results(MakoApp):
         headers = [('Etag', etag), # propagate the result update time to the HTTP layer
                    ('Cache-Control', 'no-cache, must-revalidate')] # add the cache controls
 
-        return TemplateContext(title, tvars=tvars, headers=headers)
+        return TemplateContext(title, tvars=tvars, headers=headers, stream=export)
 
 class HTMLResults(Results):
+
+    exportable = False
+
     def __init__(self):
         from medin.dws import RESULT_BRIEF
         super(HTMLResults, self).__init__(['%s', 'catalogue.html'], RESULT_BRIEF)
@@ -739,33 +842,29 @@ class CSVResults(Results):
     def prepareSOAP(self, environ):
         return self.request.prepareSOAP(environ)
 
-    def __call__(self, environ, start_response):
-        from cStringIO import StringIO
-        import csv
-
-        results, etag = self.request(environ)
-
-        buf = StringIO()
-        writer = csv.writer(buf)
-
-        writer.writerow([
-                'ID',
-                'Title',
-                'Updated',
-                'Authors',
-                'URL',
-                'Abstract',
-                'Originator',
-                'Resource type',
-                'Topic category',
-                'Lineage',
-                'Public access',
-                'Format',
-                'Parameters',
-                'West',
-                'East',
-                'South',
-                'North'])
+    def iterRows(self, results, environ):
+        """
+        Generate the CSV rows for the results
+        """
+
+        yield [
+            'ID',
+            'Title',
+            'Updated',
+            'Authors',
+            'URL',
+            'Abstract',
+            'Originator',
+            'Resource type',
+            'Topic category',
+            'Lineage',
+            'Public access',
+            'Format',
+            'Parameters',
+            'West',
+            'East',
+            'South',
+            'North']
         for result in results:
             url = "%s/full/catalogue/%s" % (environ.script_uri(), result['id'])
             row = [
@@ -800,8 +899,11 @@ class CSVResults(Results):
             else:
                 row.extend(['', '', '', ''])
 
-            writer.writerow(row)
-        buf.seek(0)
+            yield row
+
+    def __call__(self, environ, start_response):
+        export = get_query(environ).getExport()
+        results, etag = self.request(environ, export)
 
         headers = [('Etag', etag), # propagate the result update time to the HTTP layer
                    ('Cache-Control', 'no-cache, must-revalidate'), # add the cache controls
@@ -809,7 +911,7 @@ class CSVResults(Results):
                    ('Content-disposition', 'attachment; filename="results.csv"')]
 
         start_response('200 OK', headers)
-        return buf
+        return iter_csv(self.iterRows(results, environ))
 
 class AreaResults(object):
 
@@ -838,7 +940,7 @@ class AreaResults(object):
         if not aid:
             raise HTTPError('404 Not Found', 'The area name is not recognised: %s' % name)
 
-        q = get_query(environ)
+        q = get_query(environ).clone()
         q.setArea(aid)
         set_query(q, environ)
 
@@ -858,7 +960,7 @@ class ResultSummary(object):
         """
         from medin.dws import RESULT_SIMPLE
 
-        q = get_query(environ)
+        q = get_query(environ).clone()
         q.setCount(0)                   # we don't need any results
 
         return self.request.prepareCaller(q, RESULT_SIMPLE, environ['logging.logger'])
@@ -866,8 +968,7 @@ class ResultSummary(object):
     def __call__(self, environ, start_response):
         from json import dumps as tojson
 
-        self.prepareSOAP(environ)
-        r = self.request()
+        r = self.prepareSOAP(environ)()
 
         json = tojson({'status': bool(r),
                        'hits': r.hits,
@@ -902,6 +1003,9 @@ class ResultFormat(object):
 
 class Metadata(MakoApp):
 
+    # the metadata fields used by the view, or None for all of them
+    fields = None
+
     def __init__(self, path, **kwargs):
         from medin.dws import MedinMetadataRequest
 
@@ -918,19 +1022,50 @@ class Metadata(MakoApp):
 
         return self.request.prepareCaller(environ['logging.logger'], gid, areas, vocab)
 
-    def setup(self, environ, etag_data=''):
+    def checkFresh(self, environ, etag_data=''):
+        """
+        Answer a conditional request from the last known record date
+        """
+        gid = environ['selector.vars']['gid']
+
+        # the record date doesn't depend on the areas or vocabularies
+        caller = self.request.prepareCaller(environ['logging.logger'], gid, None, None)
+        def fetch():
+            parser = caller()
+            if not parser:
+                raise MetadataError('The metadata record does not exist: %s' % gid)
+            return str(parser.date()) + etag_data
+
+        key = 'metadata:%s:%s' % (gid, etag_data)
+        check_fresh(environ, key, fetch)
+        return key
 
-        self.prepareSOAP(environ)
-        parser = self.request()
+    def setup(self, environ, etag_data='', key=None):
+        """
+        Return the metadata parser and the response headers
+
+        `key` is the result of a previous call to checkFresh(), which
+        is otherwise called here.
+        """
+        if key is None:
+            key = self.checkFresh(environ, etag_data)
+        parser = self.prepareSOAP(environ)()
         if not parser:
             raise HTTPError('404 Not Found', 'The metadata record does not exist: %s' % environ['selector.vars']['gid'])
 
+        # parse the fields used by the view in a single pass
+        if self.fields is None:
+            parser.parse()
+        else:
+            parser.parse(('date',) + self.fields)
+
         # Check if the client needs a new version
         headers = []
         if parser:
             # check the etag, adding any extra data to the etag
             date = get_metadata_date(environ, parser)
             if date:
+                set_fresh(key, date+etag_data)
                 etag = check_etag(environ, date+etag_data)
                 headers.extend([('Etag', etag),
                                 ('Cache-Control', 'no-cache, must-revalidate')])
@@ -951,17 +1086,19 @@ class MetadataHTML(Metadata):
         self.filters.append(ObfuscateEmails()) # ensure emails are obfuscated when rendered
 
     def setup(self, environ):
-        from medin.dws import RESULT_SIMPLE
+        from medin.dws import RESULT_SIMPLE, submit
 
         q = get_query(environ, True)    # get the query from the HTTP referrer
         referrer_query_string = str(q)
+        key = self.checkFresh(environ, referrer_query_string) # before searching
+        criteria = q.asDict(False)
 
-        # call the base setup, using the referrer query string as etag data
-        parser, headers = super(MetadataHTML, self).setup(environ, referrer_query_string)
+        # get the hits for the referring search alongside the metadata
+        result = submit(self.search_request.prepareCaller(q, RESULT_SIMPLE, environ['logging.logger']))
 
-        criteria = q.asDict(False)
-        self.search_request.prepareCaller(q, RESULT_SIMPLE, environ['logging.logger'])
-        r = self.search_request()
+        # call the base setup, using the referrer query string as etag data
+        parser, headers = super(MetadataHTML, self).setup(environ, referrer_query_string, key)
+        r = result.result()
 
         if referrer_query_string: referrer_query_string = '?'+referrer_query_string
         metadata = parser.parse()
@@ -990,6 +1127,9 @@ class MetadataHTML(Metadata):
         return self.url_pattern.sub(lambda x: '<a href="%(url)s">%(url)s</a>' % dict(url=str(x.group())), text);
 
 class MetadataKML(Metadata):
+
+    fields = ('title', 'bboxes', 'author', 'abstract', 'unique_id')
+
     def __init__(self):
         super(MetadataKML, self).__init__(['kml', 'catalogue', 'metadata-%s.kml'],
                                           content_type='application/vnd.google-earth.kml+xml')
@@ -1056,6 +1196,30 @@ def background_raster(template_lookup, environ):
     _bg_raster = rasterpath
     return rasterpath
 
+def extent_mapfile(environ):
+    """
+    Return the mapfile used to render metadata extent images
+    """
+
+    global _extent_mapfile
+    try:
+        return _extent_mapfile
+    except NameError:
+        pass
+
+    import os.path
+
+    # ensure the background raster datasource has been created
+    template_lookup = TemplateLookup(environ)
+    lookup = template_lookup.lookup()
+    background_raster(lookup, environ)
+
+    # create the mapfile from its template
+    mappath = os.path.join('config', 'metadata-extent.xml')
+    template = lookup.get_template(mappath)
+    _extent_mapfile = template.render(root_dir=environ.root)
+    return _extent_mapfile
+
 class MetadataImage(object):
     """
     WSGI app for outputting a metadata image
@@ -1073,14 +1237,15 @@ class MetadataImage(object):
         return self.request.prepareCaller(environ['logging.logger'], gid, areas, vocab)
 
     def __call__(self, environ, start_response):
-        import os.path
         import medin.spatial
 
-        self.prepareSOAP(environ)
-        parser = self.request()
+        parser = self.prepareSOAP(environ)()
         if not parser:
             raise HTTPError('404 Not Found', 'The metadata record does not exist: %s' % environ['selector.vars']['gid'])
 
+        # only the date and bounding boxes are needed
+        parser.parse(('date', 'bboxes'))
+
         # Check if the client needs a new version
         headers = []
         date = get_metadata_date(environ, parser)
@@ -1093,21 +1258,9 @@ class MetadataImage(object):
         if not bboxes:
             raise HTTPError('404 Not Found', 'The metadata record does not have a geographic bounding box')
 
-        # ensure the background raster datasource has been created
-        template_lookup = TemplateLookup(environ)
-        lookup = template_lookup.lookup()
-        rasterpath = background_raster(lookup, environ)
-
-        # create the mapfile from its template
-        mappath = os.path.join('config', 'metadata-extent.xml')
-        template = lookup.get_template(mappath)
-        mapfile = template.render(root_dir=environ.root)
-
-        # create the image
-        image = medin.spatial.metadata_image(bboxes, mapfile)
-
-        # serialise the image
-        bytes = image.tostring('png')
+        # create the image, or retrieve it if it has been rendered
+        renderer = medin.spatial.get_extent_renderer(extent_mapfile(environ))
+        bytes = renderer(bboxes, medin.spatial.get_extent_cache())
 
         headers.append(('Content-Type', 'image/png'))
 
@@ -1132,16 +1285,14 @@ class MetadataXML(object):
         if fmt not in self.request.getMetadataFormats(environ['logging.logger']):
             raise HTTPError('404 Not Found', 'The metadata format is not supported: %s' % fmt)
 
-        self.gid = gid
-        self.fmt = fmt
         return self.request.prepareCaller(environ['logging.logger'], gid, fmt)
 
     def __call__(self, environ, start_response):
         from os.path import splitext
 
-        self.prepareSOAP(environ)
-        gid, fmt = self.gid, self.fmt
-        response = self.request()
+        response = self.prepareSOAP(environ)()
+        gid = environ['selector.vars']['gid']
+        fmt = environ['selector.vars']['format']
         if not response:
             raise HTTPError('404 Not Found', 'The metadata record does not exist: %s' % gid)
 
@@ -1167,6 +1318,82 @@ class MetadataXML(object):
         start_response('200 OK', headers)
         return [document]
 
+class MetadataBatchXML(object):
+    """
+    WSGI app for downloading several metadata records in XML format
+
+    The records are retrieved from the DWS in batches and returned as
+    children of a single root element.
+    """
+
+    max_records = 500                   # the most records per request
+
+    def __init__(self):
+        from medin.dws import MetadataRequest
+        self.request = MetadataRequest()
+
+        self.obfuscate_emails = ObfuscateEmails() # ensure emails are obfuscated when rendered
+
+    def getIds(self, environ):
+        gids = []
+        for gid in environ['selector.vars']['gids'].split(','):
+            if gid not in gids:
+                gids.append(gid)        # remove duplicates preserving the order
+        return gids
+
+    def prepareCallers(self, environ, batch_size=50):
+        gids = self.getIds(environ)
+        fmt = environ['selector.vars']['format'] # the requested format
+
+        if len(gids) > self.max_records:
+            raise HTTPError('400 Bad Request', 'No more than %d metadata records can be requested at once' % self.max_records)
+
+        if fmt not in self.request.getMetadataFormats(environ['logging.logger']):
+            raise HTTPError('404 Not Found', 'The metadata format is not supported: %s' % fmt)
+
+        return self.request.prepareBatchCallers(environ['logging.logger'], gids, fmt, batch_size)
+
+    def prepareSOAP(self, environ):
+        # represent the request as a single SOAP envelope
+        return self.prepareCallers(environ, self.max_records)[0]
+
+    def __call__(self, environ, start_response):
+        from hashlib import sha1
+        from medin.dws import call_all
+
+        responses = []
+        for batch in call_all(*self.prepareCallers(environ)):
+            responses.extend(batch)
+
+        if not responses:
+            raise HTTPError('404 Not Found', 'None of the metadata records exist: %s' % environ['selector.vars']['gids'])
+
+        # Check if the client needs a new version
+        headers = []
+        dates = [str(response.date) for response in responses if response.date]
+        if len(dates) == len(responses):
+            etag = check_etag(environ, sha1(','.join(dates)).hexdigest())
+            headers.extend([('Etag', etag),
+                            ('Cache-Control', 'no-cache, must-revalidate')])
+
+        # strip the XML declaration from each document
+        declaration = re.compile(r'^\s*<\?xml[^>]*\?>\s*')
+
+        documents = ['<?xml version="1.0" encoding="UTF-8"?>\n<records>\n']
+        for response in responses:
+            document = response.xml
+            if not document:
+                continue
+            documents.append(declaration.sub('', self.obfuscate_emails(document)))
+            documents.append('\n')
+        documents.append('</records>\n')
+
+        headers.extend([('Content-disposition', 'attachment; filename="metadata.xml"'),
+                        ('Content-Type', 'application/xml')])
+
+        start_response('200 OK', headers)
+        return documents
+
 class MetadataCSV(object):
     """
     WSGI app for downloading metadata in CSV format
@@ -1181,16 +1408,13 @@ class MetadataCSV(object):
         areas = get_areas(environ)
         vocab = get_vocab(environ)
 
-        self.gid = gid
         return self.request.prepareCaller(environ['logging.logger'], gid, areas, vocab)
 
     def __call__(self, environ, start_response):
-        from cStringIO import StringIO
-        from medin.metadata import metadata2csv
+        from medin.metadata import metadata2rows
 
-        self.prepareSOAP(environ)
-        gid = self.gid
-        parser = self.request()
+        parser = self.prepareSOAP(environ)()
+        gid = environ['selector.vars']['gid']
         if not parser:
             raise HTTPError('404 Not Found', 'The metadata record does not exist: %s' % gid)
 
@@ -1204,10 +1428,6 @@ class MetadataCSV(object):
 
         metadata = parser.parse()
 
-        buf = StringIO()
-        metadata2csv(metadata, buf)
-        buf.seek(0)                     # point to the start of the buffer
-
         if metadata.unique_id:
             filename = metadata.unique_id + '.csv'
         else:
@@ -1217,7 +1437,7 @@ class MetadataCSV(object):
                         ('Content-Type', 'application/vnd.ms-excel')])
 
         start_response('200 OK', headers)
-        return buf
+        return iter_csv(metadata2rows(metadata))
 
 class TemplateChoice(MakoApp):
     def __init__(self):
@@ -1344,6 +1564,39 @@ def get_bbox(environ, start_response):
     start_response('200 OK', headers)
     return [json]
 
+def get_intersecting(environ, start_response):
+    """
+    Return the areas intersecting the `bbox` query parameter as JSON
+
+    The `bbox` is specified as minx,miny,maxx,maxy and the areas can
+    be restricted to those of a `type` (e.g. ir for ICES rectangles).
+    """
+    from json import dumps as tojson
+    from medin.query import GETParams
+    from medin.spatial import Areas
+
+    params = GETParams(environ.get('QUERY_STRING', ''))
+    try:
+        bbox = [float(c) for c in params['bbox'][0].split(',')]
+    except (KeyError, ValueError):
+        bbox = []
+    if len(bbox) != 4:
+        raise HTTPError('400 Bad Request', 'A bbox must be specified as minx,miny,maxx,maxy')
+
+    try:
+        area_type = params['type'][0]
+    except KeyError:
+        area_type = None
+
+    areas = Areas(get_db(environ)).getIntersecting(bbox, area_type)
+    json = tojson([dict(id=id, name=name, type=type) for id, name, type in areas])
+
+    headers = [('Content-Type', 'application/json'),
+               ('Cache-Control', 'max-age=3600')]
+
+    start_response('200 OK', headers)
+    return [json]
+
 def proxy(environ, start_response):
     from medin.query import GETParams
 
@@ -24,30 +24,222 @@
 
 """
 An interface to the portal vocabularies
+
+The vocabularies are small and static, so the concepts and their
+relationships are read from the vocabulary database into an in memory
+graph which is shared by all threads. This is reloaded whenever the
+database changes.
 """
 
-import skos
-from sqlalchemy import create_engine, or_
-from sqlalchemy.orm import sessionmaker
 from collections import Mapping
 
+class ConceptGraph(object):
+    """
+    The concepts and collections in a vocabulary database
+
+    Each concept URI is interned to an integer id which indexes the
+    concept labels, definitions and relationships. The relationships
+    are stored as tuples of concept ids and collection membership as
+    sets of concept ids.
+    """
+
+    def __init__(self, conn):
+        self.uris = []                  # concept id -> URI
+        self.ids = {}                   # URI -> concept id
+        self.labels = []                # concept id -> prefLabel
+        self.definitions = []           # concept id -> definition
+
+        for uri, label, definition in conn.execute('SELECT uri, prefLabel, definition FROM concept'):
+            self.ids[uri] = len(self.uris)
+            self.uris.append(uri)
+            self.labels.append(label)
+            self.definitions.append(definition)
+
+        size = len(self.uris)
+        broader = [set() for i in xrange(size)]
+        narrower = [set() for i in xrange(size)]
+        related = [set() for i in xrange(size)]
+        synonyms = [set() for i in xrange(size)]
+
+        for broader_uri, narrower_uri in self.pairs(conn, 'SELECT broader_uri, narrower_uri FROM concept_broader'):
+            broader[narrower_uri].add(broader_uri)
+            narrower[broader_uri].add(narrower_uri)
+
+        for table, relations in (('concept_related', related), ('concept_synonyms', synonyms)):
+            for left, right in self.pairs(conn, 'SELECT left_uri, right_uri FROM %s' % table):
+                relations[left].add(right)
+                relations[right].add(left)
+
+        self.broader = [tuple(ids) for ids in broader]
+        self.narrower = [tuple(ids) for ids in narrower]
+        self.related = [tuple(ids) for ids in related]
+        self.synonyms = [tuple(ids) for ids in synonyms]
+
+        # the collections and their members
+        self.collections = {}           # collection URI -> set of concept ids
+        for (uri,) in conn.execute('SELECT uri FROM collection'):
+            self.collections[uri] = set()
+
+        for concept_uri, collection_uri in conn.execute('SELECT concept_uri, collection_uri FROM concepts2collections'):
+            try:
+                self.collections.setdefault(collection_uri, set()).add(self.ids[concept_uri])
+            except KeyError:
+                pass
+
+        for uri in self.collections.keys():
+            self.collections[uri] = frozenset(self.collections[uri])
+
+        # case insensitive prefLabel, URI and short id (the last URI
+        # segment) lookups within a collection
+        self.label_index = {}
+        self.uri_index = {}
+        self.short_id_index = {}
+        for uri, members in self.collections.iteritems():
+            for id_ in sorted(members):
+                concept_uri = self.uris[id_].lower()
+                self.label_index.setdefault((uri, self.labels[id_].lower()), id_)
+                self.uri_index.setdefault((uri, concept_uri), []).append(id_)
+                self.short_id_index.setdefault((uri, concept_uri.rsplit('/', 1)[-1]), []).append(id_)
+
+    def pairs(self, conn, sql):
+        """
+        Return the concept id pairs for a relationship
+        """
+        ids = self.ids
+        for left, right in conn.execute(sql):
+            try:
+                yield ids[left], ids[right]
+            except KeyError:
+                pass                    # the relationship is to an unknown concept
+
+    def members(self, collection_uri):
+        return self.collections.get(collection_uri, frozenset())
+
+    def associated(self, ids):
+        """
+        Return the ids of the concepts narrower than or related to `ids`
+        """
+        associated = set()
+        for id_ in ids:
+            associated.update(self.narrower[id_])
+            associated.update(self.related[id_])
+        return associated
+
+class Concept(object):
+    """
+    A concept in a ConceptGraph
+    """
+
+    __slots__ = ('graph', 'id')
+
+    def __init__(self, graph, id_):
+        self.graph = graph
+        self.id = id_
+
+    @property
+    def uri(self):
+        return self.graph.uris[self.id]
+
+    @property
+    def prefLabel(self):
+        return self.graph.labels[self.id]
+
+    @property
+    def definition(self):
+        return self.graph.definitions[self.id]
+
+    def _concepts(self, ids):
+        graph = self.graph
+        return dict([(graph.uris[id_], Concept(graph, id_)) for id_ in ids])
+
+    @property
+    def broader(self):
+        return self._concepts(self.graph.broader[self.id])
+
+    @property
+    def narrower(self):
+        return self._concepts(self.graph.narrower[self.id])
+
+    @property
+    def related(self):
+        return self._concepts(self.graph.related[self.id])
+
+    @property
+    def synonyms(self):
+        return self._concepts(self.graph.synonyms[self.id])
+
+    def __eq__(self, other):
+        return isinstance(other, Concept) and self.id == other.id and self.graph is other.graph
+
+    def __ne__(self, other):
+        return not self == other
+
+    def __hash__(self):
+        return self.id
+
+    def __repr__(self):
+        return '<Concept %s>' % self.uri
+
+class Collection(object):
+    """
+    A collection of concepts in a ConceptGraph
+    """
+
+    __slots__ = ('graph', 'uri')
+
+    def __init__(self, graph, uri):
+        self.graph = graph
+        self.uri = uri
+
+    @property
+    def members(self):
+        graph = self.graph
+        return dict([(graph.uris[id_], Concept(graph, id_)) for id_ in graph.members(self.uri)])
+
+    def __repr__(self):
+        return '<Collection %s>' % self.uri
+
+def get_graph(engine):
+    """
+    Return the ConceptGraph for a vocabulary database
+
+    The graph is memoized until the database file changes.
+    """
+    from medin.cache import file_memo, memoize
+
+    def load():
+        conn = engine.connect()
+        try:
+            return ConceptGraph(conn)
+        finally:
+            conn.close()
+
+    return memoize(file_memo(engine.url.database), 'graph', load)
+
 class Vocabularies(Mapping):
     def __init__(self, engine):
-        # get a session to the local database
-        Session = sessionmaker(bind=engine)
-        self.session = Session()
+        self.graph = get_graph(engine)
 
     def __getitem__(self, key):
-        obj = self.session.query(skos.Object).filter(skos.Object.uri == key).first()
-        if obj is None:
-            raise KeyError(key)
-        return obj
+        graph = self.graph
+        try:
+            return Concept(graph, graph.ids[key])
+        except KeyError:
+            pass
+
+        if key in graph.collections:
+            return Collection(graph, key)
+
+        raise KeyError(key)
 
     def __len__(self):
-        return self.session.query(skos.Object).count()
+        return len(self.graph.uris) + len(self.graph.collections)
 
     def __iter__(self):
-        return iter(self.session.query(skos.Object.uri))
+        for uri in self.graph.uris:
+            yield uri
+        for uri in self.graph.collections:
+            yield uri
 
     def getMatchingConcept(self, term, collection):
         """
@@ -56,10 +248,10 @@ class Vocabularies(Mapping):
         The match is case insensitive.
         """
 
-        return self.session.query(skos.Concept)\
-            .join(skos.Concept.collections)\
-            .filter(skos.Collection.uri == collection)\
-            .filter(skos.Concept.prefLabel.ilike(term)).first()
+        try:
+            return Concept(self.graph, self.graph.label_index[(collection, term.lower())])
+        except KeyError:
+            return None
 
     def getSubConcepts(self, source_collection, associated_members):
         """
@@ -67,36 +259,10 @@ class Vocabularies(Mapping):
         related member
         """
 
-        placeholder = ','.join('?' * len(associated_members))
-        sql = """SELECT o.*
-FROM object o,
-     concept c1,
-     concepts2collections c2c1,
-     concept_broader cb1
-WHERE o.uri = c1.uri
-AND c1.uri = c2c1.concept_uri
-AND c2c1.collection_uri = ?
-AND c1.uri = cb1.narrower_uri
-AND cb1.broader_uri IN (%s)
-UNION
-SELECT o.*
-FROM object o,
-     concept c1,
-     concepts2collections c2c1,
-     concept_related cr1
-WHERE o.uri = c1.uri
-AND c1.uri = c2c1.concept_uri
-AND c2c1.collection_uri = ?
-AND (c1.uri = cr1.left_uri OR c1.uri = cr1.right_uri)
-AND (cr1.right_uri IN (%s) OR cr1.left_uri IN (%s))""" % (placeholder, placeholder, placeholder)
-        conn = self.session.connection()
-        params = [source_collection]
-        params.extend(associated_members)
-        params.append(source_collection)
-        params.extend(associated_members * 2)
-        result = conn.execute(sql, params)
-        for concept in self.session.query(skos.Concept).instances(result):
-            yield concept
+        graph = self.graph
+        ids = [graph.ids[uri] for uri in associated_members if uri in graph.ids]
+        for id_ in graph.associated(ids) & graph.members(source_collection):
+            yield Concept(graph, id_)
 
     def getSubThemeIdsForDataThemeIds(self, data_theme_ids):
         ids = ['http://vocab.nerc.ac.uk/collection/P23/current/' + data_theme_id for data_theme_id in data_theme_ids]
@@ -119,22 +285,34 @@ AND (cr1.right_uri IN (%s) OR cr1.left_uri IN (%s))""" % (placeholder, placehold
         return self.getIdsFromConcepts(self['medin-access-types.xml'].members.values())
 
     def getAccessTypesFromIds(self, ids):
-        return self.getConceptsFromIds(ids, 'medin-access-types.xml', '%s')
+        return self.getConceptsFromIds(ids, 'medin-access-types.xml', False)
 
     def getMemberIdsFromCollection(self, uri):
         concepts = self[uri].members.values()
         concepts.sort(cmp=lambda a, b: cmp(a.prefLabel, b.prefLabel))
         return self.getIdsFromConcepts(concepts)
 
-    def getConceptsFromIds(self, ids, collection_uri, ilike='%%/%s'):
-        filt = or_()
+    def getConceptsFromIds(self, ids, collection_uri, short=True):
+        """
+        Retrieve the concepts in a collection matching the ids
+
+        The ids are matched case insensitively against the last
+        segment of the concept URIs or, if `short` is False, the whole
+        URI.
+        """
+
+        graph = self.graph
+        index = graph.short_id_index if short else graph.uri_index
+
+        concepts = []
+        seen = set()
         for id_ in ids:
-            filt.append(skos.Concept.uri.ilike(ilike % id_))
+            for concept_id in index.get((collection_uri, id_.lower()), ()):
+                if concept_id not in seen:
+                    seen.add(concept_id)
+                    concepts.append(Concept(graph, concept_id))
 
-        return self.session.query(skos.Concept)\
-            .join(skos.Concept.collections)\
-            .filter(skos.Collection.uri == collection_uri)\
-            .filter(filt).all()
+        return concepts
 
     def getDataThemesFromIds(self, ids):
         return self.getConceptsFromIds(ids, 'http://vocab.nerc.ac.uk/collection/P23/current')
@@ -152,81 +330,17 @@ AND (cr1.right_uri IN (%s) OR cr1.left_uri IN (%s))""" % (placeholder, placehold
         if not ids:
             return []
 
-        placeholder = ','.join('?' * len(ids))
-
-        sub_themes = """SELECT c1.uri
-      FROM concept c1,
-           concepts2collections c2c1,
-           concept_broader cb1
-      WHERE c1.uri = c2c1.concept_uri
-      AND c2c1.collection_uri = 'http://vocab.nerc.ac.uk/collection/P03/current'
-      AND c1.uri = cb1.narrower_uri
-      AND cb1.broader_uri IN (%s)
-
-      UNION
-
-      SELECT c1.uri
-      FROM concept c1,
-           concepts2collections c2c1,
-           concept_related cr1
-      WHERE c1.uri = c2c1.concept_uri
-      AND c2c1.collection_uri = 'http://vocab.nerc.ac.uk/collection/P03/current'
-      AND (c1.uri = cr1.left_uri OR c1.uri = cr1.right_uri)
-      AND (cr1.right_uri IN (%s) OR cr1.left_uri IN (%s))""" % (placeholder, placeholder, placeholder)
-
-        sql = """SELECT c1.prefLabel
-FROM concept c1,
-     concepts2collections c2c1,
-     concept_broader cb1,
-     (%s) AS sub_themes
-
-WHERE c1.uri = c2c1.concept_uri
-AND c2c1.collection_uri = 'http://vocab.nerc.ac.uk/collection/P02/current'
-AND c1.uri = cb1.narrower_uri
-AND cb1.broader_uri = sub_themes.uri
-
-UNION
-
-SELECT c1.prefLabel
-FROM concept c1,
-     concepts2collections c2c1,
-     concept_related cr1,
-     (%s) AS sub_themes
-
-WHERE c1.uri = c2c1.concept_uri
-AND c2c1.collection_uri = 'http://vocab.nerc.ac.uk/collection/P02/current'
-AND (c1.uri = cr1.left_uri OR c1.uri = cr1.right_uri)
-AND (cr1.right_uri = sub_themes.uri OR cr1.left_uri = sub_themes.uri)""" % (sub_themes, sub_themes)
-
-        conn = self.session.connection()
-        params = ['http://vocab.nerc.ac.uk/collection/P23/current/%s' % id_ for id_ in ids]
-        return [row[0] for row in conn.execute(sql, params * 6)]
+        graph = self.graph
+        themes = [graph.ids[uri] for uri in ['http://vocab.nerc.ac.uk/collection/P23/current/%s' % id_ for id_ in ids] if uri in graph.ids]
+        sub_themes = graph.associated(themes) & graph.members('http://vocab.nerc.ac.uk/collection/P03/current')
+        parameters = graph.associated(sub_themes) & graph.members('http://vocab.nerc.ac.uk/collection/P02/current')
+        return list(set([graph.labels[id_] for id_ in parameters]))
 
     def getParametersFromSubThemeIds(self, ids):
         if not ids:
             return []
 
-        placeholders = ','.join('?' * len(ids))
-        sql = """SELECT c1.prefLabel
-FROM concept c1,
-     concepts2collections c2c1,
-     concept_broader cb1
-WHERE c1.uri = c2c1.concept_uri
-AND c2c1.collection_uri = 'http://vocab.nerc.ac.uk/collection/P02/current'
-AND c1.uri = cb1.narrower_uri
-AND cb1.broader_uri IN (%s)
-
-UNION
-
-SELECT c1.prefLabel
-FROM concept c1,
-     concepts2collections c2c1,
-     concept_related cr1
-WHERE c1.uri = c2c1.concept_uri
-AND c2c1.collection_uri = 'http://vocab.nerc.ac.uk/collection/P02/current'
-AND (c1.uri = cr1.left_uri OR c1.uri = cr1.right_uri)
-AND (cr1.right_uri IN (%s) OR cr1.left_uri IN (%s));
-""" % (placeholders, placeholders, placeholders)
-        conn = self.session.connection()
-        params = ['http://vocab.nerc.ac.uk/collection/P03/current/%s' % id_ for id_ in ids]
-        return [row[0] for row in conn.execute(sql, params * 3)]
+        graph = self.graph
+        sub_themes = [graph.ids[uri] for uri in ['http://vocab.nerc.ac.uk/collection/P03/current/%s' % id_ for id_ in ids] if uri in graph.ids]
+        parameters = graph.associated(sub_themes) & graph.members('http://vocab.nerc.ac.uk/collection/P02/current')
+        return list(set([graph.labels[id_] for id_ in parameters]))
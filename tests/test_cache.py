@@ -0,0 +1,89 @@
+# Created by Homme Zwaagstra
+#
+# Copyright (c) 2014 GeoData Institute
+# http://www.geodata.soton.ac.uk
+# geodata@soton.ac.uk
+#
+# Unless explicitly acquired and licensed from Licensor under another
+# license, the contents of this file are subject to the Reciprocal
+# Public License ("RPL") Version 1.5, or subsequent versions as
+# allowed by the RPL, and You may not copy or use this file in either
+# source code or executable form, except in compliance with the terms
+# and conditions of the RPL.
+#
+# All software distributed under the RPL is provided strictly on an
+# "AS IS" basis, WITHOUT WARRANTY OF ANY KIND, EITHER EXPRESS OR
+# IMPLIED, AND LICENSOR HEREBY DISCLAIMS ALL SUCH WARRANTIES,
+# INCLUDING WITHOUT LIMITATION, ANY WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE, QUIET ENJOYMENT, OR
+# NON-INFRINGEMENT. See the RPL for specific language governing rights
+# and limitations under the RPL.
+#
+# You can obtain a full copy of the RPL from
+# http://opensource.org/licenses/rpl1.5.txt or geodata@soton.ac.uk
+
+"""
+Tests for the portal cache backends
+"""
+
+import unittest
+
+class LRUDictTest(unittest.TestCase):
+
+    def testOrder(self):
+        from medin.cache import LRUDict
+
+        entries = LRUDict()
+        for key in 'abc':
+            entries[key] = key.upper()
+        entries['a'] = 'A2'             # now the newest
+
+        self.assertEqual(len(entries), 3)
+        self.assertTrue('b' in entries)
+        self.assertEqual(entries['a'], 'A2')
+        self.assertEqual(entries.popitem(last=False), ('b', 'B'))
+        self.assertEqual(entries.popitem(), ('a', 'A2'))
+        self.assertEqual(entries.pop('c'), 'C')
+        self.assertEqual(entries.pop('c', None), None)
+        self.assertRaises(KeyError, entries.pop, 'c')
+        self.assertRaises(KeyError, entries.popitem)
+        self.assertEqual(len(entries), 0)
+
+class MemoryCacheTest(unittest.TestCase):
+
+    def testEviction(self):
+        from medin.cache import MemoryCache
+
+        cache = MemoryCache(max_entries=2)
+        cache.set('a', 1)
+        cache.set('b', 2)
+        self.assertEqual(cache.get('a'), 1) # 'b' is now the least recently used
+        cache.set('c', 3)
+
+        self.assertEqual(len(cache), 2)
+        self.assertEqual(cache.get('b'), None)
+        self.assertEqual(cache.get('a'), 1)
+        self.assertEqual(cache.get('c'), 3)
+
+    def testReplace(self):
+        from medin.cache import MemoryCache
+
+        cache = MemoryCache(max_entries=2)
+        cache.set('a', 1)
+        cache.set('a', 2)
+        self.assertEqual(len(cache), 1)
+        self.assertEqual(cache.get('a'), 2)
+
+        cache.delete('a')
+        self.assertEqual(cache.get('a'), None)
+        cache.delete('a')               # deleting a missing key is allowed
+
+    def testTimeout(self):
+        from medin.cache import MemoryCache
+
+        cache = MemoryCache(timeout=-1) # entries expire immediately
+        cache.set('a', 1)
+        self.assertEqual(cache.get('a'), None)
+
+if __name__ == '__main__':
+    unittest.main()
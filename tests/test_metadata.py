@@ -0,0 +1,201 @@
+# Created by Homme Zwaagstra
+#
+# Copyright (c) 2014 GeoData Institute
+# http://www.geodata.soton.ac.uk
+# geodata@soton.ac.uk
+#
+# Unless explicitly acquired and licensed from Licensor under another
+# license, the contents of this file are subject to the Reciprocal
+# Public License ("RPL") Version 1.5, or subsequent versions as
+# allowed by the RPL, and You may not copy or use this file in either
+# source code or executable form, except in compliance with the terms
+# and conditions of the RPL.
+#
+# All software distributed under the RPL is provided strictly on an
+# "AS IS" basis, WITHOUT WARRANTY OF ANY KIND, EITHER EXPRESS OR
+# IMPLIED, AND LICENSOR HEREBY DISCLAIMS ALL SUCH WARRANTIES,
+# INCLUDING WITHOUT LIMITATION, ANY WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE, QUIET ENJOYMENT, OR
+# NON-INFRINGEMENT. See the RPL for specific language governing rights
+# and limitations under the RPL.
+#
+# You can obtain a full copy of the RPL from
+# http://opensource.org/licenses/rpl1.5.txt or geodata@soton.ac.uk
+
+"""
+Tests for the parsing of MEDIN metadata records
+
+The StreamParser output is checked against a sample record in
+tests/data/metadata.xml and compared with the output of the libxml2
+Parser when the libxml2 Python bindings are installed.
+"""
+
+import os
+import unittest
+from datetime import date
+
+try:
+    import libxml2
+except ImportError:
+    libxml2 = None
+
+DATA = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data')
+
+class Vocabularies(object):
+    """No terms are recognised"""
+
+    def getMatchingConcept(self, term, collection):
+        return None
+
+class Areas(object):
+    """No areas are recognised"""
+
+    def getAreaId(self, name, type):
+        return None
+
+def get_document():
+    fh = open(os.path.join(DATA, 'metadata.xml'), 'rb')
+    try:
+        return fh.read()
+    finally:
+        fh.close()
+
+def normalise(value):
+    """
+    Convert a metadata value to builtin types that can be compared
+    """
+    from medin.metadata import Proxy, Contacts, Contact
+
+    if isinstance(value, Proxy):
+        return value.isoformat()
+    elif isinstance(value, Contacts):
+        return [normalise(contact) for contact in value]
+    elif isinstance(value, Contact):
+        attrs = [getattr(value, attr) for attr in ('organisation', 'name', 'position', 'address', 'tel', 'fax', 'email', 'url')]
+        roles = sorted([role.abbrv for role in value.roles])
+        children = sorted([normalise(contact) for contact in value.contacts])
+        return (attrs, roles, children)
+    elif isinstance(value, dict):
+        return dict([(k, normalise(v)) for k, v in value.iteritems()])
+    elif isinstance(value, (list, tuple)):
+        return [normalise(v) for v in value]
+    return value
+
+# the fields compared: the reference system is resolved from the EPSG
+# registry
+FIELDS = ('title', 'alt_titles', 'abstract', 'resource_type',
+          'online_resource', 'unique_id', 'resource_language',
+          'topic_category', 'service_type', 'keywords', 'bboxes',
+          'extents', 'vertical_extent', 'temporal_reference', 'lineage',
+          'spatial_resolution', 'additional_info', 'access_limits',
+          'access_conditions', 'responsible_party', 'data_format',
+          'update_frequency', 'date', 'name', 'version', 'language',
+          'parent_id', 'author')
+
+class StreamParserTest(unittest.TestCase):
+
+    def setUp(self):
+        from medin import metadata
+
+        self.cache = metadata.get_metadata_cache()
+        metadata.set_metadata_cache(None)
+
+    def tearDown(self):
+        from medin import metadata
+
+        metadata.set_metadata_cache(self.cache)
+
+    def getParser(self, cache_key=None):
+        from medin.metadata import StreamParser
+        return StreamParser('abc', get_document(), Areas(), Vocabularies(), cache_key)
+
+    def testFields(self):
+        m = self.getParser().parse(FIELDS)
+
+        self.assertEqual(m.uid, 'abc')
+        self.assertEqual(m.title, 'The Title')
+        self.assertEqual(m.alt_titles, ['Alt 1', 'Alt 2'])
+        self.assertEqual(m.abstract, 'An abstract')
+        self.assertEqual(m.unique_id, 'UID-1')
+        self.assertEqual(m.resource_language, 'English')
+        self.assertEqual(m.keywords, ['kw1', 'kw2'])
+        self.assertEqual(m.bboxes, [(-5.0, 50.0, 2.0, 55.5)])
+        self.assertEqual(m.extents, [{'id': None, 'name': 'North Sea', 'title': 'SeaDataNet Sea Areas'}])
+        self.assertEqual(m.vertical_extent, {'min-value': '0', 'max-value': '100', 'crs': 'urn:ogc:def:crs:EPSG::5715'})
+        self.assertEqual(normalise(m.temporal_reference), {'range': [date(2001, 2, 3), '2004'], 'single': [['creation', '2009-01']]})
+        self.assertEqual(m.lineage, 'Collected')
+        self.assertEqual(m.spatial_resolution, [{'distance': '10'}])
+        self.assertEqual(m.additional_info, 'More info')
+        self.assertEqual(m.access_conditions, ['Use freely'])
+        self.assertEqual(m.online_resource, [{'link': 'http://data.org/x', 'name': 'Download', 'description': None}])
+        self.assertEqual(m.update_frequency, 'Data is updated every year')
+        self.assertEqual(m.date, date(2010, 5, 4))
+        self.assertEqual(m.name, 'MEDIN')
+        self.assertEqual(m.version, '2.3')
+        self.assertEqual(m.language, 'eng')
+        self.assertEqual(m.parent_id, 'parent-1')
+        self.assertEqual(m.author, 'Org B')
+
+        organisations = sorted([contact.organisation for contact in m.responsible_party])
+        self.assertEqual(organisations, ['Org A', 'Org B'])
+
+    def testAccessors(self):
+        parser = self.getParser()
+        self.assertEqual(parser.title(), 'The Title')
+        self.assertEqual(parser.uniqueID(), 'UID-1')
+        self.assertEqual(parser.bboxes(), [(-5.0, 50.0, 2.0, 55.5)])
+        self.assertEqual(parser.date(), date(2010, 5, 4))
+
+    def testPartial(self):
+        parser = self.getParser()
+        m = parser.parse(['title'])
+        self.assertEqual(m.title, 'The Title')
+        self.assertEqual(m.abstract, None) # not yet parsed
+
+        m = parser.parse(['abstract'])
+        self.assertEqual(m.title, 'The Title')
+        self.assertEqual(m.abstract, 'An abstract')
+
+        self.assertRaises(ValueError, parser.parse, ['unknown'])
+
+    def testCache(self):
+        from medin import metadata
+        from medin.cache import MemoryCache
+
+        metadata.set_metadata_cache(MemoryCache())
+        self.getParser('key').parse(['title'])
+
+        # the cached fields are not parsed from the document again
+        parser = self.getParser('key')
+        parser.document = None
+        self.assertEqual(parser.title(), 'The Title')
+
+    def testParserSelection(self):
+        from medin import metadata
+
+        try:
+            metadata.set_parser('libxml2')
+            self.assertTrue(metadata.get_parser() is metadata.Parser)
+        finally:
+            metadata.set_parser('stream')
+        self.assertTrue(metadata.get_parser() is metadata.StreamParser)
+        self.assertRaises(ValueError, metadata.set_parser, 'unknown')
+
+@unittest.skipIf(libxml2 is None, 'the libxml2 Python bindings are not installed')
+class ParserComparisonTest(unittest.TestCase):
+    """
+    Compare the StreamParser with the libxml2 Parser
+    """
+
+    def testFields(self):
+        from medin.metadata import Parser, StreamParser
+
+        document = get_document()
+        expected = Parser('abc', document, Areas(), Vocabularies()).parse()
+        m = StreamParser('abc', document, Areas(), Vocabularies()).parse(FIELDS)
+
+        for field in FIELDS:
+            self.assertEqual(normalise(getattr(m, field)), normalise(getattr(expected, field)), field)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,182 @@
+# Created by Homme Zwaagstra
+#
+# Copyright (c) 2014 GeoData Institute
+# http://www.geodata.soton.ac.uk
+# geodata@soton.ac.uk
+#
+# Unless explicitly acquired and licensed from Licensor under another
+# license, the contents of this file are subject to the Reciprocal
+# Public License ("RPL") Version 1.5, or subsequent versions as
+# allowed by the RPL, and You may not copy or use this file in either
+# source code or executable form, except in compliance with the terms
+# and conditions of the RPL.
+#
+# All software distributed under the RPL is provided strictly on an
+# "AS IS" basis, WITHOUT WARRANTY OF ANY KIND, EITHER EXPRESS OR
+# IMPLIED, AND LICENSOR HEREBY DISCLAIMS ALL SUCH WARRANTIES,
+# INCLUDING WITHOUT LIMITATION, ANY WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE, QUIET ENJOYMENT, OR
+# NON-INFRINGEMENT. See the RPL for specific language governing rights
+# and limitations under the RPL.
+#
+# You can obtain a full copy of the RPL from
+# http://opensource.org/licenses/rpl1.5.txt or geodata@soton.ac.uk
+
+"""
+Tests for searching the local mirror of the DWS records
+"""
+
+import os
+import shutil
+import tempfile
+import unittest
+import logging
+
+class Vocabularies(object):
+    """No parameters are associated with the data themes"""
+
+    def getParametersFromDataThemeIds(self, ids):
+        return []
+
+class Areas(object):
+
+    def getBBOX(self, id):
+        return {'A1': (-4.0, 49.0, 9.0, 62.0)}.get(id)
+
+    def getAreaName(self, id):
+        return {'A1': 'North Sea'}.get(id)
+
+class Database(object):
+
+    def getDataHoldersFromIds(self, ids):
+        names = {'1': 'Org A', '2': 'Org B'}
+        return [names[id] for id in ids]
+
+# the records in the test mirror: the id, title, originator, update
+# date, temporal extent and bounding box
+RECORDS = [
+    ('r1', 'Sea water temperature', 'Org A', '2010-01-01 00:00:00.000000', ('2001-01-01', '2002-12-31'), (-5, 50, 2, 55)),
+    ('r2', 'Sand and gravel survey', 'Org B', '2011-01-01 00:00:00.000000', ('2005-01-01', '2006-12-31'), (20, 0, 30, 10)),
+    ('r3', 'Water quality', 'org c', '2009-01-01 00:00:00.000000', ('1990-01-01', '1999-12-31'), (0, 51, 1, 52))
+    ]
+
+class SearchIndexTest(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        import sqlite3
+        from medin.mirror import SCHEMA, TEXT_COLUMNS
+
+        cls.tmpdir = tempfile.mkdtemp()
+        cls.path = os.path.join(cls.tmpdir, 'mirror.sqlite')
+
+        conn = sqlite3.connect(cls.path)
+        for sql in SCHEMA:
+            conn.execute(sql)
+
+        for gid, title, originator, updated, temporal, bbox in RECORDS:
+            cur = conn.execute('INSERT INTO documents (gid, title, originator, updated, temporal_start, temporal_end) VALUES (?, ?, ?, ?, ?, ?)',
+                               (gid, title, originator, updated) + temporal)
+            doc_id = cur.lastrowid
+            values = dict(title=title, originator=originator)
+            conn.execute('INSERT INTO documents_fts (docid, %s) VALUES (?, %s)' % \
+                             (', '.join(TEXT_COLUMNS), ', '.join('?' * len(TEXT_COLUMNS))),
+                         [doc_id] + [values.get(column) for column in TEXT_COLUMNS])
+            conn.execute('INSERT INTO bboxes (document_id, minx, miny, maxx, maxy) VALUES (?, ?, ?, ?, ?)',
+                         (doc_id,) + bbox)
+        conn.commit()
+        conn.close()
+
+    @classmethod
+    def tearDownClass(cls):
+        shutil.rmtree(cls.tmpdir)
+
+    def prepare(self, qsl, result_type=None):
+        from medin.query import Query
+        from medin.mirror import SearchIndex
+        from medin.dws import RESULT_SIMPLE
+
+        if result_type is None:
+            result_type = RESULT_SIMPLE
+
+        query = Query(qsl, Areas(), ['updated', 'title', 'originator'], Vocabularies(), Database())
+        return SearchIndex(self.path).prepareCaller(query, result_type, logging.getLogger('test'))
+
+    def search(self, qsl):
+        return list(self.prepare(qsl)())
+
+    def testDefaults(self):
+        caller = self.prepare('')
+        self.assertEqual(caller.where, '1')
+        self.assertEqual(caller.params, [])
+        self.assertEqual(caller.order, 'updated DESC, id')
+        self.assertEqual((caller.count, caller.offset, caller.limit), (20, 0, 20))
+        self.assertEqual(self.search(''), ['r2', 'r1', 'r3'])
+
+    def testTerms(self):
+        match = 'id IN (SELECT docid FROM documents_fts WHERE %s MATCH ?)'
+
+        caller = self.prepare('q=water')
+        self.assertEqual(caller.where, match % 'documents_fts')
+        self.assertEqual(caller.params, ['"water"'])
+        self.assertEqual(self.search('q=water'), ['r1', 'r3'])
+
+        caller = self.prepare('q=water -temperature')
+        self.assertEqual(caller.where, '(%s AND NOT %s)' % (match % 'documents_fts', match % 'documents_fts'))
+        self.assertEqual(caller.params, ['"water"', '"temperature"'])
+        self.assertEqual(self.search('q=water -temperature'), ['r3'])
+
+        caller = self.prepare('q=sand OR o:"org c"')
+        self.assertEqual(caller.where, '(%s OR %s)' % (match % 'documents_fts', match % 'originator'))
+        self.assertEqual(caller.params, ['"sand"', '"org c"'])
+        self.assertEqual(self.search('q=sand OR o:"org c"'), ['r2', 'r3'])
+
+    def testDataHolders(self):
+        caller = self.prepare('dh=1&dh=2')
+        self.assertEqual(caller.where, 'id IN (SELECT docid FROM documents_fts WHERE originator MATCH ?)')
+        self.assertEqual(caller.params, ['"Org A" OR "Org B"'])
+        self.assertEqual(self.search('dh=1&dh=2'), ['r2', 'r1'])
+
+    def testSpatial(self):
+        caller = self.prepare('bbox=0.5,51.5,0.6,51.6')
+        self.assertEqual(caller.where, 'id IN (SELECT document_id FROM bboxes WHERE (minx <= ? AND maxx >= ? AND miny <= ? AND maxy >= ?))')
+        self.assertEqual(caller.params, [0.6, 0.5, 51.6, 51.5])
+        self.assertEqual(self.search('bbox=0.5,51.5,0.6,51.6'), ['r1', 'r3'])
+
+        # an area is searched using its extent
+        caller = self.prepare('a=A1')
+        self.assertEqual(caller.params, [9.0, -4.0, 62.0, 49.0])
+        self.assertEqual(self.search('a=A1'), ['r1', 'r3'])
+
+    def testTemporal(self):
+        caller = self.prepare('sd=2000-01-01&ed=2003-12-31')
+        self.assertEqual(caller.where, 'temporal_end >= ? AND temporal_start <= ?')
+        self.assertEqual(caller.params, ['2000-01-01', '2003-12-31'])
+        self.assertEqual(self.search('sd=2000-01-01&ed=2003-12-31'), ['r1'])
+
+    def testOrder(self):
+        self.assertEqual(self.prepare('s=title,1').order, 'title COLLATE NOCASE ASC, id')
+        self.assertEqual(self.search('s=title,1'), ['r2', 'r1', 'r3'])
+        self.assertEqual(self.search('s=originator,0'), ['r3', 'r2', 'r1'])
+
+    def testRange(self):
+        caller = self.prepare('c=1&i=2')
+        self.assertEqual((caller.count, caller.offset, caller.limit), (1, 1, 1))
+
+        response = caller()
+        self.assertEqual(list(response), ['r1'])
+        self.assertEqual(response.hits, 3)
+
+    def testSummary(self):
+        from medin.dws import RESULT_SUMMARY
+
+        documents = list(self.prepare('q=temperature', RESULT_SUMMARY)())
+        self.assertEqual(len(documents), 1)
+        document = documents[0]
+        self.assertEqual(document['id'], 'r1')
+        self.assertEqual(document['title'], 'Sea water temperature')
+        self.assertEqual(document['originator'], 'Org A')
+        self.assertEqual(document['bbox'], [[-5, 50, 2, 55]])
+
+if __name__ == '__main__':
+    unittest.main()
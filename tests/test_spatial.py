@@ -0,0 +1,221 @@
+# Created by Homme Zwaagstra
+#
+# Copyright (c) 2014 GeoData Institute
+# http://www.geodata.soton.ac.uk
+# geodata@soton.ac.uk
+#
+# Unless explicitly acquired and licensed from Licensor under another
+# license, the contents of this file are subject to the Reciprocal
+# Public License ("RPL") Version 1.5, or subsequent versions as
+# allowed by the RPL, and You may not copy or use this file in either
+# source code or executable form, except in compliance with the terms
+# and conditions of the RPL.
+#
+# All software distributed under the RPL is provided strictly on an
+# "AS IS" basis, WITHOUT WARRANTY OF ANY KIND, EITHER EXPRESS OR
+# IMPLIED, AND LICENSOR HEREBY DISCLAIMS ALL SUCH WARRANTIES,
+# INCLUDING WITHOUT LIMITATION, ANY WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE, QUIET ENJOYMENT, OR
+# NON-INFRINGEMENT. See the RPL for specific language governing rights
+# and limitations under the RPL.
+#
+# You can obtain a full copy of the RPL from
+# http://opensource.org/licenses/rpl1.5.txt or geodata@soton.ac.uk
+
+"""
+Tests for the area lookups and the serving of map tiles
+
+Run from the repository root with:
+
+    PYTHONPATH=./python python -m unittest discover -s tests
+"""
+
+import os
+import shutil
+import tempfile
+import unittest
+from cStringIO import StringIO
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+PNG = '\x89PNG\r\n\x1a\n' + 'tile data' * 10
+
+class AreasTest(unittest.TestCase):
+    """
+    Look up areas using the indexes created by index_areas()
+    """
+
+    def setUp(self):
+        import sqlite3
+        from medin.spatial import index_areas, Areas
+
+        db = sqlite3.connect(':memory:')
+        db.executescript('''
+CREATE TABLE areas (id, type, name, minx, miny, maxx, maxy);
+INSERT INTO areas VALUES ('ir1', 'ir', '49E0', 0, 49, 1, 49.5);
+INSERT INTO areas VALUES ('ir2', 'ir', '49E1', 1, 49, 2, 49.5);
+INSERT INTO areas VALUES ('sa1', 'sa', 'North Sea', -4, 49, 9, 62);
+INSERT INTO areas VALUES ('sa2', 'sa', 'Bering Sea', 162, 51, -157, 66);
+''')
+        index_areas(db)
+        self.areas = Areas(db)
+
+    def ids(self, *args):
+        return [row[0] for row in self.areas.getIntersecting(*args)]
+
+    def testIntersecting(self):
+        self.assertEqual(self.ids((0.5, 49.2, 0.6, 49.3)), ['ir1', 'sa1'])
+        self.assertEqual(self.ids((0.5, 49.2, 1.5, 49.3)), ['ir1', 'ir2', 'sa1'])
+        self.assertEqual(self.ids((0.5, 49.2, 1.5, 49.3), 'ir'), ['ir1', 'ir2'])
+        self.assertEqual(self.ids((20, 0, 30, 10)), [])
+
+    def testAntimeridian(self):
+        # areas crossing the antimeridian are found from either side
+        self.assertEqual(self.ids((170, 55, 175, 60)), ['sa2'])
+        self.assertEqual(self.ids((-170, 55, -165, 60)), ['sa2'])
+        self.assertEqual(self.ids((-150, 55, -140, 60)), [])
+
+        # as are areas intersecting a box crossing the antimeridian
+        self.assertEqual(self.ids((179, 55, -179, 60)), ['sa2'])
+        self.assertEqual(self.ids((179, 49.2, 0.5, 49.3)), ['ir1', 'sa1'])
+
+class TileResponseTest(unittest.TestCase):
+    """
+    Request a stored TMS tile through the portal WSGI application
+    """
+
+    @classmethod
+    def setUpClass(cls):
+        import medin
+        from medin import spatial, templates
+
+        # a portal root using the repository templates and data, with
+        # its own configuration and tile cache directory
+        cls.root = root = tempfile.mkdtemp()
+        for name in ('templates', 'data', 'html'):
+            os.symlink(os.path.join(ROOT, name), os.path.join(root, name))
+        os.mkdir(os.path.join(root, 'etc'))
+
+        tile_dir = os.path.join(root, 'tmp', 'bathymetry', '00', '000', '000', '000', '000', '000')
+        os.makedirs(tile_dir)
+        fh = open(os.path.join(tile_dir, '000.png'), 'wb')
+        try:
+            fh.write(PNG)
+        finally:
+            fh.close()
+
+        # discard any state belonging to another portal root
+        for obj, name in ((spatial, '_tilecache_service'),
+                          (templates.TemplateLookup, '_template_dir'),
+                          (templates.TemplateLookup, '_module_dir'),
+                          (templates.TemplateLookup, '_template_lookup')):
+            if hasattr(obj, name):
+                delattr(obj, name)
+
+        cls.app = medin.wsgi_app()
+
+    @classmethod
+    def tearDownClass(cls):
+        shutil.rmtree(cls.root)
+
+    def setUp(self):
+        import medin
+
+        # start each test from the example configuration
+        shutil.copy(os.path.join(ROOT, 'etc', 'portal.ini.example'),
+                    os.path.join(self.root, 'etc', 'portal.ini'))
+        if hasattr(medin, '_configs'):
+            del medin._configs
+
+    def request(self, path, **headers):
+        environ = {'REQUEST_METHOD': 'GET',
+                   'SCRIPT_NAME': '',
+                   'PATH_INFO': path,
+                   'QUERY_STRING': '',
+                   'SERVER_NAME': 'localhost',
+                   'SERVER_PORT': '80',
+                   'PORTAL_ROOT': self.root,
+                   'wsgi.url_scheme': 'http',
+                   'wsgi.input': StringIO(),
+                   'wsgi.errors': StringIO()}
+        environ.update(headers)
+
+        response = {}
+        def start_response(status, headers, exc_info=None):
+            response['status'] = status
+            response['headers'] = dict(headers)
+
+        result = self.app(environ, start_response)
+        try:
+            body = ''.join(result)
+        finally:
+            if hasattr(result, 'close'):
+                result.close()
+
+        return response['status'], response['headers'], body
+
+    def testTile(self):
+        status, headers, body = self.request('/spatial/tms/1.0.0/bathymetry/0/0/0.png')
+        self.assertEqual(status, '200 OK')
+        self.assertEqual(headers['Content-Type'], 'image/png')
+        self.assertEqual(headers['Content-Length'], str(len(PNG)))
+        self.assertTrue('public' in headers['Cache-Control'])
+        self.assertEqual(body, PNG)
+
+        etag = headers['Etag']
+        status, headers, body = self.request('/spatial/tms/1.0.0/bathymetry/0/0/0.png', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(status, '304 Not Modified')
+        self.assertEqual(body, '')
+
+    def testFileWrapper(self):
+        wrapped = []
+        class FileWrapper(object):
+            def __init__(self, fh, size):
+                wrapped.append(fh.name)
+                self.fh = fh
+            def __iter__(self):
+                return iter([self.fh.read()])
+            def close(self):
+                self.fh.close()
+
+        # the tile file is used every time, not a copy held in memory
+        for i in xrange(2):
+            status, headers, body = self.request('/spatial/tms/1.0.0/bathymetry/0/0/0.png',
+                                                 **{'wsgi.file_wrapper': FileWrapper})
+            self.assertEqual(status, '200 OK')
+            self.assertEqual(body, PNG)
+        self.assertEqual(len(wrapped), 2)
+
+    def setTiles(self, **options):
+        """
+        Set options in the [tiles] section of the portal configuration
+        """
+        from ConfigParser import SafeConfigParser
+
+        path = os.path.join(self.root, 'etc', 'portal.ini')
+        config = SafeConfigParser()
+        config.read([path])
+        for option, value in options.iteritems():
+            config.set('tiles', option, value)
+        fh = open(path, 'w')
+        try:
+            config.write(fh)
+        finally:
+            fh.close()
+
+    def testAccelRedirect(self):
+        self.setTiles(sendfile='x-accel-redirect', accel_prefix='/tile-cache/')
+        status, headers, body = self.request('/spatial/tms/1.0.0/bathymetry/0/0/0.png')
+        self.assertEqual(status, '200 OK')
+        self.assertEqual(headers['X-Accel-Redirect'], '/tile-cache/bathymetry/00/000/000/000/000/000/000.png')
+        self.assertEqual(body, '')
+
+    def testAccelWithoutPrefix(self):
+        self.setTiles(sendfile='x-accel-redirect')
+        status, headers, body = self.request('/spatial/tms/1.0.0/bathymetry/0/0/0.png')
+        self.assertEqual(status, '200 OK')
+        self.assertFalse('X-Accel-Redirect' in headers)
+        self.assertEqual(body, PNG)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,124 @@
+# Created by Homme Zwaagstra
+#
+# Copyright (c) 2014 GeoData Institute
+# http://www.geodata.soton.ac.uk
+# geodata@soton.ac.uk
+#
+# Unless explicitly acquired and licensed from Licensor under another
+# license, the contents of this file are subject to the Reciprocal
+# Public License ("RPL") Version 1.5, or subsequent versions as
+# allowed by the RPL, and You may not copy or use this file in either
+# source code or executable form, except in compliance with the terms
+# and conditions of the RPL.
+#
+# All software distributed under the RPL is provided strictly on an
+# "AS IS" basis, WITHOUT WARRANTY OF ANY KIND, EITHER EXPRESS OR
+# IMPLIED, AND LICENSOR HEREBY DISCLAIMS ALL SUCH WARRANTIES,
+# INCLUDING WITHOUT LIMITATION, ANY WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE, QUIET ENJOYMENT, OR
+# NON-INFRINGEMENT. See the RPL for specific language governing rights
+# and limitations under the RPL.
+#
+# You can obtain a full copy of the RPL from
+# http://opensource.org/licenses/rpl1.5.txt or geodata@soton.ac.uk
+
+"""
+Tests for the rendering of templates
+"""
+
+import unittest
+
+class StreamTemplateTest(unittest.TestCase):
+
+    def render(self, source, filters, chunk_size):
+        from mako.template import Template
+        from medin.templates import stream_template
+
+        return list(stream_template(Template(source), filters, chunk_size))
+
+    def testChunks(self):
+        source = '<p>${"x" * 20}</p>\n' * 10
+        chunks = self.render(source, [], 16)
+        self.assertEqual(''.join(chunks), source.replace('${"x" * 20}', 'x' * 20))
+        self.assertTrue(len(chunks) > 1)
+        for chunk in chunks[:-1]:
+            self.assertTrue(chunk[-1] in ' \t\r\n<>', chunk)
+
+    def testFilterAcrossChunks(self):
+        from medin.views import ObfuscateEmails
+
+        # the email address straddles the chunk size
+        source = '<p>Contact</p> ${"someone"}@${"example.com"} for details'
+        filt = ObfuscateEmails()
+        for chunk_size in xrange(1, len(source)):
+            output = ''.join(self.render(source, [filt], chunk_size))
+            self.assertFalse('someone' in output, chunk_size)
+            self.assertEqual(output, filt('<p>Contact</p> someone@example.com for details'))
+
+class Environ(dict):
+    """
+    The parts of the portal request environment used by MakoApp
+    """
+
+    def request_uri(self):
+        return 'http://localhost/page'
+
+    http_uri = script_uri = resource_uri = request_uri
+
+class Timer(object):
+
+    def __init__(self, runtime):
+        self.seconds = runtime
+
+    def runtime(self):
+        return self.seconds
+
+class Handler(object):
+
+    def notices(self):
+        return []
+
+    warnings = errors = notices
+
+class PageCacheTest(unittest.TestCase):
+
+    def setUp(self):
+        from mako.template import Template
+        from medin import templates
+        from medin.cache import MemoryCache
+
+        template = Template('<p>${content}</p><p>${runtime}</p>')
+
+        class Page(templates.MakoApp):
+            def get_template(self, environ, path, expand=True):
+                return template
+
+            def setup(self, environ):
+                return templates.TemplateContext('Page', headers=[('Etag', '"1"')],
+                                                 tvars=dict(content=environ['content']))
+
+        self.page_cache = templates.get_page_cache()
+        templates.set_page_cache(MemoryCache())
+        self.app = Page('page', check_etag=False, content_type='text/html')
+
+    def tearDown(self):
+        from medin import templates
+
+        templates.set_page_cache(self.page_cache)
+
+    def request(self, content, runtime):
+        environ = Environ({'content': content,
+                           'portal.timer': Timer(runtime),
+                           'logging.handler': Handler()})
+        def start_response(status, headers, exc_info=None):
+            self.assertEqual(status, '200 OK')
+        return ''.join(self.app(environ, start_response))
+
+    def testRuntime(self):
+        self.assertEqual(self.request('first', 1), '<p>first</p><p>1.00</p>')
+
+        # the page comes from the cache with the current runtime
+        self.assertEqual(self.request('second', 2.5), '<p>first</p><p>2.50</p>')
+
+if __name__ == '__main__':
+    unittest.main()